@@ -0,0 +1,67 @@
+'''
+augmentations.py
+
+Batched augmentations applied on the device after a batch is transferred, so that they cost a
+few tensor operations per batch instead of per-sample CPU work in the dataset.
+'''
+from glob import glob
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from PIL import Image
+
+from utils.logging_config import logger
+
+
+class RandomMaskAugmentation(nn.Module):
+    """ Occlude faces with random binary masks (e.g. the masks used by
+    scripts/generate_masked_training_dataset.py) on the fly.
+
+    All masks are loaded once into a [M, 1, H, W] buffer, so they are moved to the device with the
+    module. For a `mask_fraction` of the pairs in a batch, one image of the pair (chosen at random,
+    as InsightFaceBinaryImg.apply_mask does) is multiplied by a random mask; occluded pixels are set
+    to `fill_value` (-1 is black for images normalized with mean=std=0.5).
+
+    Args:
+        mask_pattern (str): glob pattern of the mask images (pixel values 0/1), e.g. '../datasets/face/masks/25/*'
+        mask_fraction (float): fraction of pairs to be masked.
+        image_size (list): [H, W] of the images; masks of another size are resized (nearest).
+        input_key (str): key of the (img1s, img2s) pair in the data dictionary.
+    """
+    def __init__(self, mask_pattern, mask_fraction=0.5, image_size=(112, 112), fill_value=-1.0,
+                 input_key='data_input'):
+        super().__init__()
+        mask_paths = sorted(glob(mask_pattern))
+        if len(mask_paths) == 0:
+            raise FileNotFoundError(f'No mask matches {mask_pattern}')
+        masks = torch.from_numpy(np.stack([
+            (np.array(Image.open(path).convert('L')) > 0).astype(np.float32) for path in mask_paths
+        ])).unsqueeze(1)
+        if tuple(masks.shape[-2:]) != tuple(image_size):
+            masks = F.interpolate(masks, size=tuple(image_size), mode='nearest')
+        self.register_buffer('masks', masks)
+        self.mask_fraction = mask_fraction
+        self.fill_value = fill_value
+        self.input_key = input_key
+        logger.info(f'Loaded {len(mask_paths)} masks from {mask_pattern} for mask augmentation')
+
+    def forward(self, data):
+        if self.mask_fraction <= 0:
+            return data
+        img1s, img2s = data[self.input_key]
+        batch_size = img1s.shape[0]
+        device = img1s.device
+        is_masked = torch.rand(batch_size, device=device) < self.mask_fraction
+        mask_second = torch.randint(0, 2, (batch_size,), device=device).bool()
+        masks = self.masks[torch.randint(0, len(self.masks), (batch_size,), device=device)]
+
+        def occlude(imgs, selected):
+            keep = torch.where(selected.view(-1, 1, 1, 1), masks, torch.ones_like(masks))
+            return imgs * keep + self.fill_value * (1 - keep)
+
+        # Return a new dictionary instead of modifying the batch in place
+        data = dict(data)
+        data[self.input_key] = (occlude(img1s, is_masked & ~mask_second), occlude(img2s, is_masked & mask_second))
+        return data
@@ -1,7 +1,9 @@
 import numpy as np
+import torch
+import torch.multiprocessing
 from torch.utils.data import DataLoader
 from torch.utils.data.dataloader import default_collate
-from torch.utils.data.sampler import SubsetRandomSampler
+from torch.utils.data.sampler import Sampler, SubsetRandomSampler
 
 
 # Add this to initialize workers of dataloader to avoid fixed numpy random
@@ -11,12 +13,69 @@ def worker_init_fn(worker_id):
     np.random.seed(np.random.get_state()[1][0] + worker_id)
 
 
+class ResumableRandomSampler(Sampler):
+    """ Random sampler over `indices` whose order of an epoch is a function of (seed, epoch), so that
+    its position can be saved as a few integers and an interrupted epoch can be resumed at any sample.
+
+    Every iteration (i.e. every `iter(data_loader)`) goes through the next epoch's permutation.
+    After `load_state_dict`, the next iteration continues the saved epoch from `start_index`.
+    `len()` is always the full epoch length, so per-epoch averages stay correct for resumed epochs.
+    """
+    def __init__(self, indices, seed=None):
+        self.indices = np.asarray(indices)
+        # Drawn from the torch RNG like RandomSampler does, so it follows torch.manual_seed if set
+        self.seed = int(torch.empty((), dtype=torch.int64).random_().item()) if seed is None else seed
+        self.epoch = 0
+        self.start_index = 0
+        # Whether an iteration of self.epoch has started, i.e. the next iteration is of the next epoch
+        self._started = False
+
+    def permutation(self, epoch):
+        return self.indices[np.random.RandomState([self.seed % (1 << 32), epoch]).permutation(len(self.indices))]
+
+    def __iter__(self):
+        if self._started:
+            self.epoch += 1
+            self.start_index = 0
+        self._started = True
+        return iter(self.permutation(self.epoch)[self.start_index:].tolist())
+
+    def __len__(self):
+        return len(self.indices)
+
+    def state_dict(self, num_consumed=None):
+        """ State to resume from. If num_consumed (the number of samples of the ongoing epoch already used)
+        is given, the resumed run continues this epoch after them; otherwise it starts the next epoch. """
+        if num_consumed is not None:
+            return {'seed': self.seed, 'epoch': self.epoch, 'start_index': num_consumed}
+        return {'seed': self.seed, 'epoch': self.epoch + 1 if self._started else self.epoch, 'start_index': 0}
+
+    def load_state_dict(self, state_dict):
+        self.seed = state_dict['seed']
+        self.epoch = state_dict['epoch']
+        self.start_index = state_dict['start_index']
+        self._started = False
+
+
 class BaseDataLoader(DataLoader):
     """
     Base class for all data loaders
+
+    Besides the basic arguments, the following DataLoader settings could be given in the "args"
+    of a data loader config:
+        pin_memory (bool): put batches in page-locked memory for faster (non-blocking) copies to GPU.
+        persistent_workers (bool): keep worker processes (and the datasets loaded in them) alive
+            across epochs instead of re-creating them every epoch.
+        prefetch_factor (int): number of batches loaded in advance by each worker.
+        multiprocessing_context (str): 'fork', 'spawn' or 'forkserver'.
+        sharing_strategy (str): tensor sharing strategy of torch.multiprocessing, e.g. 'file_system'
+            when too many file descriptors are opened by 'file_descriptor'. Note that it is global.
+    The worker-related settings only take effect when num_workers > 0.
     """
 
-    def __init__(self, dataset, batch_size, shuffle, validation_split, num_workers, collate_fn=default_collate):
+    def __init__(self, dataset, batch_size, shuffle, validation_split, num_workers, collate_fn=default_collate,
+                 pin_memory=False, persistent_workers=False, prefetch_factor=None,
+                 multiprocessing_context=None, sharing_strategy=None):
         self.validation_split = validation_split
         self.shuffle = shuffle
 
@@ -24,19 +83,38 @@ class BaseDataLoader(DataLoader):
         self.n_samples = len(dataset)
         self.sampler, self.valid_sampler = self._split_sampler(self.validation_split)
 
+        if sharing_strategy is not None:
+            self._set_sharing_strategy(sharing_strategy)
+
         self.init_kwargs = {
             'dataset': dataset,
             'batch_size': batch_size,
             'shuffle': self.shuffle,
             'collate_fn': collate_fn,
-            'num_workers': num_workers
+            'num_workers': num_workers,
+            'pin_memory': pin_memory,
+            'worker_init_fn': worker_init_fn
         }
-        super(BaseDataLoader, self).__init__(sampler=self.sampler, **self.init_kwargs,
-                                             worker_init_fn=worker_init_fn)
+        if num_workers > 0:
+            self.init_kwargs['persistent_workers'] = persistent_workers
+            if prefetch_factor is not None:
+                self.init_kwargs['prefetch_factor'] = prefetch_factor
+            if multiprocessing_context is not None:
+                self.init_kwargs['multiprocessing_context'] = multiprocessing_context
+        super(BaseDataLoader, self).__init__(sampler=self.sampler, **self.init_kwargs)
+
+    def _set_sharing_strategy(self, sharing_strategy):
+        if sharing_strategy not in torch.multiprocessing.get_all_sharing_strategies():
+            raise ValueError(f'Sharing strategy {sharing_strategy} is not supported on this platform.')
+        torch.multiprocessing.set_sharing_strategy(sharing_strategy)
 
     def _split_sampler(self, split):
         if split == 0.0:
-            return None, None
+            if not self.shuffle:
+                return None, None
+            # Shuffle with a resumable sampler instead (shuffle is mutually exclusive with sampler)
+            self.shuffle = False
+            return ResumableRandomSampler(np.arange(self.n_samples)), None
 
         idx_full = np.arange(self.n_samples)
 
@@ -48,7 +126,7 @@ class BaseDataLoader(DataLoader):
         valid_idx = idx_full[0:len_valid]
         train_idx = np.delete(idx_full, np.arange(0, len_valid))
 
-        train_sampler = SubsetRandomSampler(train_idx)
+        train_sampler = ResumableRandomSampler(train_idx)
         valid_sampler = SubsetRandomSampler(valid_idx)
 
         # turn off shuffle option which is mutually exclusive with sampler
@@ -17,16 +17,19 @@ class FaceDataLoader(BaseDataLoader):
     """
     def __init__(self, data_dir, batch_size, shuffle=True, validation_split=0.0,
                  num_workers=1, name=None,
-                 norm_mean=(0.5, 0.5, 0.5), norm_std=(0.5, 0.5, 0.5)):
-        trsfm = transforms.Compose([
-            transforms.RandomHorizontalFlip(),
+                 norm_mean=(0.5, 0.5, 0.5), norm_std=(0.5, 0.5, 0.5),
+                 decoder='pil', decode_size=None, horizontal_flip=True, return_indices=False, **kwargs):
+        trsfm = transforms.Compose(([transforms.RandomHorizontalFlip()] if horizontal_flip else []) + [
             transforms.ToTensor(),
             transforms.Normalize(mean=norm_mean, std=norm_std)
         ])
         self.data_dir = data_dir
-        self.dataset = SiameseImageFolder(data_dir, trsfm)
+        self.horizontal_flip = horizontal_flip
+        # See data_loader/image_decoders.py for the decoder backends; decode_size (H, W) resizes every image to it
+        self.dataset = SiameseImageFolder(data_dir, trsfm, decoder=decoder, decode_size=decode_size,
+                                          return_indices=return_indices)
         self.name = self.__class__.__name__ if name is None else name
-        super().__init__(self.dataset, batch_size, shuffle, validation_split, num_workers)
+        super().__init__(self.dataset, batch_size, shuffle, validation_split, num_workers, **kwargs)
 
 
 class FaceBinDataLoader(BaseDataLoader):
@@ -37,7 +40,7 @@ class FaceBinDataLoader(BaseDataLoader):
     def __init__(self, data_dir, batch_size, shuffle=True, validation_split=0.0,
                  num_workers=1, name="lfw", nickname=None, mask_dir=None,
                  norm_mean=(0.5, 0.5, 0.5), norm_std=(0.5, 0.5, 0.5),
-                 use_bgr=True):
+                 use_bgr=True, **kwargs):
         if use_bgr:
             trsfm = transforms.Compose([
                 transforms.ToTensor()
@@ -51,7 +54,7 @@ class FaceBinDataLoader(BaseDataLoader):
         self.dataset = InsightFaceBinaryImg(data_dir, name, trsfm, mask_dir, use_bgr)
         self.name = self.__class__.__name__ if name is None else name
         self.name = nickname if nickname is not None else self.name
-        super().__init__(self.dataset, batch_size, shuffle, validation_split, num_workers)
+        super().__init__(self.dataset, batch_size, shuffle, validation_split, num_workers, **kwargs)
 
 
 class MnistDataLoader(BaseDataLoader):
@@ -61,7 +64,7 @@ class MnistDataLoader(BaseDataLoader):
     """
     def __init__(self, data_dir, batch_size, shuffle=True, validation_split=0.0,
                  num_workers=1, training=True, name=None,
-                 img_size=28, norm_mean=(0.1307,), norm_std=(0.3081,)):
+                 img_size=28, norm_mean=(0.1307,), norm_std=(0.3081,), **kwargs):
         trsfm = transforms.Compose([
             transforms.Scale(img_size),
             transforms.ToTensor(),
@@ -70,7 +73,7 @@ class MnistDataLoader(BaseDataLoader):
         self.data_dir = data_dir
         self.dataset = MnistDataset(self.data_dir, train=training, download=True, transform=trsfm)
         self.name = self.__class__.__name__ if name is None else name
-        super().__init__(self.dataset, batch_size, shuffle, validation_split, num_workers)
+        super().__init__(self.dataset, batch_size, shuffle, validation_split, num_workers, **kwargs)
 
 
 class MnistResultDataLoader(BaseDataLoader):
@@ -78,10 +81,10 @@ class MnistResultDataLoader(BaseDataLoader):
     Customized MNIST result data loader demo
     Returned data will be in dictionary
     """
-    def __init__(self, dataset_args, batch_size, num_workers=1, training=True, name=None):
+    def __init__(self, dataset_args, batch_size, num_workers=1, training=True, name=None, **kwargs):
         self.dataset = MnistResultDataset(**dataset_args)
         self.name = self.__class__.__name__ if name is None else name
-        super().__init__(self.dataset, batch_size, False, 0, num_workers)
+        super().__init__(self.dataset, batch_size, False, 0, num_workers, **kwargs)
 
 
 class ARFaceDataLoader(BaseDataLoader):
@@ -90,16 +93,18 @@ class ARFaceDataLoader(BaseDataLoader):
     Returned data will be in dictionary
     """
     def __init__(self, data_dir, batch_size, shuffle=True, validation_split=0.0,
-                 num_workers=1, name=None, norm_mean=(0.5, 0.5, 0.5), norm_std=(0.5, 0.5, 0.5)):
+                 num_workers=1, name=None, norm_mean=(0.5, 0.5, 0.5), norm_std=(0.5, 0.5, 0.5),
+                 cache_bytes=0, **kwargs):
         trsfm = transforms.Compose([
             transforms.Resize([112, 112]),
             transforms.ToTensor(),
             transforms.Normalize(mean=norm_mean, std=norm_std)
         ])
         self.data_dir = data_dir
-        self.dataset = ARFaceDataset(data_dir, trsfm)
+        # cache_bytes > 0 keeps decoded 112x112 faces in shared memory across workers and epochs
+        self.dataset = ARFaceDataset(data_dir, trsfm, cache_bytes=cache_bytes)
         self.name = self.__class__.__name__ if name is None else name
-        super().__init__(self.dataset, batch_size, shuffle, validation_split, num_workers)
+        super().__init__(self.dataset, batch_size, shuffle, validation_split, num_workers, **kwargs)
 
 
 class GeneGANDataLoader(BaseDataLoader):
@@ -109,13 +114,15 @@ class GeneGANDataLoader(BaseDataLoader):
     """
     def __init__(self, data_dir, batch_size, identity_txt, shuffle=True, validation_split=0.0,
                  num_workers=1, name=None,
-                 norm_mean=(0.5, 0.5, 0.5), norm_std=(0.5, 0.5, 0.5)):
+                 norm_mean=(0.5, 0.5, 0.5), norm_std=(0.5, 0.5, 0.5),
+                 decoder='pil', decode_size=None, **kwargs):
         trsfm = transforms.Compose([
             transforms.RandomHorizontalFlip(),
             transforms.ToTensor(),
             transforms.Normalize(mean=norm_mean, std=norm_std)
         ])
         self.data_dir = data_dir
-        self.dataset = GeneGANDataset(data_dir, identity_txt, trsfm)
+        # decode_size (H, W) resizes every image to it (see data_loader/image_decoders.py)
+        self.dataset = GeneGANDataset(data_dir, identity_txt, trsfm, decoder=decoder, decode_size=decode_size)
         self.name = self.__class__.__name__ if name is None else name
-        super().__init__(self.dataset, batch_size, shuffle, validation_split, num_workers)
+        super().__init__(self.dataset, batch_size, shuffle, validation_split, num_workers, **kwargs)
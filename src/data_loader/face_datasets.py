@@ -1,7 +1,9 @@
 import cv2
+import hashlib
 import os
 import os.path as op
 import warnings
+import zipfile
 from glob import glob
 import numpy as np
 import pandas as pd
@@ -13,12 +15,14 @@ from torchvision import transforms, datasets
 from torch.utils.data import Dataset
 from torch.utils.data.sampler import BatchSampler
 from torchvision.datasets import ImageFolder
-import random
 
 from PIL import ImageFile
 
 from utils.align import Alignment
 from utils.util_python import read_lines_into_list
+from .metadata import StringTable, LabelIndex, RelationCandidates
+from .image_cache import SharedImageCache
+from .image_decoders import build_image_decoder
 
 cos = nn.CosineSimilarity(dim=0, eps=1e-6)
 # ImageFile is useless?
@@ -126,14 +130,13 @@ class SiameseDFWImageFolder(Dataset):
             dataset_type,
             f"{dataset_type}_data_mask_matrix.txt",
         )
-        self.data_mask_matrix = np.loadtxt(matrix_txt_path)
         img_path_list_path = os.path.join(
             self.root, f"{dataset_type.capitalize()}_data_face_name.txt"
         )
-        self.img_path_list = read_lines_into_list(img_path_list_path)
-        self.img_label_list, self.name2label = self.img_path_to_label_list(
-            self.img_path_list
-        )
+        img_path_list = read_lines_into_list(img_path_list_path)
+        self.candidates = self.load_relation_candidates(matrix_txt_path, len(img_path_list))
+        self.img_label_list, self.name2label = self.img_path_to_label_list(img_path_list)
+        self.img_path_list = StringTable(img_path_list)
         self.transform = transform
         # ############################################
         # self.wFace_dataset = ImageFolder(imgs_folder_dir, transform)
@@ -161,18 +164,18 @@ class SiameseDFWImageFolder(Dataset):
         # Sample the 1-st image
         img1_path = os.path.join(self.root, self.img_path_list[idx])
         img1 = self.load_transformed_img_tensor(img1_path)
-        label1 = self.img_label_list[idx]
+        label1 = int(self.img_label_list[idx])
 
         # Sample the 2-nd image
         # is_the_same_id is a bool that determines whether returning one pair with the same identity.
         is_the_same_id = np.random.randint(0, 2)
         ############
-        img2_path = self.get_siamese_path(idx, is_the_same_id)
-        img2_path = os.path.join(self.root, img2_path)
+        siamese_idx = self.get_siamese_index(idx, is_the_same_id)
+        img2_path = os.path.join(self.root, self.img_path_list[siamese_idx])
         # print("In getitem, img2_path: ", img2_path)
         # print("In getitem, img1_path: ", img1_path)
         img2 = self.load_transformed_img_tensor(img2_path)
-        label2 = self.img_path_to_label(img2_path)
+        label2 = int(self.img_label_list[siamese_idx])
         ###################################
         # img1, label1 = self.train_data[index]  # , self.train_labels[index].item()
         # if target == 1:
@@ -191,23 +194,20 @@ class SiameseDFWImageFolder(Dataset):
     def __len__(self):
         return len(self.img_path_list)
 
+    @staticmethod
+    def img_path_to_name(path):
+        # path e.g. Training_data/Matthew_McConaughey/Matthew_McConaughey_h_002.jpg
+        # Assume that Imposter Impersonator is one unique identity
+        if "_I_" in path:
+            return path.split("/")[-1][:-8]
+        return path.split("/")[1]
+
     def img_path_to_label_list(self, path_list):
-        label_list = []
-        name_list = []
-        name2label = {}
-        for path in path_list:
-            # path e.g. Training_data/Matthew_McConaughey/Matthew_McConaughey_h_002.jpg
-            # Assume that Imposter Impersonator is one unique identity
-            if "_I_" in path:
-                name = path.split("/")[-1][:-8]
-            else:
-                name = path.split("/")[1]
-            if name not in name_list:
-                name_list.append(name)
-                name2label[name] = len(name_list) - 1
-            label = name2label[name]
-            label_list.append(label)
-        return label_list, name2label
+        """ Return the label array (labels are given in the order of first occurrence) and the name2label dict """
+        names = [self.img_path_to_name(path) for path in path_list]
+        label_list, unique_names = pd.factorize(pd.Series(names, dtype=object))
+        name2label = {name: label for label, name in enumerate(unique_names)}
+        return label_list.astype(np.int64), name2label
 
     def img_path_to_label(self, path):
         # path e.g. data/dfw/Training_data/Matthew_McConaughey/Matthew_McConaughey_h_003.jpg
@@ -231,43 +231,74 @@ class SiameseDFWImageFolder(Dataset):
             raise NotImplementedError
         return img
 
+    @staticmethod
+    def load_relation_candidates(matrix_txt_path, n_rows):
+        """
+        Convert the dense N x N data mask matrix (codes 0~4) into per-row candidate lists once
+        and cache them in a .npz file next to the matrix (or in the working directory if that
+        is not writable). The cache name contains a hash of the absolute path, size and mtime of
+        the matrix, so a changed matrix or another dataset root never reuses it. Unreadable
+        caches or caches without n_rows rows (one per image) are rebuilt.
+        """
+        stat = os.stat(matrix_txt_path)
+        key = f"{op.abspath(matrix_txt_path)}:{stat.st_size}:{stat.st_mtime_ns}"
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+        cache_name = f"{op.splitext(op.basename(matrix_txt_path))[0]}_candidates_{digest}.npz"
+        cache_paths = [op.join(op.dirname(matrix_txt_path), cache_name), cache_name]
+        for cache_path in cache_paths:
+            if not op.exists(cache_path):
+                continue
+            try:
+                candidates = RelationCandidates.load(cache_path)
+            except (OSError, EOFError, ValueError, KeyError, zipfile.BadZipFile) as e:
+                warnings.warn(f"Ignoring the unreadable relation cache {cache_path}: {e}")
+                continue
+            if len(candidates) == n_rows:
+                return candidates
+            warnings.warn(f"Ignoring the relation cache {cache_path} of {len(candidates)} rows "
+                          f"instead of {n_rows}")
+
+        candidates = RelationCandidates.from_text(matrix_txt_path, n_codes=4)
+        if len(candidates) != n_rows:
+            raise ValueError(f"{matrix_txt_path} has {len(candidates)} rows, but there are {n_rows} images")
+        for cache_path in cache_paths:
+            try:
+                candidates.save(cache_path)
+                break
+            except OSError:
+                continue
+        return candidates
+
     def get_siamese_path(self, idx, is_the_same_id):
+        return self.img_path_list[self.get_siamese_index(idx, is_the_same_id)]
+
+    def get_siamese_index(self, idx, is_the_same_id):
         """
         Input:
+            idx: index of the first image
+            is_the_same_id: whether to sample an image of the same identity
+        Relation codes in the data mask matrix: 1, 2 for the same identity, 3 for impersonators
+        and 4 for other identities.
         """
-        candidate = self.data_mask_matrix[idx]
-        positions = []
-        # print(">>>> Is the same", is_the_same_id)
         if is_the_same_id:
-            targets = [1, 2]
-            for target in targets:
-                pos = np.where(candidate == target)[0]
-                pos = list(pos)
-                # print(">>>> candidate=", candidate)
-                # print(">>>> pos= ", pos)
-                positions += pos
+            start, end = self.candidates.span(idx, 1, 2)
             # _I.jpg case (no identical id)
-            if len(positions) == 0:
-                pos3 = np.where(candidate == 3)[0]
-                pos3 = list(pos3)
-                positions += pos3
+            if start == end:
+                start, end = self.candidates.span(idx, 3)
         else:
-            pos3 = np.where(candidate == 3)[0]
-            pos4 = np.where(candidate == 4)[0]
-            pos3 = list(pos3)
-            pos4 = list(pos4)
-            # print(">>>> candidate=", candidate)
-            # print(">>>> pos3= ", pos3)
-            # print(">>>> pos4= ", pos4)
-            # _I.jpg case
-            if len(pos4) > 0:
-                pos4 = random.sample(pos4, max(len(pos3), 1))  # at least take 1 sample
-                positions += pos4
-            positions += pos3
-
-        assert len(positions) > 0
-        siamese_idx = random.choice(positions)
-        return self.img_path_list[siamese_idx]
+            start3, end3 = self.candidates.span(idx, 3)
+            start4, end4 = self.candidates.span(idx, 4)
+            n3, n4 = end3 - start3, end4 - start4
+            # Equivalent to choosing uniformly among all code-3 candidates plus a random subset of
+            # max(n3, 1) code-4 candidates (at least take 1 sample)
+            n4_kept = min(n4, max(n3, 1))
+            if np.random.randint(n3 + n4_kept) < n4_kept:
+                start, end = start4, end4
+            else:
+                start, end = start3, end3
+
+        assert end > start
+        return self.candidates.indices[start + np.random.randint(end - start)]
 
 
 class SiameseImageFolder(Dataset):
@@ -276,47 +307,60 @@ class SiameseImageFolder(Dataset):
     Test: Creates fixed pairs for testing
     """
 
-    def __init__(self, imgs_folder_dir, transform):
+    def __init__(self, imgs_folder_dir, transform, decoder='pil', decode_size=None, return_indices=False):
         print(">>> In SIFolder, imgfolderdir=", imgs_folder_dir)
         self.root = imgs_folder_dir
-        self.wFace_dataset = ImageFolder(imgs_folder_dir, transform)
-        print("typeWFace", type(self.wFace_dataset))
-        self.class_num = len(self.wFace_dataset.classes)
+        self.transform = transform
+        # Also return the indices of the pair, e.g. to look up cached teacher outputs for distillation
+        self.return_indices = return_indices
+        self.decoder = build_image_decoder(decoder, decode_size)
+        # Same sample order/labels as ImageFolder, but kept in flat arrays instead of a list of tuples
+        self.classes, img_paths, labels = self._scan_image_folder(imgs_folder_dir)
+        self.class_num = len(self.classes)
         print(">>> self.class_num = ", self.class_num)
-        print("typeWFaceTarget", type(self.wFace_dataset.targets))
-        print("typeWFaceTarget[last]", self.wFace_dataset.targets[-1])
-        self.train_labels = np.array(self.wFace_dataset.targets, dtype=int)
-        print("Type Train_lables", type(self.train_labels))
+        self.img_paths = StringTable(img_paths)
+        self.label_index = LabelIndex(labels)
+        self.train_labels = self.label_index.labels
         print("Num Train_lables", len(self.train_labels))
-        print(">>> self.train_labels:", self.train_labels[1000:1010])
-
-        self.train_data = self.wFace_dataset
-
-        self.labels_set = set(self.train_labels)
-        self.label_to_indices = {
-            label: np.where(self.train_labels == label)[0] for label in self.labels_set
-        }
         print(">>> Init SiameseImageFolder done!")
 
+    @staticmethod
+    def _scan_image_folder(root):
+        classes = sorted(entry.name for entry in os.scandir(root) if entry.is_dir())
+        img_paths, labels = [], []
+        for label, class_name in enumerate(classes):
+            for dirpath, _, fnames in sorted(os.walk(op.join(root, class_name), followlinks=True)):
+                for fname in sorted(fnames):
+                    if datasets.folder.has_file_allowed_extension(fname, datasets.folder.IMG_EXTENSIONS):
+                        img_paths.append(op.relpath(op.join(dirpath, fname), root))
+                        labels.append(label)
+        return classes, img_paths, labels
+
+    def _load_sample(self, index):
+        img = self.decoder(op.join(self.root, self.img_paths[index]))
+        if self.transform is not None:
+            img = self.transform(img)
+        return img, int(self.train_labels[index])
+
     def __getitem__(self, index):
         """
         img1 = (feat_fc, feat_grid)
         """
         target = np.random.randint(0, 2)
-        img1, label1 = self.train_data[index]  # , self.train_labels[index].item()
+        img1, label1 = self._load_sample(index)
         if target == 1:
-            siamese_index = index
-            while siamese_index == index:
-                siamese_index = np.random.choice(self.label_to_indices[label1])
+            siamese_index = self.label_index.sample_same_label(index)
         else:
-            siamese_label = np.random.choice(list(self.labels_set - set([label1])))
-            siamese_index = np.random.choice(self.label_to_indices[siamese_label])
-        img2, label2 = self.train_data[siamese_index]
+            siamese_index = self.label_index.sample_other_label(index)
+        img2, label2 = self._load_sample(siamese_index)
 
-        return {"data_input": (img1, img2), "targeted_id_labels": (label1, label2)}
+        data = {"data_input": (img1, img2), "targeted_id_labels": (label1, label2)}
+        if self.return_indices:
+            data["sample_indices"] = (index, int(siamese_index))
+        return data
 
     def __len__(self):
-        return len(self.wFace_dataset)
+        return len(self.img_paths)
 
 
 class SiameseWholeFace(Dataset):
@@ -981,7 +1025,7 @@ class IJBVerificationPathDataset(Dataset):
         else:
             raise NotImplementedError
         col_name = ["TEMPLATE_ID1", "TEMPLATE_ID2", "IS_SAME"]
-        self.match = pd.read_csv(
+        match = pd.read_csv(
             match_filename,
             delim_whitespace=True,
             header=None,
@@ -990,29 +1034,34 @@ class IJBVerificationPathDataset(Dataset):
         )
 
         if leave_ratio < 1.0:  # shrink the number of verified pairs
-            indice = np.arange(len(self.match))
+            indice = np.arange(len(match))
             np.random.seed(0)
             np.random.shuffle(indice)
-            left_number = int(len(self.match) * leave_ratio)
-            self.match = self.match.iloc[indice[:left_number]]
+            left_number = int(len(match) * leave_ratio)
+            match = match.iloc[indice[:left_number]]
+
+        # Keep the (millions of) pairs in string tables instead of a DataFrame of python strings
+        self.template_ids1 = StringTable(match["TEMPLATE_ID1"])
+        self.template_ids2 = StringTable(match["TEMPLATE_ID2"])
+        self.is_same_list = StringTable(match["IS_SAME"])
 
     def __getitem__(self, idx):
         def path_suffixes(id_str):
             path = f"{id_str}.jpg"
             return [path]
 
-        id1 = self.match.iloc[idx]["TEMPLATE_ID1"]
-        id2 = self.match.iloc[idx]["TEMPLATE_ID2"]
+        id1 = self.template_ids1[idx]
+        id2 = self.template_ids2[idx]
         return {
             "enroll_template_id": id1,
             "verif_template_id": id2,
             "enroll_path_suffixes": path_suffixes(id1),
             "verif_path_suffixes": path_suffixes(id2),
-            "is_same": self.match.iloc[idx]["IS_SAME"],
+            "is_same": self.is_same_list[idx],
         }
 
     def __len__(self):
-        return len(self.match)
+        return len(self.template_ids1)
 
 
 class IJBCAllCroppedFacesDataset(Dataset):
@@ -1025,7 +1074,7 @@ class IJBCAllCroppedFacesDataset(Dataset):
         repeated faces that should not be computed again and again.
     """
 
-    def __init__(self, ijbc_data_root):
+    def __init__(self, ijbc_data_root, decoder="pil", decode_size=None):
         self.ijbc_data_root = ijbc_data_root
         self.transforms = transforms.Compose(
             [
@@ -1034,20 +1083,21 @@ class IJBCAllCroppedFacesDataset(Dataset):
                 transforms.Normalize([0.5, 0.5, 0.5], [0.5, 0.5, 0.5]),
             ]
         )
-        self.all_cropped_paths_img = sorted(
+        # decode_size=(112, 112) allows reduced-size JPEG decoding as faces are resized to 112x112
+        self.decoder = build_image_decoder(decoder, decode_size)
+        all_cropped_paths_img = sorted(
             glob(op.join(self.ijbc_data_root, "cropped_faces", "img", "*.jpg"))
         )
-        self.len_set1 = len(self.all_cropped_paths_img)
-        self.all_cropped_paths_frames = sorted(
+        self.len_set1 = len(all_cropped_paths_img)
+        all_cropped_paths_frames = sorted(
             glob(op.join(self.ijbc_data_root, "cropped_faces", "frames", "*.jpg"))
         )
+        # Paths of img/ followed by frames/
+        self.all_cropped_paths = StringTable(all_cropped_paths_img + all_cropped_paths_frames)
 
     def __getitem__(self, idx):
-        if idx < self.len_set1:
-            path = self.all_cropped_paths_img[idx]
-        else:
-            path = self.all_cropped_paths_frames[idx - self.len_set1]
-        img = Image.open(path).convert("RGB")
+        path = self.all_cropped_paths[idx]
+        img = self.decoder(path)
         tensor = self.transforms(img)
         return {
             "tensor": tensor,
@@ -1055,7 +1105,7 @@ class IJBCAllCroppedFacesDataset(Dataset):
         }
 
     def __len__(self):
-        return len(self.all_cropped_paths_frames) + len(self.all_cropped_paths_img)
+        return len(self.all_cropped_paths)
 
 
 class IJBCroppedFacesDataset(Dataset):
@@ -1089,26 +1139,20 @@ class IJBCroppedFacesDataset(Dataset):
         self.alignment = Alignment()
 
     def loadImgPathAndLandmarks(self, path):
+        """ Return image names as a StringTable (relative to self.img_dir) and landmarks as a [N, 5, 2] array """
         imgs_list = []
         landmarks_list = []
         with open(path) as img_list:
-            lines = img_list.readlines()
-            for line in lines:
+            for line in img_list:
                 name_lmk_score = line.strip().split(" ")
-                img_name = os.path.join(self.img_dir, name_lmk_score[0])
-                lmk = np.array(
-                    [float(x) for x in name_lmk_score[1:-1]], dtype=np.float32
-                )
-                lmk = lmk.reshape((5, 2))
+                imgs_list.append(name_lmk_score[0])
+                landmarks_list.append(name_lmk_score[1:-1])
 
-                imgs_list.append(img_name)
-                landmarks_list.append(lmk)
-
-        landmarks_list = np.array(landmarks_list)
-        return imgs_list, landmarks_list
+        landmarks_list = np.array(landmarks_list, dtype=np.float32).reshape((-1, 5, 2))
+        return StringTable(imgs_list), landmarks_list
 
     def __getitem__(self, idx):
-        img_path = self.imgs_list[idx]
+        img_path = os.path.join(self.img_dir, self.imgs_list[idx])
         landmark = self.landmarks_list[idx]
         img = cv2.imread(img_path)
         # XXX cv2.cvtColor(img, cv2.COLOR_BGR2RGB) in the align function
@@ -1149,6 +1193,8 @@ class IJBAVerificationDataset(Dataset):
         only_first_image=False,
         aligned_facial_3points=False,
         crop_face=True,
+        decoder="pil",
+        decode_size=None,
     ):
         self.ijba_data_root = ijba_data_root
         split_root = op.join(ijba_data_root, "IJB-A_11_sets", split_name)
@@ -1173,6 +1219,8 @@ class IJBAVerificationDataset(Dataset):
         self.aligned_facial_3points = aligned_facial_3points
         self.src_facial_3_points = self._get_source_facial_3points()
         self.crop_face = crop_face
+        # Face boxes are given in the original resolution, so never decode at a reduced size when cropping
+        self.decoder = build_image_decoder(decoder, None if crop_face else decode_size)
 
     def _get_source_facial_3points(self, output_size=(112, 112)):
         # set source landmarks based on 96x112 size
@@ -1196,7 +1244,7 @@ class IJBAVerificationDataset(Dataset):
         fname = entry["FILE"]
         if fname[:5] == "frame":
             fname = "frames" + fname[5:]  # to fix error in annotation =_=
-        img = Image.open(op.join(self.ijba_data_root, "images", fname)).convert("RGB")
+        img = self.decoder(op.join(self.ijba_data_root, "images", fname))
 
         if self.aligned_facial_3points:
             raise NotImplementedError
@@ -1243,14 +1291,21 @@ class IJBAVerificationDataset(Dataset):
         return len(self.comparisons)
 
 
+def load_resized_rgb_array(path, size=(112, 112)):
+    """ Decode an image and resize it as transforms.Resize does, returning a [H, W, 3] uint8 array """
+    image = Image.open(path).convert("RGB")
+    return np.asarray(image.resize((size[1], size[0]), Image.BILINEAR))
+
+
 class ARVerificationAllPathDataset(Dataset):
     "/tmp3/biolin/datasets/face/ARFace/test2"
 
     def __init__(
-        self, dataset_root="/tmp2/zhe2325138/dataset/ARFace/mtcnn_aligned_and_cropped/"
+        self, dataset_root="/tmp2/zhe2325138/dataset/ARFace/mtcnn_aligned_and_cropped/",
+        cache_bytes=0
     ):
         self.dataset_root = dataset_root
-        self.face_image_paths = sorted(glob(op.join(self.dataset_root, "*.png")))
+        self.face_image_paths = StringTable(sorted(glob(op.join(self.dataset_root, "*.png"))))
 
         self.transforms = transforms.Compose(
             [
@@ -1259,12 +1314,19 @@ class ARVerificationAllPathDataset(Dataset):
                 transforms.Normalize([0.5, 0.5, 0.5], [0.5, 0.5, 0.5]),
             ]
         )
+        # Decoded & resized faces are cached in shared memory if cache_bytes > 0
+        self.cache = None
+        if cache_bytes > 0:
+            self.cache = SharedImageCache(len(self.face_image_paths), (112, 112, 3), cache_bytes)
 
     def __getitem__(self, idx):
         fpath = self.face_image_paths[idx]
         fname, _ = op.splitext(op.basename(fpath))
 
-        image = Image.open(fpath)
+        if self.cache is not None:
+            image = Image.fromarray(self.cache.get_or_load(idx, lambda: load_resized_rgb_array(fpath)))
+        else:
+            image = Image.open(fpath)
         image_tensor = self.transforms(image)
         return {"image_tensor": image_tensor, "fname": fname}
 
@@ -1273,58 +1335,80 @@ class ARVerificationAllPathDataset(Dataset):
 
 
 class ARFaceDataset(Dataset):
-    def __init__(self, root_folder, transform=None):
+    """
+    Pairs of ARFace .bmp images. If cache_bytes > 0, images decoded and resized to cache_image_size
+    are kept in a shared-memory LRU cache, so that they are decoded only once across workers and
+    epochs (the transform should then expect images of cache_image_size).
+    """
+    def __init__(self, root_folder, transform=None, cache_bytes=0, cache_image_size=(112, 112)):
         self.root = root_folder
         self.transform = transform
         with os.scandir(root_folder) as it:
-            self.img_arr = pd.DataFrame([[entry.name, int(entry.name.split('-')[1])]
-                                         for entry in it if entry.name.endswith('.bmp')],
-                                        columns=['image_id', 'person_id'])
+            image_ids = [entry.name for entry in it if entry.name.endswith('.bmp')]
+        self.image_ids = StringTable(image_ids)
+        self.person_ids = np.array([int(name.split('-')[1]) for name in image_ids], dtype=np.int64)
+        _, person_labels = np.unique(self.person_ids, return_inverse=True)
+        self.label_index = LabelIndex(person_labels)
+        self.cache_image_size = tuple(cache_image_size)
+        self.cache = None
+        if cache_bytes > 0:
+            self.cache = SharedImageCache(len(self.image_ids), self.cache_image_size + (3,), cache_bytes)
+
+    def _load_image(self, index):
+        path = os.path.join(self.root, self.image_ids[index])
+        if self.cache is None:
+            return Image.open(path)
+        return Image.fromarray(
+            self.cache.get_or_load(index, lambda: load_resized_rgb_array(path, self.cache_image_size)))
 
     def __getitem__(self, index):
         target = np.random.randint(0, 2)  # 0: same person, 1: different person
-        row1 = self.img_arr.iloc[index]
         if target == 0:
-            row2 = self.img_arr[self.img_arr['person_id'] == row1['person_id']].sample().iloc[0]
+            index2 = self.label_index.sample_same_label(index, exclude_self=False)
         else:
-            row2 = self.img_arr[self.img_arr['person_id'] != row1['person_id']].sample().iloc[0]
+            index2 = self.label_index.sample_other_sample(index)
 
-        img1 = Image.open(os.path.join(self.root, row1['image_id']))
-        img2 = Image.open(os.path.join(self.root, row2['image_id']))
+        img1 = self._load_image(index)
+        img2 = self._load_image(index2)
         return {
             'data_input': (self.transform(img1), self.transform(img2)),
-            'is_same_labels': row1['person_id'] == row2['person_id'],
+            'is_same_labels': self.person_ids[index] == self.person_ids[index2],
             'index': index
         }
 
     def __len__(self):
-        return self.img_arr.shape[0]
+        return len(self.image_ids)
 
 
 class GeneGANDataset(Dataset):
-    def __init__(self, root_folder, identity_txt, transform=None):
+    def __init__(self, root_folder, identity_txt, transform=None, decoder='pil', decode_size=None):
         self.root = root_folder
-        self.img_arr = pd.read_csv(identity_txt, sep=' ', header=None)
-        self.img_arr.columns = ['image_id', 'person_id']
-        for name in self.img_arr['image_id']:
+        self.decoder = build_image_decoder(decoder, decode_size)
+        img_arr = pd.read_csv(identity_txt, sep=' ', header=None)
+        img_arr.columns = ['image_id', 'person_id']
+        for name in img_arr['image_id']:
             if not os.path.exists(os.path.join(self.root, name)):
                 raise FileNotFoundError(f'{os.path.join(self.root, name)} does not exists.')
+        self.image_ids = StringTable(img_arr['image_id'])
+        # Person ids may be strings, so only the unique ids are kept as objects
+        self.unique_person_ids, person_labels = np.unique(img_arr['person_id'].to_numpy(), return_inverse=True)
+        self.label_index = LabelIndex(person_labels)
         self.transform = transform
 
     def __getitem__(self, index):
         target = np.random.randint(0, 2)  # 0: same person, 1: different person
-        row1 = self.img_arr.iloc[index]
         if target == 0:
-            row2 = self.img_arr[self.img_arr['person_id'] == row1['person_id']].sample().iloc[0]
+            index2 = self.label_index.sample_same_label(index, exclude_self=False)
         else:
-            row2 = self.img_arr[self.img_arr['person_id'] != row1['person_id']].sample().iloc[0]
+            index2 = self.label_index.sample_other_sample(index)
 
-        img1 = Image.open(os.path.join(self.root, row1['image_id']))
-        img2 = Image.open(os.path.join(self.root, row2['image_id']))
+        img1 = self.decoder(os.path.join(self.root, self.image_ids[index]))
+        img2 = self.decoder(os.path.join(self.root, self.image_ids[index2]))
         return {
             'data_input': (self.transform(img1), self.transform(img2)),
-            'targeted_id_labels': (row1['person_id'], row2['person_id'])
+            'targeted_id_labels': (self.unique_person_ids[self.label_index.labels[index]],
+                                   self.unique_person_ids[self.label_index.labels[index2]])
         }
 
     def __len__(self):
-        return self.img_arr.shape[0]
+        return len(self.image_ids)
@@ -0,0 +1,100 @@
+'''
+image_cache.py
+
+Cache of decoded and resized uint8 images kept in shared memory, so that validation sets read
+again every epoch are decoded only once. The arena and the bookkeeping arrays are torch
+shared-memory tensors: images put by one DataLoader worker are visible to the other workers,
+to the main process, and to the workers of later epochs.
+'''
+import multiprocessing
+
+import numpy as np
+
+from .metadata import SharedArrays
+
+
+class SharedImageCache(SharedArrays):
+    """ LRU cache of fixed-shape uint8 images with a byte budget.
+
+    Keys are sample indices in [0, n_keys). The number of slots is max_bytes // image bytes
+    (at most n_keys); when all slots are used, the least recently used image is evicted.
+
+    Args:
+        n_keys (int): number of samples of the dataset.
+        image_shape (tuple): (H, W, C) of the cached images.
+        max_bytes (int): memory budget of the image arena.
+    """
+    _array_names = ('arena', 'key_to_slot', 'slot_to_key', 'slot_ticks', 'counters')
+    # Indices in self.counters
+    _CLOCK, _USED_SLOTS, _HITS, _MISSES, _EVICTIONS = range(5)
+
+    def __init__(self, n_keys, image_shape=(112, 112, 3), max_bytes=1 << 30):
+        self.image_shape = tuple(image_shape)
+        image_bytes = int(np.prod(self.image_shape))
+        n_slots = int(min(n_keys, max_bytes // image_bytes))
+        self.arena = np.zeros((n_slots,) + self.image_shape, dtype=np.uint8)
+        self.key_to_slot = np.full(n_keys, -1, dtype=np.int64)
+        self.slot_to_key = np.full(n_slots, -1, dtype=np.int64)
+        self.slot_ticks = np.zeros(n_slots, dtype=np.int64)
+        self.counters = np.zeros(5, dtype=np.int64)
+        self.lock = multiprocessing.Lock()
+        self.share_memory()
+
+    @property
+    def n_slots(self):
+        return len(self.slot_to_key)
+
+    @property
+    def stats(self):
+        return {
+            'used_slots': int(self.counters[self._USED_SLOTS]),
+            'hits': int(self.counters[self._HITS]),
+            'misses': int(self.counters[self._MISSES]),
+            'evictions': int(self.counters[self._EVICTIONS]),
+        }
+
+    def _tick(self, slot):
+        self.counters[self._CLOCK] += 1
+        self.slot_ticks[slot] = self.counters[self._CLOCK]
+
+    def get(self, key):
+        """ Return a copy of the cached image of `key`, or None if it is not cached """
+        if self.n_slots == 0:
+            return None
+        with self.lock:
+            slot = self.key_to_slot[key]
+            if slot < 0:
+                self.counters[self._MISSES] += 1
+                return None
+            self.counters[self._HITS] += 1
+            self._tick(slot)
+            return self.arena[slot].copy()
+
+    def put(self, key, image):
+        """ Cache `image` (uint8 array of image_shape) for `key`, evicting the LRU image if needed """
+        if self.n_slots == 0:
+            return
+        assert image.shape == self.image_shape and image.dtype == np.uint8, \
+            f'Expect a uint8 image of shape {self.image_shape}, got {image.dtype} {image.shape}'
+        with self.lock:
+            if self.key_to_slot[key] >= 0:  # put by another worker in the meantime
+                return
+            if self.counters[self._USED_SLOTS] < self.n_slots:
+                slot = self.counters[self._USED_SLOTS]
+                self.counters[self._USED_SLOTS] += 1
+            else:
+                slot = int(np.argmin(self.slot_ticks))
+                self.key_to_slot[self.slot_to_key[slot]] = -1
+                self.counters[self._EVICTIONS] += 1
+            self.arena[slot] = image
+            self.key_to_slot[key] = slot
+            self.slot_to_key[slot] = key
+            self._tick(slot)
+
+    def get_or_load(self, key, load_fn):
+        """ Return the cached image of `key`, or load it with `load_fn()` and cache it """
+        image = self.get(key)
+        if image is None:
+            image = load_fn()
+            self.put(key, image)
+        return image
@@ -0,0 +1,130 @@
+'''
+image_decoders.py
+
+Pluggable image decoding backends for datasets. Every decoder is a callable mapping an image
+path to an RGB PIL image, so it can replace torchvision's default_loader without changing the
+transforms of a data loader.
+
+Backends:
+    pil: PIL, the same as torchvision's default_loader.
+    pil_simd: PIL with the Pillow-SIMD build (a drop-in replacement of Pillow); a warning is
+        issued if the installed PIL is not Pillow-SIMD.
+    cv2: cv2.imdecode on raw bytes.
+    torchvision: torchvision.io.decode_jpeg on raw bytes (other formats use decode_image).
+
+If `target_size` (H, W) is given, every decoded image is resized to exactly `target_size`
+(like a Resize(target_size) transform), whatever its source size and format. JPEGs are then
+decoded at a reduced DCT scale (1/2, 1/4 or 1/8) as long as the decoded image is still no
+smaller than the target, which skips most of the IDCT work for large images. Reduced decoding
+is supported by the PIL backends (Image.draft) and cv2 (IMREAD_REDUCED_*); the torchvision
+decoder always decodes at full size.
+'''
+import io
+import warnings
+
+import cv2
+import numpy as np
+import torchvision.io
+from PIL import Image
+
+from utils.logging_config import logger
+
+JPEG_EXTENSIONS = ('.jpg', '.jpeg')
+CV2_REDUCED_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+
+def _is_jpeg(path):
+    return path.lower().endswith(JPEG_EXTENSIONS)
+
+
+def _reduction_factor(image_size, target_size):
+    """ Return the largest factor in (1, 2, 4, 8) keeping the (W, H) image_size no smaller than target_size (H, W) """
+    width, height = image_size
+    factor = 1
+    for candidate in (2, 4, 8):
+        if width // candidate >= target_size[1] and height // candidate >= target_size[0]:
+            factor = candidate
+    return factor
+
+
+class ImageDecoder():
+    """ Base class of image decoders. Subclasses implement `decode(path)` returning an RGB PIL image,
+    which may be decoded at a reduced scale if target_size is set; __call__ resizes it to target_size. """
+    def __init__(self, target_size=None):
+        self.target_size = tuple(target_size) if target_size is not None else None
+
+    def decode(self, path):
+        raise NotImplementedError
+
+    def __call__(self, path):
+        img = self.decode(path)
+        if self.target_size is not None and img.size != (self.target_size[1], self.target_size[0]):
+            img = img.resize((self.target_size[1], self.target_size[0]), Image.BILINEAR)
+        return img
+
+
+class PILDecoder(ImageDecoder):
+    def decode(self, path):
+        with open(path, 'rb') as f:
+            img = Image.open(f)
+            if self.target_size is not None and img.format == 'JPEG':
+                # draft() picks the smallest DCT scale whose result is no smaller than the requested size
+                img.draft('RGB', (self.target_size[1], self.target_size[0]))
+            return img.convert('RGB')
+
+
+class PILSIMDDecoder(PILDecoder):
+    def __init__(self, target_size=None):
+        super().__init__(target_size)
+        if '.post' not in Image.__version__:
+            warnings.warn(f'Pillow {Image.__version__} is not a Pillow-SIMD build, decoding is not accelerated.')
+
+
+class CV2Decoder(ImageDecoder):
+    def decode(self, path):
+        data = np.fromfile(path, dtype=np.uint8)
+        factor = 1
+        if self.target_size is not None and _is_jpeg(path):
+            # Only the header of the bytes in memory is parsed here to get the image size
+            with Image.open(io.BytesIO(data.tobytes())) as img:
+                factor = _reduction_factor(img.size, self.target_size)
+        img = cv2.imdecode(data, CV2_REDUCED_FLAGS[factor])
+        if img is None:
+            raise IOError(f'cv2 failed to decode {path}')
+        return Image.fromarray(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
+
+
+class TorchvisionDecoder(ImageDecoder):
+    def decode(self, path):
+        data = torchvision.io.read_file(path)
+        if _is_jpeg(path):
+            img = torchvision.io.decode_jpeg(data, mode=torchvision.io.ImageReadMode.RGB)
+        else:
+            img = torchvision.io.decode_image(data, mode=torchvision.io.ImageReadMode.RGB)
+        return Image.fromarray(img.permute(1, 2, 0).numpy())
+
+
+IMAGE_DECODERS = {
+    'pil': PILDecoder,
+    'pil_simd': PILSIMDDecoder,
+    'cv2': CV2Decoder,
+    'torchvision': TorchvisionDecoder,
+}
+
+
+def build_image_decoder(backend='pil', target_size=None):
+    """ Build the decoder of a backend name in IMAGE_DECODERS.
+    `target_size` (H, W) resizes every image to target_size and enables reduced-size decoding; leave
+    it None if the image will be cropped in the original resolution (e.g. by bounding boxes).
+    """
+    if backend not in IMAGE_DECODERS:
+        raise ValueError(f'Unknown image decoder {backend}, should be one of {list(IMAGE_DECODERS.keys())}')
+    if target_size is not None and backend == 'torchvision':
+        logger.warning('The torchvision decoder does not support reduced-size decoding; images are decoded '
+                       'at full size and then resized.')
+    return IMAGE_DECODERS[backend](target_size)
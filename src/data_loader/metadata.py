@@ -0,0 +1,217 @@
+'''
+metadata.py
+
+Compact per-sample metadata for datasets used with multi-worker DataLoaders.
+
+Python lists/dicts/DataFrames of per-sample objects are copied into every forked worker on
+access, because reading an object updates its reference count and thus writes to its memory
+page. The containers here keep everything in a few flat numpy arrays instead (strings in one
+uint8 buffer with offsets, labels in an int64 array with a CSR label -> indices index), so the
+pages stay shared among workers and the worker RSS does not grow with num_workers.
+Calling `share_memory()` moves the arrays into torch shared memory, so that they are shared
+instead of pickled when workers are started with the 'spawn'/'forkserver' contexts.
+'''
+import os
+
+import numpy as np
+import torch
+
+
+class SharedArrays():
+    """ Base class of containers made of the numpy arrays named in `_array_names` """
+    _array_names = ()
+
+    def share_memory(self):
+        """ Move the arrays into torch shared memory (in place) and return self """
+        self._shared_tensors = {}
+        for name in self._array_names:
+            tensor = torch.from_numpy(np.ascontiguousarray(getattr(self, name))).share_memory_()
+            self._shared_tensors[name] = tensor
+            setattr(self, name, tensor.numpy())
+        return self
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # Shared tensors are pickled as handles to the shared memory, the numpy views are rebuilt from them
+        if '_shared_tensors' in state:
+            for name in self._array_names:
+                del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        for name, tensor in state.get('_shared_tensors', {}).items():
+            setattr(self, name, tensor.numpy())
+
+
+class StringTable(SharedArrays):
+    """ An immutable list of strings stored as one uint8 buffer and int64 offsets.
+
+    Example:
+        >>> table = StringTable(['a/1.jpg', 'b/2.jpg'])
+        >>> table[1]
+        'b/2.jpg'
+    """
+    _array_names = ('buffer', 'offsets')
+
+    def __init__(self, strings):
+        encoded = [s.encode('utf-8') for s in strings]
+        self.offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(e) for e in encoded], out=self.offsets[1:])
+        self.buffer = np.frombuffer(b''.join(encoded), dtype=np.uint8).copy()
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(f'StringTable index {idx} out of range')
+        return self.buffer[self.offsets[idx]:self.offsets[idx + 1]].tobytes().decode('utf-8')
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+    @property
+    def nbytes(self):
+        return self.buffer.nbytes + self.offsets.nbytes
+
+
+class LabelIndex(SharedArrays):
+    """ Integer labels with a CSR-style label -> sample indices index.
+
+    Samples of label l are `indices[indptr[l]:indptr[l + 1]]`. All sampling functions are O(1)
+    and use np.random, which is re-seeded for each worker by `worker_init_fn`.
+
+    Args:
+        labels (array-like): non-negative integer label of each sample.
+    """
+    _array_names = ('labels', 'indptr', 'indices', 'positions', 'present_labels', 'present_rank')
+
+    def __init__(self, labels):
+        self.labels = np.asarray(labels, dtype=np.int64)
+        n_labels = int(self.labels.max()) + 1 if len(self.labels) > 0 else 0
+        counts = np.bincount(self.labels, minlength=n_labels)
+        self.indptr = np.zeros(n_labels + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.indptr[1:])
+        self.indices = np.argsort(self.labels, kind='stable').astype(np.int64)
+        # Position of each sample within the samples of its label
+        self.positions = np.empty(len(self.labels), dtype=np.int64)
+        self.positions[self.indices] = np.arange(len(self.labels)) - self.indptr[self.labels[self.indices]]
+        # Labels that have at least one sample, and the rank of each label among them
+        self.present_labels = np.nonzero(counts)[0].astype(np.int64)
+        self.present_rank = np.full(n_labels, -1, dtype=np.int64)
+        self.present_rank[self.present_labels] = np.arange(len(self.present_labels))
+
+    def __len__(self):
+        return len(self.labels)
+
+    @property
+    def n_labels(self):
+        return len(self.present_labels)
+
+    def indices_of(self, label):
+        return self.indices[self.indptr[label]:self.indptr[label + 1]]
+
+    def sample_same_label(self, index, exclude_self=True):
+        """ Return a random sample index with the same label as `index`.
+        If `index` is the only sample of its label, `index` itself is returned.
+        """
+        label = self.labels[index]
+        start, end = self.indptr[label], self.indptr[label + 1]
+        n = end - start
+        if not exclude_self:
+            return self.indices[start + np.random.randint(n)]
+        if n == 1:
+            return index
+        r = np.random.randint(n - 1)
+        if r >= self.positions[index]:
+            r += 1
+        return self.indices[start + r]
+
+    def sample_other_label(self, index):
+        """ Return a random sample index of a uniformly chosen label other than the label of `index` """
+        rank = self.present_rank[self.labels[index]]
+        r = np.random.randint(self.n_labels - 1)
+        if r >= rank:
+            r += 1
+        label = self.present_labels[r]
+        start, end = self.indptr[label], self.indptr[label + 1]
+        return self.indices[start + np.random.randint(end - start)]
+
+    def sample_other_sample(self, index):
+        """ Return a uniformly chosen sample index among all samples whose label differs from `index` """
+        label = self.labels[index]
+        start, end = self.indptr[label], self.indptr[label + 1]
+        r = np.random.randint(len(self.labels) - (end - start))
+        if r >= start:
+            r += end - start
+        return self.indices[r]
+
+
+class RelationCandidates(SharedArrays):
+    """ Sparse per-row candidate lists of a dense relation matrix with small integer codes.
+
+    Column indices of row r with code c (1 <= c <= n_codes) are
+    `indices[indptr[r * n_codes + c - 1]:indptr[r * n_codes + c]]`, so candidates of consecutive
+    codes (e.g. 1 and 2) of a row are also contiguous. Code 0 means "no relation" and is not stored.
+    """
+    _array_names = ('indptr', 'indices')
+
+    def __init__(self, indptr, indices, n_codes):
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int32)
+        self.n_codes = int(n_codes)
+
+    @classmethod
+    def from_text(cls, matrix_txt_path, n_codes=4):
+        """ Parse a whitespace-separated dense matrix line by line, without holding the whole matrix """
+        counts, indices = [], []
+        with open(matrix_txt_path) as fin:
+            for line in fin:
+                if not line.strip():
+                    continue
+                row = np.array(line.split(), dtype=np.float32).astype(np.int8)
+                for code in range(1, n_codes + 1):
+                    columns = np.nonzero(row == code)[0].astype(np.int32)
+                    counts.append(len(columns))
+                    indices.append(columns)
+        indptr = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=indptr[1:])
+        indices = np.concatenate(indices) if len(indices) > 0 else np.zeros(0, dtype=np.int32)
+        return cls(indptr, indices, n_codes)
+
+    @classmethod
+    def load(cls, npz_path):
+        with np.load(npz_path) as data:
+            return cls(data['indptr'], data['indices'], data['n_codes'])
+
+    def save(self, npz_path):
+        """ Write to a temporary file in the same directory, then rename it to npz_path, so that an
+        interrupted or concurrent save never leaves a truncated file at npz_path """
+        tmp_path = f'{npz_path}.tmp{os.getpid()}'
+        try:
+            with open(tmp_path, 'wb') as fout:
+                np.savez(fout, indptr=self.indptr, indices=self.indices, n_codes=self.n_codes)
+                fout.flush()
+                os.fsync(fout.fileno())
+            os.replace(tmp_path, npz_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def __len__(self):
+        return (len(self.indptr) - 1) // self.n_codes
+
+    def span(self, row, first_code, last_code=None):
+        """ Return the (start, end) range in `indices` of codes first_code ~ last_code of a row """
+        last_code = first_code if last_code is None else last_code
+        return (self.indptr[row * self.n_codes + first_code - 1],
+                self.indptr[row * self.n_codes + last_code])
+
+    def candidates(self, row, first_code, last_code=None):
+        start, end = self.span(row, first_code, last_code)
+        return self.indices[start:end]
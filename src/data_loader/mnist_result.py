@@ -1,6 +1,10 @@
+import os
+
 import numpy as np
 from torch.utils.data import Dataset
 
+from utils.output_writer import load_streamed_outputs
+
 
 class MnistResultDataset(Dataset):
     """
@@ -11,6 +15,9 @@ class MnistResultDataset(Dataset):
         self.results = self._load_data(result_filename, key)
 
     def _load_data(self, result_filename, key):
+        # A directory is written by StreamingOutputWriter and is read lazily
+        if os.path.isdir(result_filename):
+            return load_streamed_outputs(result_filename)[key]
         return np.load(result_filename)[key]
 
     def __getitem__(self, index):
@@ -0,0 +1,94 @@
+'''
+prefetcher.py
+
+Overlap host-to-device copies with computation. DevicePrefetcher wraps a data loader, pins
+each batch and copies it to the device with non_blocking copies on a side CUDA stream while
+the previous batch is being consumed, so one batch is always in flight.
+'''
+import torch
+
+
+def move_to_device(obj, device, non_blocking=False):
+    """ Recursively move tensors in (nested) dicts/lists/tuples to `device`.
+
+    A new container is returned and the input is left untouched, so the same batch can be safely
+    referred to elsewhere (e.g. by a pinned-memory buffer). Non-tensor items such as paths are
+    passed through.
+    """
+    if torch.is_tensor(obj):
+        return obj.to(device, non_blocking=non_blocking)
+    if isinstance(obj, dict):
+        return {key: move_to_device(value, device, non_blocking) for key, value in obj.items()}
+    if isinstance(obj, tuple) and hasattr(obj, '_fields'):  # namedtuple
+        return type(obj)(*[move_to_device(value, device, non_blocking) for value in obj])
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(move_to_device(value, device, non_blocking) for value in obj)
+    return obj
+
+
+def pin_memory(obj):
+    """ Recursively pin the CPU tensors in (nested) dicts/lists/tuples """
+    if torch.is_tensor(obj):
+        return obj if obj.is_cuda or obj.is_pinned() else obj.pin_memory()
+    if isinstance(obj, dict):
+        return {key: pin_memory(value) for key, value in obj.items()}
+    if isinstance(obj, tuple) and hasattr(obj, '_fields'):
+        return type(obj)(*[pin_memory(value) for value in obj])
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(pin_memory(value) for value in obj)
+    return obj
+
+
+def _record_stream(obj, stream):
+    """ Mark tensors as used by `stream` so the caching allocator does not reuse their memory early """
+    if torch.is_tensor(obj):
+        obj.record_stream(stream)
+    elif isinstance(obj, dict):
+        for value in obj.values():
+            _record_stream(value, stream)
+    elif isinstance(obj, (list, tuple)):
+        for value in obj:
+            _record_stream(value, stream)
+
+
+class DevicePrefetcher():
+    """ Iterate over `loader` yielding batches that are already on `device`.
+
+    On CUDA, the copy of batch i+1 is issued on a side stream right after batch i is handed out,
+    and the consuming (current) stream waits for that copy only when batch i+1 is requested.
+    On CPU devices the batches are passed through unchanged.
+
+    Note: batches are pinned here only if the loader does not already pin them (see the
+    `pin_memory` option of BaseDataLoader, which pins in a background thread and is cheaper).
+    """
+    def __init__(self, loader, device):
+        self.loader = loader
+        self.device = device
+        self.use_cuda = device.type == 'cuda'
+        self.stream = torch.cuda.Stream(device=device) if self.use_cuda else None
+
+    def __len__(self):
+        return len(self.loader)
+
+    def _preload(self, iterator):
+        try:
+            batch = next(iterator)
+        except StopIteration:
+            return None
+        with torch.cuda.stream(self.stream):
+            return move_to_device(pin_memory(batch), self.device, non_blocking=True)
+
+    def __iter__(self):
+        if not self.use_cuda:
+            yield from self.loader
+            return
+
+        iterator = iter(self.loader)
+        next_batch = self._preload(iterator)
+        while next_batch is not None:
+            current_stream = torch.cuda.current_stream(self.device)
+            current_stream.wait_stream(self.stream)
+            batch = next_batch
+            _record_stream(batch, current_stream)
+            next_batch = self._preload(iterator)
+            yield batch
@@ -1,17 +1,24 @@
 import os
 import argparse
 # import warnings
-import torch
 
+from utils.checkpoint import load_checkpoint
 from utils.logging_config import logger
 from pipeline import TrainingPipeline, TestingPipeline, EvaluationPipeline
 
+# Checkpoint entries needed by each mode (None: all); testing does not need optimizer states for example
+RESUMED_CHECKPOINT_KEYS = {
+    'train': None,
+    'test': ['arch', 'epoch', 'state_dict', 'config'],
+    'eval': ['config'],
+}
 
-def main(args):
+
+def setup_pipeline(args):
     # load config file from checkpoint, this will include the training information (epoch, optimizer parameters)
     if args.resume is not None:
         logger.info(f"Resuming checkpoint: {args.resume} ...")
-        resumed_checkpoint = torch.load(args.resume)
+        resumed_checkpoint = load_checkpoint(args.resume, keys=RESUMED_CHECKPOINT_KEYS[args.mode])
     else:
         resumed_checkpoint = None
     args.resumed_checkpoint = resumed_checkpoint
@@ -30,6 +37,11 @@ def main(args):
         pipeline = EvaluationPipeline(args)
     else:
         raise NotImplementedError(f'Mode {args.mode} not defined.')
+    return pipeline
+
+
+def main(args):
+    pipeline = setup_pipeline(args)
 
     ################
     # Run pipeline #
@@ -38,7 +50,7 @@ def main(args):
     pipeline.run()
 
 
-def parse_args():
+def parse_args(argv=None):
     parser = argparse.ArgumentParser(description='PyTorch Template')
     parser.add_argument(
         '-tc', '--template_config', default=None, type=str,
@@ -61,7 +73,7 @@ def parse_args():
                         help='Specify the keys to save at testing mode.')
     parser.add_argument('--ckpts_subdir', type=str, default='ckpts', help='Subdir name for ckpts saving.')
     parser.add_argument('--outputs_subdir', type=str, default='outputs', help='Subdir name for outputs saving.')
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     # Set template config to default if not given
     if args.template_config is None:
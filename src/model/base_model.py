@@ -8,6 +8,10 @@ class BaseModel(nn.Module):
     """
     Base class for all models
     """
+    # Submodules used only by training (e.g. classification heads), not loaded from checkpoints for testing
+    training_only_modules = []
+    # Submodules not built by this instance (e.g. by an inference-only model), skipped when loading checkpoints
+    unbuilt_modules = []
 
     def __init__(self):
         super(BaseModel, self).__init__()
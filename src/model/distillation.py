@@ -0,0 +1,74 @@
+'''
+distillation.py
+
+The frozen teacher of the 'distillation' optimize strategy. It provides the xCos outputs of a
+pretrained (e.g. IR-SE50) xCosModel as targets for a compact student.
+
+With a teacher cache (written by scripts/precompute_teacher_cache.py), the grid features of
+every training image are read from disk by the sample indices of the batch, and only the
+attention/grid-cosine part of the teacher (a few small convs on 7x7 maps) runs during training.
+'''
+import torch
+import torch.nn as nn
+
+from utils.checkpoint import load_checkpoint
+from utils.logging_config import logger
+from utils.output_writer import load_streamed_outputs
+import model.model as module_arch
+
+TEACHER_OUTPUT_KEYS = ['x_coses', 'grid_cos_maps', 'attention_maps']
+
+
+def build_teacher_model(entry, checkpoint_path):
+    """ Build the teacher from an arch entry ({"type": ..., "args": ...}) and load its weights """
+    model = getattr(module_arch, entry['type'])(**entry['args'])
+    logger.info(f"Loading teacher checkpoint: {checkpoint_path} ...")
+    checkpoint = load_checkpoint(checkpoint_path, keys=['state_dict'])
+    missing_keys, unexpected_keys = model.load_state_dict(checkpoint['state_dict'], strict=False)
+    if len(missing_keys) > 0:
+        logger.warning(f'Keys missing in the teacher checkpoint: {missing_keys}')
+    if len(unexpected_keys) > 0:
+        logger.warning(f'Unexpected keys in the teacher checkpoint: {unexpected_keys}')
+    return model
+
+
+class XCosTeacher(nn.Module):
+    """ Frozen xCosModel returning its outputs as 'teacher_<key>' entries to be added to the data dictionary
+
+    Args:
+        model (xCosModel): the pretrained teacher.
+        cache_dir (str): output directory of scripts/precompute_teacher_cache.py. If given, the batches
+            should have 'sample_indices' (see SiameseImageFolder's return_indices) and the backbones of
+            the teacher are dropped.
+    """
+    def __init__(self, model, cache_dir=None):
+        super().__init__()
+        self.model = model
+        self.grid_feats = None
+        if cache_dir is not None:
+            self.grid_feats = load_streamed_outputs(cache_dir)['grid_feats']
+            logger.info(f'Loaded teacher cache of {len(self.grid_feats)} images from {cache_dir}')
+            del self.model.backbone, self.model.backbone_target, self.model.head
+        for param in self.model.parameters():
+            param.requires_grad = False
+        self.train(False)
+
+    def train(self, mode=True):
+        # The teacher always stays in evaluation mode
+        return super().train(False)
+
+    def _cached_grid_feats(self, indices, device):
+        grid_feats = self.grid_feats[indices.cpu().numpy()]
+        return torch.from_numpy(grid_feats).to(device=device, dtype=torch.float32)
+
+    @torch.no_grad()
+    def forward(self, data_dict):
+        if self.grid_feats is None:
+            output = self.model(data_dict, scenario='get_feature_and_xcos')
+        else:
+            device = next(self.model.parameters()).device
+            indices1, indices2 = data_dict['sample_indices']
+            attention_maps, grid_cos_maps, x_coses = self.model.compute_xcos(
+                self._cached_grid_feats(indices1, device), self._cached_grid_feats(indices2, device))
+            output = {'x_coses': x_coses, 'grid_cos_maps': grid_cos_maps, 'attention_maps': attention_maps}
+        return {f'teacher_{key}': output[key] for key in TEACHER_OUTPUT_KEYS}
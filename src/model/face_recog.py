@@ -93,7 +93,21 @@ def get_block(in_channel, depth, num_units, stride=2):
 
 
 def get_blocks(num_layers):
-    if num_layers == 50:
+    if num_layers == 18:
+        blocks = [
+            get_block(in_channel=64, depth=64, num_units=2),
+            get_block(in_channel=64, depth=128, num_units=2),
+            get_block(in_channel=128, depth=256, num_units=2),
+            get_block(in_channel=256, depth=512, num_units=2)
+        ]
+    elif num_layers == 34:
+        blocks = [
+            get_block(in_channel=64, depth=64, num_units=3),
+            get_block(in_channel=64, depth=128, num_units=4),
+            get_block(in_channel=128, depth=256, num_units=6),
+            get_block(in_channel=256, depth=512, num_units=3)
+        ]
+    elif num_layers == 50:
         blocks = [
             get_block(in_channel=64, depth=64, num_units=3),
             get_block(in_channel=64, depth=128, num_units=4),
@@ -120,7 +134,7 @@ def get_blocks(num_layers):
 class Backbone(Module):
     def __init__(self, num_layers, drop_ratio, mode='ir'):
         super(Backbone, self).__init__()
-        assert num_layers in [50, 100, 152], 'num_layers should be 50,100, or 152'
+        assert num_layers in [18, 34, 50, 100, 152], 'num_layers should be 18, 34, 50, 100, or 152'
         assert mode in ['ir', 'ir_se'], 'mode should be ir or ir_se'
         blocks = get_blocks(num_layers)
         if mode == 'ir':
@@ -158,7 +172,7 @@ class Backbone(Module):
 class Backbone_FC2Conv(Module):
     def __init__(self, num_layers, drop_ratio, mode='ir', returnGrid=True):
         super(Backbone_FC2Conv, self).__init__()
-        assert num_layers in [50, 100, 152], 'num_layers should be 50,100, or 152'
+        assert num_layers in [18, 34, 50, 100, 152], 'num_layers should be 18, 34, 50, 100, or 152'
         assert mode in ['ir', 'ir_se'], 'mode should be ir or ir_se'
         blocks = get_blocks(num_layers)
         if mode == 'ir':
@@ -328,6 +342,52 @@ class MobileFaceNet(Module):
         out = self.bn(out)
         return l2_norm(out)
 
+
+class MobileFaceNet_FC2Conv(MobileFaceNet):
+    """ MobileFaceNet counterpart of Backbone_FC2Conv: the 7x7 feature map before conv_6_dw is projected
+    to 32 channels by a 1x1 conv, so that it can be fed to XCosAttention/GridCos, and its flattened
+    (1568-d) version is the embedding. """
+    def __init__(self, embedding_size=512, returnGrid=True):
+        super(MobileFaceNet_FC2Conv, self).__init__(embedding_size)
+        self.conv1x1 = Sequential(Conv2d(512, 32, (1, 1), 1, 0),
+                                  BatchNorm2d(32),
+                                  PReLU(32))
+        self.returnGrid = returnGrid
+
+    def get_feature_map(self, x):
+        out = self.conv1(x)
+        out = self.conv2_dw(out)
+        out = self.conv_23(out)
+        out = self.conv_3(out)
+        out = self.conv_34(out)
+        out = self.conv_4(out)
+        out = self.conv_45(out)
+        out = self.conv_5(out)
+        out = self.conv_6_sep(out)
+        # out.size() : [bs, 512, 7, 7]
+        return out
+
+    def forward(self, x):
+        x = self.get_feature_map(x)
+        x = self.conv1x1(x)
+        # x.size() : [bs, 32, 7, 7]
+
+        grid_feat = x
+        x = x.flatten(1)
+        # x.size() : [bs, 1568]
+
+        if self.returnGrid:
+            return l2_norm(x), grid_feat
+        else:
+            return l2_norm(x)
+
+    def get_original_feature(self, x):
+        return super(MobileFaceNet_FC2Conv, self).forward(x)
+
+    def weight_init(self, mean, std):
+        for m in self._modules:
+            normal_init(self._modules[m], mean, std)
+
 # Arcface head #############################################################
 
 
@@ -0,0 +1,45 @@
+'''
+inference_checkpoint.py
+
+Inference checkpoints of xCosModel: only the parameters of the grid backbone and the attention
+(the head and the target backbone are only used by training), stored in half precision in one
+file of the safetensors layout together with the arch entry. Loading it builds the model with
+inference_only=True and maps the file lazily, which avoids building, initializing and
+unpickling the unused submodules.
+'''
+import json
+import time
+
+import torch
+
+from utils.checkpoint import save_safetensors, load_safetensors
+from utils.logging_config import logger
+import model.model as module_arch
+
+INFERENCE_MODULES = ['backbone', 'attention']
+
+
+def export_inference_checkpoint(state_dict, arch_entry, filename, dtype=torch.float16):
+    """ Write the inference parameters of a (full) xCosModel state_dict and its arch entry
+    ({"type": ..., "args": ...}) to filename; floating point tensors are cast to dtype. """
+    prefixes = tuple(f'{name}.' for name in INFERENCE_MODULES)
+    tensors = {
+        key: value.to(dtype) if value.is_floating_point() else value
+        for key, value in state_dict.items() if key.startswith(prefixes)
+    }
+    arch_entry = {'type': arch_entry['type'], 'args': {**arch_entry.get('args', {}), 'inference_only': True}}
+    save_safetensors(tensors, filename, metadata={'arch': json.dumps(arch_entry)})
+    return tensors
+
+
+def load_inference_model(filename, device='cpu'):
+    """ Build the inference-only model described by an inference checkpoint and load its parameters
+    (cast to the parameter dtype of the model, i.e. float32) """
+    start_time = time.time()
+    state_dict, metadata = load_safetensors(filename)
+    arch_entry = json.loads(metadata['arch'])
+    model = getattr(module_arch, arch_entry['type'])(**arch_entry['args'])
+    model.load_state_dict(state_dict)
+    model = model.to(device).eval()
+    logger.info(f'Loaded inference model {arch_entry["type"]} from {filename} in {time.time() - start_time:.2f}s')
+    return model
@@ -50,6 +50,34 @@ class SiameseMSELoss(BaseLoss):
         return data_dict, output_dict
 
 
+class DistillationMSELoss(BaseLoss):
+    """ MSE between a student output and the teacher output put in data_dict by the distillation
+    trainer (e.g. output_key='x_coses', target_key='teacher_x_coses') """
+    def __init__(self, *args, **kargs):
+        super().__init__(*args, **kargs)
+        self.loss_fn = nn.MSELoss()
+
+    def _postprocess(self, output, target):
+        # Cached teacher outputs may be stored in half precision
+        return output, target.to(output.dtype).view_as(output)
+
+
+class AttentionKLDivLoss(BaseLoss):
+    """ KL(teacher || student) between attention maps ([bs, 7, 7, 1]), each regarded as a distribution
+    over the grid cells """
+    def __init__(self, *args, eps=1e-8, **kargs):
+        super().__init__(*args, **kargs)
+        self.eps = eps
+        self.loss_fn = nn.KLDivLoss(reduction='batchmean')
+
+    def _postprocess(self, output, target):
+        output = output.reshape(output.size(0), -1)
+        target = target.to(output.dtype).reshape(target.size(0), -1)
+        output = output / output.sum(1, keepdim=True)
+        target = target / target.sum(1, keepdim=True)
+        return output.clamp(min=self.eps).log(), target
+
+
 class GANLoss(BaseLoss):
     def __init__(
         self, network,
@@ -1,16 +1,22 @@
 import os
 import torch
 from abc import abstractmethod
+from functools import lru_cache
 import tempfile
 
 import numpy as np
-from torchvision import transforms
 
 from utils.util import DeNormalize, lib_path, import_given_path
-from utils.verification import evaluate_accuracy
+from utils.verification import evaluate_accuracy, score_histograms, evaluate_histograms, get_roc_curve
 from utils.logging_config import logger
 
 
+@lru_cache(maxsize=None)
+def _import_pytorch_fid(module_name):
+    """ Import a module of libs/pytorch_fid on first use, since importing it (scipy, Inception) is slow """
+    return import_given_path(module_name, os.path.join(lib_path, f'pytorch_fid/{module_name}.py'))
+
+
 class BaseMetric(torch.nn.Module):
     def __init__(self, output_key, target_key, nickname, scenario='training'):
         super().__init__()
@@ -41,6 +47,13 @@ class BaseMetric(torch.nn.Module):
         """ Calculate the final metric values given the variables updated in each batch. """
         pass
 
+    def images(self):
+        """ Image tensors (3, H, W) of the last finalize() by Tensorboard tag (e.g. ROC curves).
+
+        Workers write them to Tensorboard right after finalize() (see WorkerTemplate._finalize_metrics()).
+        """
+        return {}
+
 
 class TestMetric(BaseMetric):
     def __init__(self, k, output_key, target_key, nickname=None, scenario='training'):
@@ -62,13 +75,19 @@ class TestMetric(BaseMetric):
 
 
 class VerificationMetric(BaseMetric):
+    """ k-fold verification accuracy. The ROC curve (fpr/tpr arrays) of the last finalize() is kept in
+    self.roc, with its image tensor under 'image' if plot_roc (see utils.verification.get_roc_curve), which
+    is written to Tensorboard as '<nickname>_roc'. """
     def __init__(self, output_key, target_key,
-                 nickname=None, num_of_folds=5, scenario='validation'):
+                 nickname=None, num_of_folds=5, scenario='validation', plot_roc=False, roc_renderer='fast'):
         nickname = f"verificatoin_acc_{target_key}" if nickname is None else nickname
         super().__init__(output_key, target_key, nickname, scenario)
         self.num_of_folds = num_of_folds
+        self.plot_roc = plot_roc
+        self.roc_renderer = roc_renderer
         self.cos_values = []
         self.is_same_ground_truth = []
+        self.roc = None
 
     def clear(self):
         self.cos_values = []
@@ -82,17 +101,93 @@ class VerificationMetric(BaseMetric):
     def finalize(self):
         self.cos_values = np.concatenate(self.cos_values, axis=None)
         self.is_same_ground_truth = np.concatenate(self.is_same_ground_truth, axis=None)
-        accuracy, threshold, roc_tensor = self.evaluate_and_plot_roc(
+        accuracy, threshold, self.roc = self.evaluate_and_plot_roc(
             self.cos_values, self.is_same_ground_truth, self.num_of_folds
         )
         logger.info(f">>>> In verification metric, accuracy:{accuracy}, threshold: {threshold}")
         return accuracy
 
+    def images(self):
+        if self.roc is None or 'image' not in self.roc:
+            return {}
+        return {f'{self.nickname}_roc': self.roc['image']}
+
     def evaluate_and_plot_roc(self, coses, issame, nrof_folds=5):
-        accuracy, best_thresholds, roc_curve_tensor = evaluate_accuracy(
-            coses, issame, nrof_folds
+        accuracy, best_thresholds, roc = evaluate_accuracy(
+            coses, issame, nrof_folds, plot_roc=self.plot_roc, roc_renderer=self.roc_renderer
         )
-        return accuracy.mean(), best_thresholds.mean(), roc_curve_tensor
+        return accuracy.mean(), best_thresholds.mean(), roc
+
+
+class StreamingVerificationMetric(BaseMetric):
+    """ Verification accuracy like VerificationMetric, computed from per-fold score histograms updated in
+    each batch instead of from all the scores, so the memory does not grow with the number of pairs.
+
+    Pairs are assigned to the folds in turn (pair i to fold i % num_of_folds) since the number of pairs is
+    not known in advance, unlike the contiguous folds of VerificationMetric. With the default 400 bins,
+    the thresholds are the same as those of evaluate_accuracy (a 0.005 grid on [-1, 1]).
+
+    finalize() returns the value of `report` (accuracy, threshold, auc or tar@far=<far> of far_targets);
+    all of them are logged and kept in self.results. With plot_roc, the ROC curve image tensor is
+    rendered into self.roc_curve by roc_renderer and written to Tensorboard as '<nickname>_roc'.
+    """
+    def __init__(self, output_key, target_key, nickname=None, num_of_folds=5, num_bins=400,
+                 far_targets=(1e-3,), report='accuracy', plot_roc=False, roc_renderer='fast', scenario='validation'):
+        nickname = f"verification_{report}_{target_key}" if nickname is None else nickname
+        super().__init__(output_key, target_key, nickname, scenario)
+        self.num_of_folds = num_of_folds
+        self.num_bins = num_bins
+        self.far_targets = far_targets
+        self.report = report
+        self.plot_roc = plot_roc
+        self.roc_renderer = roc_renderer
+        self.clear()
+
+    def clear(self):
+        self.histograms = np.zeros((self.num_of_folds, 2, self.num_bins), dtype=np.int64)
+        self.n_pairs = 0
+        self.results = None
+        self.roc_curve = None
+
+    def update(self, data, output):
+        scores = output[self.output_key].detach().cpu().numpy().reshape(-1)
+        is_same = data[self.target_key].cpu().numpy().reshape(-1)
+        folds = (self.n_pairs + np.arange(len(scores))) % self.num_of_folds
+        self.histograms += score_histograms(scores, is_same, folds, self.num_of_folds, self.num_bins)
+        self.n_pairs += len(scores)
+        return None
+
+    def finalize(self):
+        self.results = evaluate_histograms(self.histograms, self.far_targets)
+        summary = ', '.join(f'{key}: {value:.4f}' for key, value in self.results.items() if key not in ['tpr', 'fpr'])
+        logger.info(f">>>> In streaming verification metric ({self.n_pairs} pairs), {summary}")
+        if self.plot_roc:
+            self.roc_curve = get_roc_curve(self.results['fpr'], self.results['tpr'], renderer=self.roc_renderer)
+        return self.results[self.report]
+
+    def images(self):
+        return {} if self.roc_curve is None else {f'{self.nickname}_roc': self.roc_curve}
+
+
+class CascadeRatioMetric(BaseMetric):
+    """ Fraction of pairs scored by xCos (instead of exiting early with the global cosine) in the cascade
+    scoring of xCosModel, given the bool mask in output[output_key] """
+    def __init__(self, output_key='xcos_computed', target_key=None, nickname='xcos_ratio', scenario='validation'):
+        super().__init__(output_key, target_key, nickname, scenario)
+
+    def clear(self):
+        self.total_computed = 0
+        self.total_number = 0
+
+    def update(self, data, output):
+        computed = output[self.output_key]
+        n_computed = computed.sum().item()
+        self.total_computed += n_computed
+        self.total_number += len(computed)
+        return n_computed / len(computed)
+
+    def finalize(self):
+        return self.total_computed / max(self.total_number, 1)
 
 
 class TopKAcc(BaseMetric):
@@ -125,9 +220,13 @@ class FIDScoreOffline(BaseMetric):
     """
     Module calculating FID score by saving all images into temporary directories
     """
-    fid_score = import_given_path("fid_score", os.path.join(lib_path, 'pytorch_fid/fid_score.py'))
+    @property
+    def fid_score(self):
+        return _import_pytorch_fid('fid_score')
 
     def __init__(self, output_key, target_key, unnorm_mean=(0.5,), unnorm_std=(0.5,), nickname="FID_InceptionV3"):
+        from torchvision import transforms
+
         super().__init__(output_key, target_key, nickname)
         self.from_tensor_to_pil = transforms.Compose([
             DeNormalize(unnorm_mean, unnorm_mean),
@@ -165,7 +264,9 @@ class FIDScore(BaseMetric):
     """
     Abstract class of FID score calculator (store inception activation in memory)
     """
-    fid_score = import_given_path("fid_score", os.path.join(lib_path, 'pytorch_fid/fid_score.py'))
+    @property
+    def fid_score(self):
+        return _import_pytorch_fid('fid_score')
 
     def __init__(self, output_key, target_key, unnorm_mean=(0.5,), unnorm_std=(0.5,), nickname="FID_InceptionV3"):
         super().__init__(output_key, target_key, nickname)
@@ -211,7 +312,9 @@ class FIDScore(BaseMetric):
 
 
 class FIDScoreInceptionV3(FIDScore):
-    inception = import_given_path("inception", os.path.join(lib_path, 'pytorch_fid/inception.py'))
+    @property
+    def inception(self):
+        return _import_pytorch_fid('inception')
 
     def __init__(self, *args, **kargs):
         super().__init__(*args, **kargs)
@@ -9,27 +9,48 @@ import torch.nn.functional as F
 from .base_model import BaseModel
 from .networks import MnistGenerator, MnistDiscriminator
 
-from .face_recog import Backbone_FC2Conv, Backbone, Am_softmax, Arcface
+from .face_recog import Backbone_FC2Conv, Backbone, MobileFaceNet_FC2Conv, Am_softmax, Arcface
 from .xcos_modules import XCosAttention, FrobeniusInnerProduct, GridCos, l2normalize
-from utils.util import batch_visualize_xcos
 # from utils.global_config import global_config
 
 cosineDim1 = nn.CosineSimilarity(dim=1, eps=1e-6)
 
 
 class xCosModel(BaseModel):
+    training_only_modules = ['head']
+
     def __init__(self,
                  net_depth=50, dropout_ratio=0.6, net_mode='ir_se',
                  model_to_plugin='CosFace', embedding_size=1568, class_num=9999,
-                 use_softmax=True, softmax_temp=1, draw_qualitative_result=False):
+                 use_softmax=True, softmax_temp=1, draw_qualitative_result=False,
+                 backbone_arch='resnet', cascade_band=None, cascade_threshold=0.2545, inference_only=False,
+                 xcos_only=False):
         super().__init__()
         assert model_to_plugin in ['CosFace', 'ArcFace']
+        # With inference_only, the training-only head and target backbone are not built (only the
+        # 'get_feature_and_xcos' scenario works) and the weights are not initialized, as they are loaded
+        # afterwards (e.g. from an inference checkpoint, see model/inference_checkpoint.py).
+        # xcos_only skips the same modules but initializes the weights, for models trained only in the
+        # 'get_feature_and_xcos' scenario (e.g. distillation students).
+        self.inference_only = inference_only
+        self.xcos_only = xcos_only or inference_only
+        self.unbuilt_modules = ['head', 'backbone_target'] if self.xcos_only else []
         self.attention = XCosAttention(use_softmax=True, softmax_t=1, chw2hwc=True)
-        self.backbone = Backbone_FC2Conv(net_depth,
-                                         dropout_ratio,
-                                         net_mode)
+        # The grid backbone: IR/IR-SE ResNet ('resnet', net_depth and net_mode apply) or 'mobilefacenet'.
+        # The target backbone is the IR/IR-SE ResNet in both cases.
+        self.backbone_arch = backbone_arch
+        if self.backbone_arch == 'resnet':
+            self.backbone = Backbone_FC2Conv(net_depth,
+                                             dropout_ratio,
+                                             net_mode)
+        elif self.backbone_arch == 'mobilefacenet':
+            self.backbone = MobileFaceNet_FC2Conv()
+        else:
+            raise NotImplementedError
         self.model_to_plugin = model_to_plugin
-        if self.model_to_plugin == 'CosFace':
+        if self.xcos_only:
+            pass
+        elif self.model_to_plugin == 'CosFace':
             self.head = Am_softmax(embedding_size=embedding_size,
                                    classnum=class_num)
         elif self.model_to_plugin == 'ArcFace':
@@ -37,21 +58,33 @@ class xCosModel(BaseModel):
                                 classnum=class_num)
         else:
             raise NotImplementedError
-        self.backbone_target = Backbone(net_depth,
-                                        dropout_ratio,
-                                        net_mode)
+        if not self.xcos_only:
+            self.backbone_target = Backbone(net_depth,
+                                            dropout_ratio,
+                                            net_mode)
         self.frobenius_inner_product = FrobeniusInnerProduct()
         self.grid_cos = GridCos()  # chw2hwc=True
 
-        self.attention.weight_init(mean=0.0, std=0.02)
-        self.backbone.weight_init(mean=0.0, std=0.02)
-        self.backbone_target.weight_init(mean=0.0, std=0.02)
+        if not self.inference_only:
+            self.attention.weight_init(mean=0.0, std=0.02)
+            self.backbone.weight_init(mean=0.0, std=0.02)
+            if not self.xcos_only:
+                self.backbone_target.weight_init(mean=0.0, std=0.02)
 
+        # Visualizations are rendered by the Tester (see utils/async_visualizer.py), not in forward()
         self.draw_qualitative_result = draw_qualitative_result
 
+        # Cascade scoring (inference only): pairs whose global cosine is farther than cascade_band from
+        # cascade_threshold are scored by the cosine; xCos is computed only for the remaining pairs.
+        self.cascade_band = cascade_band
+        self.cascade_threshold = cascade_threshold
+
     def forward(self, data_dict, scenario="normal"):
         model_output = {}
         if scenario == 'normal':
+            if self.xcos_only:
+                raise RuntimeError("Scenario 'normal' needs the head and target backbone "
+                                   "(inference_only=False and xcos_only=False)")
             img1s, img2s = data_dict['data_input']
             label1s, label2s = data_dict['targeted_id_labels']
             ###############
@@ -70,9 +103,7 @@ class xCosModel(BaseModel):
             # loss1 = self.loss_fr(thetas, labels)
 
             # Part2: xCos
-            attention_maps = self.attention(grid_feat1s, grid_feat2s)
-            grid_cos_maps = self.grid_cos(grid_feat1s, grid_feat2s)
-            x_coses = self.frobenius_inner_product(grid_cos_maps, attention_maps)
+            attention_maps, grid_cos_maps, x_coses = self.compute_xcos(grid_feat1s, grid_feat2s)
             targeted_coses = self.getCos(img1s, img2s)
             model_output["x_coses"] = x_coses
             model_output["targeted_cos"] = targeted_coses
@@ -84,22 +115,50 @@ class xCosModel(BaseModel):
             model_output["flatten_feats"] = (flatten_feat1s, flatten_feat2s)
             model_output["grid_feats"] = (grid_feat1s, grid_feat2s)
 
-            attention_maps = self.attention(grid_feat1s, grid_feat2s)
-            grid_cos_maps = self.grid_cos(grid_feat1s, grid_feat2s)
-            x_coses = self.frobenius_inner_product(grid_cos_maps, attention_maps)
+            if self.cascade_band is not None and not self.training:
+                attention_maps, grid_cos_maps, x_coses, xcos_computed = self.compute_cascaded_xcos(
+                    flatten_feat1s, flatten_feat2s, grid_feat1s, grid_feat2s)
+                model_output["xcos_computed"] = xcos_computed
+            else:
+                attention_maps, grid_cos_maps, x_coses = self.compute_xcos(grid_feat1s, grid_feat2s)
             model_output["x_coses"] = x_coses
 
         model_output["attention_maps"] = attention_maps
         model_output["grid_cos_maps"] = grid_cos_maps
-        if self.draw_qualitative_result:
-            img1s = img1s.cpu().numpy()
-            img2s = img2s.cpu().numpy()
-            grid_cos_maps = grid_cos_maps.squeeze().detach().cpu().numpy()
-            attention_maps = attention_maps.squeeze().detach().cpu().numpy()
-            visualizations = batch_visualize_xcos(img1s, img2s, grid_cos_maps, attention_maps)
-            model_output["xcos_visualizations"] = visualizations
         return model_output
 
+    def compute_xcos(self, grid_feat1s, grid_feat2s):
+        '''
+        grid_feat1s.size: [bs, 32, 7, 7]
+        Returns attention maps, grid cosine maps (both [bs, 7, 7, 1]) and xCos values ([bs])
+        '''
+        attention_maps = self.attention(grid_feat1s, grid_feat2s)
+        grid_cos_maps = self.grid_cos(grid_feat1s, grid_feat2s)
+        x_coses = self.frobenius_inner_product(grid_cos_maps, attention_maps)
+        return attention_maps, grid_cos_maps, x_coses
+
+    def compute_cascaded_xcos(self, flatten_feat1s, flatten_feat2s, grid_feat1s, grid_feat2s):
+        '''
+        Score pairs by the cosine of the (l2-normalized) flatten features first, and compute xCos only
+        for the pairs with |cosine - cascade_threshold| <= cascade_band.
+        Returns attention maps and grid cosine maps (zeros for the early-exit pairs), scores ([bs])
+        and a bool mask ([bs]) of the pairs scored by xCos.
+        '''
+        coses = (flatten_feat1s * flatten_feat2s).sum(1)
+        xcos_computed = (coses - self.cascade_threshold).abs() <= self.cascade_band
+        x_coses = coses.clone()
+        map_size = (coses.size(0),) + tuple(grid_feat1s.shape[2:]) + (1,)
+        attention_maps = coses.new_zeros(map_size)
+        grid_cos_maps = coses.new_zeros(map_size)
+        indices = xcos_computed.nonzero(as_tuple=True)[0]
+        if len(indices) > 0:
+            sub_attention_maps, sub_grid_cos_maps, sub_x_coses = self.compute_xcos(
+                grid_feat1s[indices], grid_feat2s[indices])
+            attention_maps[indices] = sub_attention_maps.to(attention_maps.dtype)
+            grid_cos_maps[indices] = sub_grid_cos_maps.to(grid_cos_maps.dtype)
+            x_coses[indices] = sub_x_coses.to(x_coses.dtype)
+        return attention_maps, grid_cos_maps, x_coses, xcos_computed
+
     def getCos(self, img1s, img2s):
         '''
         img1s.size: [bs * 2, c, h, w]
@@ -120,6 +179,8 @@ class xCosModel(BaseModel):
 
 
 class NormalFaceModel(BaseModel):
+    training_only_modules = ['head']
+
     def __init__(self,
                  net_depth=50, dropout_ratio=0.6, net_mode='ir_se',
                  model_type='CosFace', embedding_size=512, class_num=9999):
@@ -8,6 +8,7 @@ import torch
 import pandas as pd
 
 from utils.util import get_instance
+from utils.checkpoint import load_checkpoint, load_safetensors
 from utils.visualization import WriterTensorboard
 from utils.logging_config import logger
 from utils.global_config import global_config
@@ -161,10 +162,15 @@ class BasePipeline(ABC):
         """ Setup optimizers according to configuration.
             Each optimizer has its corresponding network(s) to train, specified by 'target_network' in configuraion.
             If no `target_network` is specified, all parameters of self.model will be included.
+            Optimizers of networks in the model's unbuilt_modules (e.g. the head of xCosModel(xcos_only=True))
+            are skipped.
         """
         self.optimizers = {}
         for name, entry in global_config['optimizers'].items():
             model = self._get_non_parallel_model()
+            if entry.get('target_network') in getattr(model, 'unbuilt_modules', []):
+                logger.info(f'Optimizer "{name}" skipped: its target network {entry["target_network"]} is not built.')
+                continue
             if 'target_network' in entry.keys():
                 network = getattr(model, entry['target_network'])
             else:
@@ -187,9 +193,28 @@ class BasePipeline(ABC):
     def _load_pretrained(self, pretrained_path):
         """ Load pretrained model not strictly """
         logger.info(f"Loading pretrained checkpoint: {pretrained_path} ...")
-        checkpoint = torch.load(pretrained_path)
+        if pretrained_path.endswith('.safetensors'):
+            # An inference checkpoint (see scripts/export_inference_checkpoint.py)
+            state_dict, _ = load_safetensors(pretrained_path)
+        else:
+            state_dict = load_checkpoint(pretrained_path, keys=['state_dict'])['state_dict']
+        self._load_model_state_dict(state_dict, strict=False)
+
+    def _load_model_state_dict(self, state_dict, strict=True):
+        """ Load parameters into the model. The parameters of the model's unbuilt_modules and, except for
+        training, of its training_only_modules are skipped (and never read from a memory-mapped checkpoint). """
         model = self._get_non_parallel_model()
-        model.load_state_dict(checkpoint['state_dict'], strict=False)
+        from .training_pipeline import TrainingPipeline
+        skipped_modules = list(getattr(model, 'unbuilt_modules', []))
+        if not isinstance(self, TrainingPipeline):
+            skipped_modules += getattr(model, 'training_only_modules', [])
+        skipped_prefixes = tuple(f'{name}.' for name in skipped_modules)
+        state_dict = {key: value for key, value in state_dict.items() if not key.startswith(skipped_prefixes)}
+        missing_keys, unexpected_keys = model.load_state_dict(state_dict, strict=False)
+        missing_keys = [key for key in missing_keys if not key.startswith(skipped_prefixes)]
+        if strict and (len(missing_keys) > 0 or len(unexpected_keys) > 0):
+            raise RuntimeError(
+                f'Error(s) in loading state_dict: missing keys {missing_keys}, unexpected keys {unexpected_keys}')
 
     def _resume_checkpoint(self, resumed_checkpoint):
         """
@@ -208,6 +233,13 @@ class BasePipeline(ABC):
         self.start_epoch = resumed_checkpoint['epoch'] + 1
         self.monitor_best = resumed_checkpoint['monitor_best']
 
+        # A mid-epoch checkpoint continues its epoch at the next batch (see Trainer._init_output)
+        self.resumed_iteration_state = resumed_checkpoint.get('iteration_state', None)
+        if self.resumed_iteration_state is not None:
+            self.start_epoch = resumed_checkpoint['epoch']
+        if 'sampler' in resumed_checkpoint and hasattr(self.data_loader.sampler, 'load_state_dict'):
+            self.data_loader.sampler.load_state_dict(resumed_checkpoint['sampler'])
+
         # Estimated iteration_count is based on length of the current data loader,
         # which will be wrong if the batch sizes between the two training processes are different.
         self.train_iteration_count = resumed_checkpoint.get('train_iteration_count', 0)
@@ -217,7 +249,8 @@ class BasePipeline(ABC):
 
         # load optimizer state from resumed_checkpoint only when optimizer type is not changed.
         optimizers_ckpt = resumed_checkpoint['optimizers']
-        for key in global_config['optimizers'].keys():
+        # Only the optimizers which were set up (see _setup_optimizers)
+        for key in self.optimizers.keys():
             if key not in optimizers_ckpt.keys():
                 logger.warning(f'Optimizer name {key} in config file is not in checkpoint (not resumed)')
             elif resumed_checkpoint['config']['optimizers'][key]['type'] != global_config['optimizers'][key]['type']:
@@ -225,6 +258,13 @@ class BasePipeline(ABC):
             else:
                 self.optimizers[key].load_state_dict(optimizers_ckpt[key])
 
+        lr_schedulers_ckpt = resumed_checkpoint.get('lr_schedulers', {})
+        for key, scheduler in self.lr_schedulers.items():
+            if key in lr_schedulers_ckpt:
+                scheduler.load_state_dict(lr_schedulers_ckpt[key])
+            else:
+                logger.warning(f'LR scheduler {key} is not in checkpoint (not resumed)')
+
     def _resume_model_params(self, resumed_checkpoint):
         """ Load model parameters from resumed checkpoint """
         # load architecture params from resumed_checkpoint.
@@ -233,8 +273,7 @@ class BasePipeline(ABC):
                 'Warning: Architecture config given in config file is different from that of resumed_checkpoint. '
                 'This may yield an exception while state_dict is being loaded.'
             )
-        model = self._get_non_parallel_model()
-        model.load_state_dict(resumed_checkpoint['state_dict'])
+        self._load_model_state_dict(resumed_checkpoint['state_dict'])
 
     def _print_and_write_log(self, epoch, worker_outputs, write=True):
         # This function is to print out epoch summary of workers
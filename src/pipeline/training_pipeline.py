@@ -4,9 +4,13 @@ import os
 import torch
 
 from .base_pipeline import BasePipeline
+from data_loader.base_data_loader import ResumableRandomSampler
 from worker.trainer import Trainer
 from worker.validator import Validator
 import model.loss as module_loss
+import model.distillation as module_distillation
+import data_loader.augmentations as module_augmentation
+from utils.checkpoint import AsyncCheckpointWriter
 from utils.global_config import global_config
 from utils.logging_config import logger
 from utils.util import ensure_dir
@@ -17,11 +21,16 @@ class TrainingPipeline(BasePipeline):
         super().__init__(args)
 
     def _setup_pipeline_specific_attributes(self):
+        # Set by _resume_training_state when resumed from a mid-epoch checkpoint
+        self.resumed_iteration_state = None
         self._setup_loss_functions()
         if self.optimize_strategy == 'GAN':
             self._setup_gan_loss_functions()
         self._setup_optimizers()
         self._setup_lr_schedulers()
+        self._setup_mask_augmentation()
+        if self.optimize_strategy == 'distillation':
+            self._setup_distillation_teacher()
 
     def _create_saving_dir(self, args):
         saving_dir = os.path.join(global_config['trainer']['save_dir'], args.ckpts_subdir,
@@ -49,6 +58,29 @@ class TrainingPipeline(BasePipeline):
             for key, entry in global_config['gan_losses'].items()
         }
 
+    def _setup_mask_augmentation(self):
+        """ Setup the on-the-fly mask augmentation of training batches if 'mask_augmentation' is configured """
+        self.mask_augmentation = None
+        if 'mask_augmentation' in global_config:
+            entry = global_config['mask_augmentation']
+            self.mask_augmentation = getattr(module_augmentation, entry['type'])(**entry['args']).to(self.device)
+
+    def _setup_distillation_teacher(self):
+        """ Setup the frozen teacher of the 'distillation' optimize strategy from the 'distillation' config:
+        'teacher' (arch entry), 'teacher_checkpoint' and the optional 'teacher_cache' """
+        entry = global_config['distillation']
+        cache_dir = entry.get('teacher_cache', None)
+        if cache_dir is not None:
+            # Cached teacher outputs are only valid for the un-augmented images
+            if self.mask_augmentation is not None or getattr(self.data_loader, 'horizontal_flip', False):
+                raise ValueError('Teacher cache can not be used with random flips or mask augmentation '
+                                 '(set data_loader.args.horizontal_flip to false and remove mask_augmentation)')
+        teacher_model = module_distillation.build_teacher_model(entry['teacher'], entry['teacher_checkpoint'])
+        self.teacher = module_distillation.XCosTeacher(teacher_model, cache_dir).to(self.device)
+        if cache_dir is not None and len(self.teacher.grid_feats) != len(self.data_loader.dataset):
+            raise ValueError(f'Teacher cache {cache_dir} has {len(self.teacher.grid_feats)} images '
+                             f'but the training set has {len(self.data_loader.dataset)}')
+
     def _setup_lr_schedulers(self):
         """ Setup learning rate schedulers according to configuration. Note that the naming of
         optimizers and lr_schedulers in configuration should have a strict one-to-one mapping.
@@ -92,13 +124,16 @@ class TrainingPipeline(BasePipeline):
 
         self.do_validation = len(self.valid_data_loaders) > 0
 
-    def _save_checkpoint(self, epoch, save_best=False):
-        """
-        Saving checkpoints
+        # Checkpoints are written in a background thread; keep_last/keep_best limit the kept epoch checkpoints
+        # and keep_iterations the kept mid-epoch checkpoints
+        self.checkpoint_writer = AsyncCheckpointWriter(
+            keep_last=global_config['trainer'].get('keep_last', None),
+            keep_best=global_config['trainer'].get('keep_best', None),
+            keep_iterations=global_config['trainer'].get('keep_iterations', 1),
+            asynchronous=global_config['trainer'].get('async_checkpoint', True),
+        )
 
-        :param epoch: current epoch number
-        :param save_best: if True, add '-best.pth' at the end of the best model
-        """
+    def _get_checkpoint_state(self, epoch):
         arch = type(self.model).__name__
 
         # assure that we save the model state without DataParallel module
@@ -107,25 +142,58 @@ class TrainingPipeline(BasePipeline):
             model_state = self.model.module.state_dict()
         else:
             model_state = self.model.state_dict()
+        trainer, validators = self.workers[0], self.workers[1:]
         state = {
             'arch': arch,
             'epoch': epoch,
             'state_dict': model_state,
             'optimizers': {key: optimizer.state_dict() for key, optimizer in self.optimizers.items()},
+            'lr_schedulers': {key: scheduler.state_dict() for key, scheduler in self.lr_schedulers.items()},
             'monitor_best': self.monitor_best,
             'config': global_config,
-            'train_iteration_count': self.train_iteration_count,
-            'valid_iteration_counts': self.valid_iteration_counts,
+            # Tensorboard steps of the workers
+            'train_iteration_count': trainer.step,
+            'valid_iteration_counts': [validator.step for validator in validators],
         }
+        sampler = self.data_loader.sampler
+        if isinstance(sampler, ResumableRandomSampler):
+            state['sampler'] = sampler.state_dict()
+        return state
+
+    def _save_checkpoint(self, epoch, save_best=False):
+        """
+        Saving checkpoints
+
+        :param epoch: current epoch number
+        :param save_best: if True, add '-best.pth' at the end of the best model
+        """
+        state = self._get_checkpoint_state(epoch)
 
         best_str = '-best' if save_best else ''
         monitored_name = f'{self.monitored_loader}_{self.monitored_metric}'
         filename = os.path.join(
             self.saving_dir, f'ckpt-ep{epoch:04d}-{monitored_name}{self.monitor_best:.4f}{best_str}.pth'
         )
-        torch.save(state, filename)
+        # Only the copy of the state to CPU memory happens here; it is written by the checkpoint writer
+        self.checkpoint_writer.save(state, filename, is_best=save_best)
         logger.info(f"Saving checkpoint: {filename} ...")
 
+    def _save_iteration_checkpoint(self, epoch, iteration_state):
+        """ Save a mid-epoch checkpoint, called by the Trainer every `trainer.save_iteration_freq` batches.
+        Resuming from it continues the epoch at the next batch (see _resume_training_state). """
+        sampler = self.data_loader.sampler
+        if not isinstance(sampler, ResumableRandomSampler):
+            logger.warning('Mid-epoch checkpoints need a shuffled training data loader (ResumableRandomSampler); '
+                           'not saved')
+            return
+        state = self._get_checkpoint_state(epoch)
+        state['sampler'] = sampler.state_dict(num_consumed=iteration_state['num_consumed'])
+        state['iteration_state'] = iteration_state
+
+        filename = os.path.join(self.saving_dir, f'ckpt-ep{epoch:04d}-iter{iteration_state["batch_idx"] + 1:07d}.pth')
+        self.checkpoint_writer.save(state, filename, is_iteration=True)
+        logger.info(f"Saving mid-epoch checkpoint: {filename} ...")
+
     def _check_and_save_best(self, epoch, worker_outputs):
         """
         Evaluate model performance according to configured metric, save best checkpoint as model_best
@@ -148,18 +216,24 @@ class TrainingPipeline(BasePipeline):
 
     def _after_epoch(self, epoch, worker_outputs):
         self._print_and_write_log(epoch, worker_outputs)
-        self._check_and_save_best(epoch, worker_outputs)
 
+        # Step the schedulers before saving, so that the checkpoint holds the states for the next epoch
         if self.lr_schedulers is not None:
             for scheduler in self.lr_schedulers.values():
                 scheduler.step()
 
+        self._check_and_save_best(epoch, worker_outputs)
+
     def run(self):
         """
         Full training pipeline logic
         """
-        for epoch in range(self.start_epoch, self.epochs + 1):
-            for worker in self.workers:
-                worker_output = worker.run(epoch)
-                self.worker_outputs[worker.data_loader.name] = worker_output
-            self._after_epoch(epoch, self.worker_outputs)
+        try:
+            for epoch in range(self.start_epoch, self.epochs + 1):
+                for worker in self.workers:
+                    worker_output = worker.run(epoch)
+                    self.worker_outputs[worker.data_loader.name] = worker_output
+                self._after_epoch(epoch, self.worker_outputs)
+        finally:
+            # Finish writing the pending checkpoints
+            self.checkpoint_writer.close()
@@ -0,0 +1,324 @@
+'''
+Benchmark the data path alone (no model): samples/s, time to first batch, main/worker CPU time
+and peak RSS of every data loader / dataset class, across num_workers, batch sizes and decoder
+options. Synthetic ImageFolder, bcolz, ARFace, DFW and IJB-A/B/C fixtures are generated under
+--fixture_dir (once; reused by later runs), and every case runs in a fresh process so that the
+peak RSS of one case does not leak into the next. Results are written as JSON for regression
+tracking.
+
+The MNIST loaders are not covered since their datasets are downloaded instead of generated.
+
+Example:
+    python scripts/benchmark_data_pipeline.py --fixture_dir /tmp/xcos_data_fixtures \
+        --num_workers 0 2 4 --batch_sizes 32 128 --decoders pil cv2 -o data_benchmark.json
+
+'''
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # NOQA
+import argparse
+import itertools
+import json
+import time
+
+import numpy as np
+from PIL import Image
+
+from utils.benchmark import measure_loader, run_isolated
+from utils.logging_config import logger
+
+IMAGE_SIZE = 112
+# Larger images for the IJB crops, so that the reduced-size decoding could take effect
+LARGE_IMAGE_SIZE = 256
+
+
+# ============ Fixtures ==============
+def _random_image(rng, size, n_channels=3):
+    return Image.fromarray(rng.randint(0, 256, (size, size, n_channels), dtype=np.uint8).squeeze())
+
+
+def _make_image_folder(root, rng, num_identities, images_per_identity):
+    for identity in range(num_identities):
+        os.makedirs(os.path.join(root, f'{identity:05d}'), exist_ok=True)
+        for i in range(images_per_identity):
+            _random_image(rng, IMAGE_SIZE).save(os.path.join(root, f'{identity:05d}', f'{i:03d}.jpg'))
+
+
+def _make_genegan(root, rng, num_identities, images_per_identity):
+    os.makedirs(root, exist_ok=True)
+    with open(os.path.join(root, 'identity.txt'), 'w') as fout:
+        for identity in range(num_identities):
+            for i in range(images_per_identity):
+                name = f'{identity:05d}_{i:03d}.jpg'
+                _random_image(rng, IMAGE_SIZE).save(os.path.join(root, name))
+                fout.write(f'{name} {identity}\n')
+
+
+def _make_bcolz(root, rng, num_pairs, name='lfw'):
+    import bcolz
+    os.makedirs(root, exist_ok=True)
+    images = rng.uniform(-1, 1, (num_pairs * 2, 3, IMAGE_SIZE, IMAGE_SIZE)).astype(np.float32)
+    bcolz.carray(images, rootdir=os.path.join(root, name), mode='w').flush()
+    np.save(os.path.join(root, f'{name}_list.npy'), rng.randint(0, 2, num_pairs).astype(bool))
+
+
+def _make_arface(root, rng, num_identities, images_per_identity):
+    os.makedirs(root, exist_ok=True)
+    for identity in range(num_identities):
+        for i in range(images_per_identity):
+            _random_image(rng, 165).save(os.path.join(root, f'm-{identity + 1:03d}-{i + 1}.bmp'))
+
+
+def _make_ar_verification(root, rng, num_images):
+    os.makedirs(root, exist_ok=True)
+    for i in range(num_images):
+        _random_image(rng, IMAGE_SIZE).save(os.path.join(root, f'{i:05d}.png'))
+
+
+def _make_dfw(root, rng, num_identities, images_per_identity, dataset_type='training'):
+    names, identities = [], []
+    for identity in range(num_identities):
+        person = f'Person_{identity:04d}'
+        os.makedirs(os.path.join(root, 'Training_data', person), exist_ok=True)
+        for i in range(images_per_identity):
+            # Every 4th image of a person is an impersonator, named as {name}_I_{xxx}.jpg
+            suffix = f'_I_{i:03d}.jpg' if i % 4 == 3 else f'_h_{i:03d}.jpg'
+            name = f'Training_data/{person}/{person}{suffix}'
+            _random_image(rng, IMAGE_SIZE).save(os.path.join(root, name))
+            names.append(name)
+            identities.append(identity if i % 4 != 3 else -1 - identity)
+    with open(os.path.join(root, f'{dataset_type.capitalize()}_data_face_name.txt'), 'w') as fout:
+        fout.writelines([f'{name}\n' for name in names])
+
+    # Codes: 1 same identity, 3 impersonator of this identity, 4 other identities, 0 self
+    identities = np.array(identities)
+    owners = np.where(identities < 0, -1 - identities, identities)
+    same_owner = owners[:, None] == owners[None, :]
+    is_impersonator = (identities[:, None] < 0) | (identities[None, :] < 0)
+    matrix = np.where(same_owner, np.where(is_impersonator, 3, 1), 4)
+    np.fill_diagonal(matrix, 0)
+    matrix_dir = os.path.join(root, 'Mask_matrices', dataset_type)
+    os.makedirs(matrix_dir, exist_ok=True)
+    np.savetxt(os.path.join(matrix_dir, f'{dataset_type}_data_mask_matrix.txt'), matrix, fmt='%d')
+
+
+def _make_ijb(root, rng, num_templates, images_per_template, num_pairs):
+    import pandas as pd
+    # IJB-B/C 1:1 pairs and loose crops with 5-point landmarks
+    os.makedirs(os.path.join(root, 'meta'), exist_ok=True)
+    os.makedirs(os.path.join(root, 'loose_crop'), exist_ok=True)
+    landmark = '38.3 51.7 73.5 51.5 56.0 71.7 41.5 92.4 70.7 92.2'
+    with open(os.path.join(root, 'meta', 'ijbb_name_5pts_score.txt'), 'w') as fout:
+        for i in range(num_templates):
+            _random_image(rng, IMAGE_SIZE).save(os.path.join(root, 'loose_crop', f'{i}.jpg'))
+            fout.write(f'{i}.jpg {landmark} 0.99\n')
+    pairs = rng.randint(0, num_templates, (num_pairs, 2))
+    with open(os.path.join(root, 'meta', 'ijbb_template_pair_label.txt'), 'w') as fout:
+        fout.writelines([f'{t1} {t2} {int(t1 % 7 == t2 % 7)}\n' for t1, t2 in pairs])
+
+    # IJB-C cropped faces and the test1 protocol
+    for subdir in ['img', 'frames']:
+        os.makedirs(os.path.join(root, 'cropped_faces', subdir), exist_ok=True)
+    os.makedirs(os.path.join(root, 'protocols', 'test1'), exist_ok=True)
+    rows = []
+    for template_id in range(num_templates):
+        subject_id = template_id % (num_templates // 2 + 1)
+        for i in range(images_per_template):
+            subdir = 'img' if i % 2 == 0 else 'frames'
+            file_index = template_id * images_per_template + i
+            _random_image(rng, LARGE_IMAGE_SIZE).save(
+                os.path.join(root, 'cropped_faces', subdir, f'{subject_id}_{file_index}.jpg'))
+            rows.append([str(template_id), str(subject_id), f'{subdir}/{file_index}.jpg'])
+    templates = pd.DataFrame(rows, columns=['TEMPLATE_ID', 'SUBJECT_ID', 'FILENAME'])
+    templates.to_csv(os.path.join(root, 'protocols', 'test1', 'enroll_templates.csv'), index=False)
+    templates.to_csv(os.path.join(root, 'protocols', 'test1', 'verif_templates.csv'), index=False)
+    metadata = templates[['SUBJECT_ID', 'FILENAME']].copy()
+    for i in range(1, 19):
+        metadata[f'OCC{i}'] = rng.randint(0, 2, len(metadata))
+    metadata.to_csv(os.path.join(root, 'protocols', 'ijbc_metadata_with_age.csv'), index=False)
+    pd.DataFrame(pairs.astype(str), columns=['ENROLL_TEMPLATE_ID', 'VERIF_TEMPLATE_ID']).to_csv(
+        os.path.join(root, 'protocols', 'test1', 'match.csv'), index=False)
+
+
+def _make_ijba(root, rng, num_templates, images_per_template, num_pairs, split_name='split1'):
+    import pandas as pd
+    split_root = os.path.join(root, 'IJB-A_11_sets', split_name)
+    os.makedirs(split_root, exist_ok=True)
+    os.makedirs(os.path.join(root, 'images', 'img'), exist_ok=True)
+    rows = []
+    for template_id in range(num_templates):
+        for i in range(images_per_template):
+            fname = f'img/{template_id}_{i}.jpg'
+            _random_image(rng, LARGE_IMAGE_SIZE).save(os.path.join(root, 'images', fname))
+            rows.append([template_id, template_id % 5, fname, 40, 30, 150, 180])
+    pd.DataFrame(rows, columns=['TEMPLATE_ID', 'SUBJECT_ID', 'FILE', 'FACE_X', 'FACE_Y', 'FACE_WIDTH',
+                                'FACE_HEIGHT']).to_csv(
+        os.path.join(split_root, f'verify_metadata_{split_name[5:]}.csv'), index=False)
+    pd.DataFrame(rng.randint(0, num_templates, (num_pairs, 2))).to_csv(
+        os.path.join(split_root, f'verify_comparisons_{split_name[5:]}.csv'), index=False, header=False)
+
+
+def make_fixtures(fixture_dir, num_identities, images_per_identity, seed=0):
+    """ Generate all synthetic fixtures under fixture_dir (skipping those already generated) """
+    rng = np.random.RandomState(seed)
+    makers = {
+        'image_folder': lambda root: _make_image_folder(root, rng, num_identities, images_per_identity),
+        'genegan': lambda root: _make_genegan(root, rng, num_identities, images_per_identity),
+        'bcolz': lambda root: _make_bcolz(root, rng, num_identities * images_per_identity // 2),
+        'arface': lambda root: _make_arface(root, rng, num_identities, images_per_identity),
+        'ar_verification': lambda root: _make_ar_verification(root, rng, num_identities * images_per_identity),
+        'dfw': lambda root: _make_dfw(root, rng, num_identities, images_per_identity),
+        'ijb': lambda root: _make_ijb(root, rng, num_identities, images_per_identity,
+                                      num_identities * images_per_identity),
+        'ijba': lambda root: _make_ijba(root, rng, num_identities, images_per_identity,
+                                        num_identities * images_per_identity),
+    }
+    for name, make in makers.items():
+        root = os.path.join(fixture_dir, name)
+        done_flag = os.path.join(root, '.done')
+        if os.path.exists(done_flag):
+            continue
+        logger.info(f'Generating fixture {root} ...')
+        try:
+            make(root)
+        except ImportError as e:
+            logger.warning(f'Skipping fixture {name}: {e}')
+            continue
+        open(done_flag, 'w').close()
+
+
+# ============ Cases ==============
+# name -> (fixture, whether the case accepts a decoder option, whether batches need list collation)
+CASES = {
+    'FaceDataLoader': ('image_folder', True, False),
+    'GeneGANDataLoader': ('genegan', True, False),
+    'FaceBinDataLoader': ('bcolz', False, False),
+    'ARFaceDataLoader': ('arface', False, False),
+    'ARFaceDataLoader_cached': ('arface', False, False),
+    'SiameseDFWImageFolder': ('dfw', False, False),
+    'ARVerificationAllPathDataset': ('ar_verification', False, False),
+    'IJBCAllCroppedFacesDataset': ('ijb', True, False),
+    'IJBCroppedFacesDataset': ('ijb', False, False),
+    'IJBVerificationPathDataset': ('ijb', False, False),
+    'IJBCVerificationPathDataset': ('ijb', False, True),
+    'IJBCVerificationDataset': ('ijb', False, True),
+    'IJBAVerificationDataset': ('ijba', True, True),
+}
+
+
+def list_collate(batch):
+    """ Keep samples of variable sizes (e.g. templates with different numbers of faces) as a list """
+    return batch
+
+
+def build_loader(case, fixture_root, batch_size, num_workers, decoder):
+    import data_loader.data_loaders as module_data
+    import data_loader.face_datasets as module_dataset
+    from data_loader.base_data_loader import BaseDataLoader
+    from torchvision import transforms
+
+    loader_kwargs = {'batch_size': batch_size, 'num_workers': num_workers}
+    decoder_kwargs = {'decoder': decoder} if decoder is not None else {}
+    if case == 'FaceDataLoader':
+        return module_data.FaceDataLoader(fixture_root, **loader_kwargs, **decoder_kwargs)
+    if case == 'GeneGANDataLoader':
+        return module_data.GeneGANDataLoader(fixture_root, identity_txt=os.path.join(fixture_root, 'identity.txt'),
+                                             **loader_kwargs, **decoder_kwargs)
+    if case == 'FaceBinDataLoader':
+        return module_data.FaceBinDataLoader(fixture_root, name='lfw', **loader_kwargs)
+    if case == 'ARFaceDataLoader':
+        return module_data.ARFaceDataLoader(fixture_root, **loader_kwargs)
+    if case == 'ARFaceDataLoader_cached':
+        return module_data.ARFaceDataLoader(fixture_root, cache_bytes=1 << 28, **loader_kwargs)
+
+    if case == 'SiameseDFWImageFolder':
+        transform = transforms.Compose([transforms.ToTensor(), transforms.Normalize([0.5] * 3, [0.5] * 3)])
+        dataset = module_dataset.SiameseDFWImageFolder(fixture_root, transform)
+    elif case == 'ARVerificationAllPathDataset':
+        dataset = module_dataset.ARVerificationAllPathDataset(fixture_root)
+    elif case == 'IJBCAllCroppedFacesDataset':
+        dataset = module_dataset.IJBCAllCroppedFacesDataset(fixture_root, **decoder_kwargs, decode_size=(112, 112))
+    elif case == 'IJBCroppedFacesDataset':
+        dataset = module_dataset.IJBCroppedFacesDataset(fixture_root, is_ijbb=True)
+    elif case == 'IJBVerificationPathDataset':
+        dataset = module_dataset.IJBVerificationPathDataset(fixture_root, dataset_type='IJBB')
+    elif case == 'IJBCVerificationPathDataset':
+        dataset = module_dataset.IJBCVerificationPathDataset(fixture_root)
+    elif case == 'IJBCVerificationDataset':
+        dataset = module_dataset.IJBCVerificationDataset(fixture_root)
+    elif case == 'IJBAVerificationDataset':
+        dataset = module_dataset.IJBAVerificationDataset(fixture_root, **decoder_kwargs)
+    else:
+        raise NotImplementedError(f'Unknown case {case}')
+    collate_fn = list_collate if CASES[case][2] else None
+    collate_kwargs = {'collate_fn': collate_fn} if collate_fn is not None else {}
+    return BaseDataLoader(dataset, batch_size, False, 0.0, num_workers, **collate_kwargs)
+
+
+def run_case(case, fixture_root, batch_size, num_workers, decoder, epochs, max_batches):
+    start_time = time.time()
+    data_loader = build_loader(case, fixture_root, batch_size, num_workers, decoder)
+    construction_time = time.time() - start_time
+    return {
+        'construction_time': construction_time,
+        'epochs': measure_loader(data_loader, epochs=epochs, max_batches=max_batches),
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--fixture_dir', type=str, default='/tmp/xcos_data_fixtures',
+                        help='Directory of the generated fixtures')
+    parser.add_argument('--num_identities', type=int, default=50)
+    parser.add_argument('--images_per_identity', type=int, default=8)
+    parser.add_argument('--cases', type=str, nargs='+', default=list(CASES.keys()))
+    parser.add_argument('--num_workers', type=int, nargs='+', default=[0, 2, 4])
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=[32, 128])
+    parser.add_argument('--decoders', type=str, nargs='+', default=['pil'],
+                        help='Decoder backends for the cases supporting them (see data_loader/image_decoders.py)')
+    parser.add_argument('--epochs', type=int, default=2)
+    parser.add_argument('--max_batches', type=int, default=None, help='Maximum number of batches per epoch')
+    parser.add_argument('-o', '--output_filename', type=str, default=None, help='Output json file')
+    args = parser.parse_args()
+    return args
+
+
+def main(args):
+    make_fixtures(args.fixture_dir, args.num_identities, args.images_per_identity)
+
+    results = []
+    for case in args.cases:
+        fixture, accepts_decoder, _ = CASES[case]
+        fixture_root = os.path.join(args.fixture_dir, fixture)
+        if not os.path.exists(os.path.join(fixture_root, '.done')):
+            logger.warning(f'Skipping {case}: fixture {fixture} is not available')
+            continue
+        decoders = args.decoders if accepts_decoder else [None]
+        for num_workers, batch_size, decoder in itertools.product(args.num_workers, args.batch_sizes, decoders):
+            setting = {'num_workers': num_workers, 'batch_size': batch_size, 'decoder': decoder}
+            try:
+                result = run_isolated(
+                    run_case, case=case, fixture_root=fixture_root, batch_size=batch_size,
+                    num_workers=num_workers, decoder=decoder, epochs=args.epochs, max_batches=args.max_batches)
+            except RuntimeError as e:
+                logger.warning(f'{case} {setting} failed: {e}')
+                continue
+            result.update({'case': case, 'setting': setting})
+            results.append(result)
+            last_epoch = result['epochs'][-1]
+            logger.info(
+                f"{case} {setting}: {last_epoch['samples_per_second']:.1f} samples/s, "
+                f"first batch {last_epoch['time_to_first_batch']:.2f}s, "
+                f"worker CPU {last_epoch['worker_cpu_seconds']:.1f}s, "
+                f"peak RSS {result['peak_rss_mb']:.0f}MB (worker {result['peak_child_rss_mb']:.0f}MB)"
+            )
+
+    if args.output_filename is not None:
+        with open(args.output_filename, 'w') as fout:
+            json.dump(results, fout, indent=4)
+        logger.info(f"{args.output_filename} written")
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    main(args)
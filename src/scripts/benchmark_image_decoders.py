@@ -0,0 +1,82 @@
+'''
+Compare the decode throughput of the image decoder backends (see data_loader/image_decoders.py)
+on a set of face crops, with and without reduced-size decoding. Each decoded image is resized
+to the target size as the data loaders do, so that the numbers are end-to-end comparable.
+
+Example:
+    python scripts/benchmark_image_decoders.py -p '../datasets/face/IJB/IJB-C/cropped_faces/img/*.jpg' \
+        --num_images 2000 --target_size 112 112 -o decoder_benchmark.json
+
+'''
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # NOQA
+import argparse
+import json
+import time
+from glob import glob
+
+from PIL import Image
+
+from data_loader.image_decoders import IMAGE_DECODERS, build_image_decoder
+from utils.logging_config import logger
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-p', '--pattern', type=str, required=True, help='Glob pattern of the images')
+    parser.add_argument('--backends', type=str, nargs='+', default=list(IMAGE_DECODERS.keys()))
+    parser.add_argument('--num_images', type=int, default=1000, help='Number of images to be decoded')
+    parser.add_argument('--target_size', type=int, nargs=2, default=[112, 112], help='H W')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of repeated runs (the best one is reported)')
+    parser.add_argument('-o', '--output_filename', type=str, default=None, help='Output json file')
+    args = parser.parse_args()
+    return args
+
+
+def time_decoder(decoder, paths, target_size):
+    start_time = time.time()
+    for path in paths:
+        img = decoder(path)
+        img.resize((target_size[1], target_size[0]), Image.BILINEAR)
+    return time.time() - start_time
+
+
+def main(args):
+    paths = sorted(glob(args.pattern))[:args.num_images]
+    if len(paths) == 0:
+        raise FileNotFoundError(f'No image matches {args.pattern}')
+    logger.info(f"Decoding {len(paths)} images, resizing to {args.target_size}")
+
+    results = []
+    for backend in args.backends:
+        for reduced in [False, True]:
+            if reduced and backend == 'torchvision':
+                continue
+            try:
+                decoder = build_image_decoder(backend, args.target_size if reduced else None)
+            except Exception as e:
+                logger.warning(f"Skipping {backend}: {e}")
+                break
+            # Warm up the file system cache and the decoder
+            time_decoder(decoder, paths[:10], args.target_size)
+            elapsed_time = min(time_decoder(decoder, paths, args.target_size) for _ in range(args.repeat))
+            result = {
+                'backend': backend,
+                'reduced': reduced,
+                'images_per_second': len(paths) / elapsed_time,
+                'ms_per_image': elapsed_time / len(paths) * 1000,
+            }
+            results.append(result)
+            logger.info(f"{backend:12s} reduced={str(reduced):5s}: {result['images_per_second']:8.1f} images/s "
+                        f"({result['ms_per_image']:.3f} ms/image)")
+
+    if args.output_filename is not None:
+        with open(args.output_filename, 'w') as fout:
+            json.dump(results, fout, indent=4)
+        logger.info(f"{args.output_filename} written")
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    main(args)
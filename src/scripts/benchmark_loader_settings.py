@@ -0,0 +1,125 @@
+'''
+Sweep DataLoader settings (num_workers, pin_memory, persistent_workers, prefetch_factor and the
+multiprocessing context) for each data loader in a config, and report the loader construction
+time, the time to the first batch, the throughput and the CPU time of each epoch.
+
+Example:
+    python scripts/benchmark_loader_settings.py -tc configs/template_train_config.json \
+        -sc configs/xcos_train_config.json --num_workers 0 4 8 --pin_memory 0 1 \
+        --persistent_workers 0 1 --epochs 2 --max_batches 200 -o loader_benchmark.json
+
+'''
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # NOQA
+import argparse
+import itertools
+import json
+import time
+from copy import deepcopy
+
+import data_loader.data_loaders as module_data
+from utils.benchmark import measure_loader
+from utils.global_config import global_config
+from utils.logging_config import logger
+
+LOADER_KEYS = ['data_loader', 'valid_data_loaders', 'test_data_loaders']
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-tc', '--template_config', type=str, required=True, help='Template config file')
+    parser.add_argument('-sc', '--specified_configs', type=str, nargs='+', default=None,
+                        help='Specified config files')
+    parser.add_argument('--loaders', type=str, nargs='+', default=None,
+                        help='Only benchmark loaders with these types or names (default: all)')
+    parser.add_argument('--num_workers', type=int, nargs='+', default=[0, 4])
+    parser.add_argument('--pin_memory', type=int, nargs='+', default=[0, 1])
+    parser.add_argument('--persistent_workers', type=int, nargs='+', default=[0, 1])
+    parser.add_argument('--prefetch_factor', type=int, nargs='+', default=[2])
+    parser.add_argument('--multiprocessing_context', type=str, nargs='+', default=['fork'])
+    parser.add_argument('--sharing_strategy', type=str, default=None,
+                        help='Tensor sharing strategy for all runs (e.g. file_system)')
+    parser.add_argument('--epochs', type=int, default=2,
+                        help='Number of epochs per setting (later epochs show the effect of persistent workers)')
+    parser.add_argument('--max_batches', type=int, default=100, help='Number of batches per epoch')
+    parser.add_argument('-o', '--output_filename', type=str, default=None, help='Output json file')
+    args = parser.parse_args()
+    return args
+
+
+def collect_loader_entries(config, selected=None):
+    """ Return (config key, loader config entry) pairs of all data loaders in a config """
+    entries = []
+    for key in LOADER_KEYS:
+        if key not in config:
+            continue
+        sub_entries = [config[key]] if key == 'data_loader' else list(config[key].values())
+        for entry in sub_entries:
+            name = entry['args'].get('name', entry['type'])
+            if selected is None or entry['type'] in selected or name in selected:
+                entries.append((key, entry))
+    return entries
+
+
+def iterate_settings(args):
+    """ Yield the swept settings, skipping worker-only settings that have no effect when num_workers == 0 """
+    seen = set()
+    grid = itertools.product(
+        args.num_workers, args.pin_memory, args.persistent_workers, args.prefetch_factor, args.multiprocessing_context)
+    for num_workers, pin_memory, persistent_workers, prefetch_factor, context in grid:
+        setting = {'num_workers': num_workers, 'pin_memory': bool(pin_memory)}
+        if num_workers > 0:
+            setting.update({
+                'persistent_workers': bool(persistent_workers),
+                'prefetch_factor': prefetch_factor,
+                'multiprocessing_context': context,
+            })
+        key = tuple(sorted(setting.items()))
+        if key not in seen:
+            seen.add(key)
+            yield setting
+
+
+def benchmark_loader(entry, setting, sharing_strategy, epochs, max_batches):
+    loader_args = deepcopy(entry['args'])
+    loader_args.update(setting)
+    if sharing_strategy is not None:
+        loader_args['sharing_strategy'] = sharing_strategy
+
+    start_time = time.time()
+    data_loader = getattr(module_data, entry['type'])(**loader_args)
+    result = {'construction_time': time.time() - start_time}
+    result['epochs'] = measure_loader(data_loader, epochs=epochs, max_batches=max_batches)
+    # Shut down persistent workers before the next setting
+    del data_loader
+    return result
+
+
+def main(args):
+    global_config.setup(args.template_config, args.specified_configs)
+    entries = collect_loader_entries(global_config, args.loaders)
+    logger.info(f"Benchmarking {len(entries)} data loaders")
+
+    results = []
+    for key, entry in entries:
+        name = entry['args'].get('name', entry['type'])
+        for setting in iterate_settings(args):
+            result = benchmark_loader(entry, setting, args.sharing_strategy, args.epochs, args.max_batches)
+            result.update({'config_key': key, 'type': entry['type'], 'name': name, 'setting': setting})
+            results.append(result)
+            epoch_summary = ', '.join([
+                f"ep{i + 1}: first {e['time_to_first_batch']:.2f}s, {e['samples_per_second']:.1f} samples/s"
+                for i, e in enumerate(result['epochs'])
+            ])
+            logger.info(f"{name} {setting}: build {result['construction_time']:.2f}s | {epoch_summary}")
+
+    if args.output_filename is not None:
+        with open(args.output_filename, 'w') as fout:
+            json.dump(results, fout, indent=4)
+        logger.info(f"{args.output_filename} written")
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    main(args)
@@ -0,0 +1,218 @@
+'''
+Benchmark the throughput and latency of the xCos model components on CPU: images/s, p50/p99
+latency and peak RSS of forward-only (eval, no_grad) and forward+backward (train) passes,
+across batch sizes, torch thread counts and precisions (fp32, and bf16/fp16 CPU autocast).
+Every case runs in a fresh process, so that the thread setting and the peak RSS of one case do
+not leak into the next. Results are written as JSON and/or CSV for comparison across commits.
+
+For the pairwise modules (GridCos, XCosAttention), an "image" is a pair of 32x7x7 grid features;
+for xCos_resnet/xCos_mobilefacenet (the xCosModel inference path, i.e. backbone + attention + grid
+cos, with the IR-SE or the MobileFaceNet grid backbone), it is a pair of face images.
+
+Example:
+    python scripts/benchmark_models.py --components Backbone_FC2Conv MobileFaceNet XCosAttention \
+        --batch_sizes 1 16 64 --num_threads 1 4 --precisions fp32 bf16 \
+        -o model_benchmark.json --csv model_benchmark.csv
+
+'''
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # NOQA
+import argparse
+import csv
+import itertools
+import json
+import time
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+import model.face_recog as module_face_recog
+import model.model as module_arch
+import model.xcos_modules as module_xcos
+from utils.benchmark import run_isolated
+from utils.logging_config import logger
+
+PRECISIONS = {
+    'fp32': None,
+    'bf16': torch.bfloat16,
+    'fp16': torch.float16,
+}
+MODES = ['forward', 'forward_backward']
+
+
+# ============ Components ==============
+def _images(batch_size):
+    return (torch.randn(batch_size, 3, 112, 112),)
+
+
+def _image_pairs(batch_size):
+    return (torch.randn(batch_size, 3, 112, 112), torch.randn(batch_size, 3, 112, 112))
+
+
+def _grid_feat_pairs(batch_size):
+    return (torch.randn(batch_size, 32, 7, 7), torch.randn(batch_size, 32, 7, 7))
+
+
+def _embeddings_and_labels(classnum):
+    def make_inputs(batch_size):
+        embeddings = F.normalize(torch.randn(batch_size, 512), dim=1)
+        return embeddings, torch.randint(0, classnum, (batch_size,))
+    return make_inputs
+
+
+class XCosInference(nn.Module):
+    """ Run xCosModel on a pair of image batches as the Tester/Evaluator do """
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, img1s, img2s):
+        return self.model({'data_input': (img1s, img2s)}, scenario='get_feature_and_xcos')
+
+
+def build_component(name, num_layers=50, classnum=51332):
+    """ Return the module and a function making its inputs of a given batch size """
+    if name == 'Backbone':
+        return module_face_recog.Backbone(num_layers, 0.4, 'ir'), _images
+    elif name == 'Backbone_FC2Conv':
+        return module_face_recog.Backbone_FC2Conv(num_layers, 0.4, 'ir'), _images
+    elif name == 'MobileFaceNet':
+        return module_face_recog.MobileFaceNet(512), _images
+    elif name == 'MobileFaceNet_FC2Conv':
+        return module_face_recog.MobileFaceNet_FC2Conv(512), _images
+    elif name in ['xCos_resnet', 'xCos_mobilefacenet']:
+        model = module_arch.xCosModel(net_depth=num_layers, class_num=classnum, backbone_arch=name.split('_')[1])
+        return XCosInference(model), _image_pairs
+    elif name == 'XCosAttention':
+        return module_xcos.XCosAttention(use_softmax=True, softmax_t=1, chw2hwc=True), _grid_feat_pairs
+    elif name == 'GridCos':
+        return module_xcos.GridCos(), _grid_feat_pairs
+    elif name == 'Arcface':
+        return module_face_recog.Arcface(embedding_size=512, classnum=classnum), _embeddings_and_labels(classnum)
+    elif name == 'Am_softmax':
+        return module_face_recog.Am_softmax(embedding_size=512, classnum=classnum), _embeddings_and_labels(classnum)
+    raise ValueError(f'Unknown component {name}')
+
+
+COMPONENTS = [
+    'Backbone', 'Backbone_FC2Conv', 'MobileFaceNet', 'MobileFaceNet_FC2Conv', 'XCosAttention', 'GridCos',
+    'Arcface', 'Am_softmax', 'xCos_resnet', 'xCos_mobilefacenet',
+]
+
+
+def _scalar_output(output):
+    """ Reduce the (nested) output of a component to a scalar to back-propagate from """
+    if torch.is_tensor(output):
+        return output.float().sum()
+    if isinstance(output, dict):
+        output = list(output.values())
+    return sum(_scalar_output(o) for o in output)
+
+
+def run_case(component, batch_size, num_threads, precision, mode, warmup, iterations, num_layers, classnum):
+    torch.set_num_threads(num_threads)
+    torch.manual_seed(0)
+    module, make_inputs = build_component(component, num_layers, classnum)
+    n_parameters = sum(p.numel() for p in module.parameters())
+    inputs = make_inputs(batch_size)
+    backward = mode == 'forward_backward'
+    if backward:
+        module.train()
+        # GridCos has no parameters; back-propagate to the (floating point) inputs instead
+        for x in inputs:
+            if x.is_floating_point():
+                x.requires_grad_(True)
+    else:
+        module.eval()
+
+    dtype = PRECISIONS[precision]
+
+    def step():
+        with torch.autocast('cpu', dtype=dtype, enabled=dtype is not None):
+            with torch.set_grad_enabled(backward):
+                output = module(*inputs)
+        if backward:
+            _scalar_output(output).backward()
+            module.zero_grad(set_to_none=True)
+            for x in inputs:
+                x.grad = None
+
+    for _ in range(warmup):
+        step()
+    latencies = []
+    for _ in range(iterations):
+        start_time = time.perf_counter()
+        step()
+        latencies.append(time.perf_counter() - start_time)
+    latencies = np.array(latencies) * 1000
+    return {
+        'n_parameters': n_parameters,
+        'images_per_second': batch_size / latencies.mean() * 1000,
+        'latency_mean_ms': latencies.mean(),
+        'latency_p50_ms': np.percentile(latencies, 50),
+        'latency_p99_ms': np.percentile(latencies, 99),
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--components', type=str, nargs='+', default=COMPONENTS, choices=COMPONENTS)
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=[1, 16, 64])
+    parser.add_argument('--num_threads', type=int, nargs='+', default=[1, torch.get_num_threads()])
+    parser.add_argument('--precisions', type=str, nargs='+', default=['fp32', 'bf16'], choices=list(PRECISIONS.keys()))
+    parser.add_argument('--modes', type=str, nargs='+', default=MODES, choices=MODES)
+    parser.add_argument('--warmup', type=int, default=3, help='Number of untimed iterations')
+    parser.add_argument('--iterations', type=int, default=20, help='Number of timed iterations')
+    parser.add_argument('--num_layers', type=int, default=50, help='Depth of Backbone/Backbone_FC2Conv/xCos_resnet')
+    parser.add_argument('--classnum', type=int, default=51332, help='Number of classes of Arcface/Am_softmax')
+    parser.add_argument('--timeout', type=float, default=None, help='Timeout of each case in seconds')
+    parser.add_argument('-o', '--output_filename', type=str, default=None, help='Output json file')
+    parser.add_argument('--csv', type=str, default=None, help='Output csv file')
+    args = parser.parse_args()
+    return args
+
+
+def main(args):
+    results = []
+    settings = itertools.product(args.components, args.modes, args.precisions, args.num_threads, args.batch_sizes)
+    for component, mode, precision, num_threads, batch_size in settings:
+        setting = {
+            'component': component, 'mode': mode, 'precision': precision,
+            'num_threads': num_threads, 'batch_size': batch_size,
+        }
+        if mode == 'forward_backward' and batch_size < 2:
+            # BatchNorm needs more than one sample per channel in training mode
+            continue
+        try:
+            result = run_isolated(
+                run_case, timeout=args.timeout, **setting, warmup=args.warmup, iterations=args.iterations,
+                num_layers=args.num_layers, classnum=args.classnum)
+        except Exception as e:
+            logger.warning(f'{setting} failed: {e}')
+            continue
+        result = {**setting, **result}
+        results.append(result)
+        logger.info(
+            f"{component} {mode} {precision} threads={num_threads} bs={batch_size}: "
+            f"{result['images_per_second']:.1f} images/s, p50 {result['latency_p50_ms']:.2f}ms, "
+            f"p99 {result['latency_p99_ms']:.2f}ms, peak RSS {result['peak_rss_mb']:.0f}MB"
+        )
+
+    if args.output_filename is not None:
+        with open(args.output_filename, 'w') as fout:
+            json.dump(results, fout, indent=4)
+        logger.info(f"{args.output_filename} written")
+    if args.csv is not None and len(results) > 0:
+        with open(args.csv, 'w', newline='') as fout:
+            writer = csv.DictWriter(fout, fieldnames=list(results[0].keys()))
+            writer.writeheader()
+            writer.writerows(results)
+        logger.info(f"{args.csv} written")
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    main(args)
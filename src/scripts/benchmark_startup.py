@@ -0,0 +1,165 @@
+'''
+Benchmark the startup time: the import time of the modules loaded by main.py, and the
+time-to-first-batch of `main.py --mode test` (imports, pipeline setup including data loaders,
+model and checkpoint loading, then the first test batch loaded and forwarded by the Tester).
+Every case runs in a fresh Python process, so that nothing is already imported or cached in memory
+(except the OS file cache), and the best of --repeat runs is reported.
+
+With --baseline (the JSON written by -o of a previous run), the script fails (exit code 1) if any
+case got slower than its baseline by more than --tolerance, to guard against import regressions.
+
+The arguments after "--" are passed to main.py for the time-to-first-batch case; without them only
+the import times are measured.
+
+Example:
+    python scripts/benchmark_startup.py -o startup.json -- -tc configs/xcos_testing.json \
+        -p ../pretrained_model/xcos/20200217_accu_9931_Arcface.pth
+    python scripts/benchmark_startup.py --baseline startup.json -- -tc configs/xcos_testing.json \
+        -p ../pretrained_model/xcos/20200217_accu_9931_Arcface.pth
+'''
+# Only lightweight modules are imported here; everything measured is imported by the case processes
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # NOQA
+import argparse
+import importlib
+import json
+import shutil
+import subprocess
+import tempfile
+import time
+
+IMPORTED_MODULES = ['utils.util', 'utils.verification', 'model.metric', 'model.model', 'main']
+# Modules which should only be imported on demand
+HEAVY_MODULES = ['matplotlib', 'seaborn', 'sklearn', 'scipy', 'cv2', 'torchvision']
+
+
+def import_case(module_name):
+    start_time = time.time()
+    importlib.import_module(module_name)
+    return {
+        'seconds': time.time() - start_time,
+        'heavy_modules': [name for name in HEAVY_MODULES if name in sys.modules],
+    }
+
+
+def first_batch_case(main_args):
+    start_time = time.time()
+    import main as main_module
+    import_time = time.time()
+
+    output_dir = tempfile.mkdtemp(prefix='startup_benchmark_')
+    try:
+        # The (absolute) outputs_subdir makes the saving directory a new temporary one
+        args = main_module.parse_args(main_args + ['--mode', 'test', '--outputs_subdir', output_dir])
+        pipeline = main_module.setup_pipeline(args)
+        setup_time = time.time()
+
+        tester = pipeline.workers[0]
+        tester._setup_model()
+        data = tester._data_to_device(next(iter(tester.data_loader)))
+        tester._run_and_optimize_model(data)
+        first_batch_time = time.time()
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+    return {
+        'seconds': first_batch_time - start_time,
+        'import_seconds': import_time - start_time,
+        'setup_seconds': setup_time - import_time,
+        'first_batch_seconds': first_batch_time - setup_time,
+    }
+
+
+def run_case(case, case_arg):
+    """ Run a case in a fresh interpreter; the wall time of the whole process (including the interpreter
+    startup) is added as process_seconds """
+    with tempfile.NamedTemporaryFile(suffix='.json') as result_file:
+        command = [sys.executable, os.path.abspath(__file__), '--case', case, '--result_file', result_file.name]
+        if case == 'import':
+            command += ['--module', case_arg]
+        else:
+            command += ['--'] + case_arg
+        start_time = time.time()
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+        process_seconds = time.time() - start_time
+        with open(result_file.name) as fin:
+            result = json.load(fin)
+    result['process_seconds'] = process_seconds
+    return result
+
+
+def check_regressions(results, baseline, tolerance, min_slack):
+    """ Names of the cases slower than (1 + tolerance) * baseline + min_slack seconds """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        limit = baseline[name]['seconds'] * (1 + tolerance) + min_slack
+        if result['seconds'] > limit:
+            regressions.append(name)
+            print(f"REGRESSION {name}: {result['seconds']:.3f}s > {limit:.3f}s "
+                  f"(baseline {baseline[name]['seconds']:.3f}s)")
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('main_args', nargs=argparse.REMAINDER,
+                        help='Arguments of main.py for the time-to-first-batch case, after "--"')
+    parser.add_argument('--modules', type=str, nargs='+', default=IMPORTED_MODULES,
+                        help='Modules whose import time is measured')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per case; the fastest one is reported')
+    parser.add_argument('-o', '--output_filename', type=str, default=None, help='Output JSON file')
+    parser.add_argument('--baseline', type=str, default=None, help='Results JSON of a previous run to compare to')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Allowed relative slowdown compared to the baseline')
+    parser.add_argument('--min_slack', type=float, default=0.05,
+                        help='Allowed absolute slowdown in seconds (for timing noise of fast cases)')
+    # Internal arguments of the case processes
+    parser.add_argument('--case', type=str, default=None, choices=['import', 'first_batch'], help=argparse.SUPPRESS)
+    parser.add_argument('--module', type=str, default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--result_file', type=str, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if len(args.main_args) > 0 and args.main_args[0] == '--':
+        args.main_args = args.main_args[1:]
+    return args
+
+
+def main(args):
+    if args.case is not None:
+        result = import_case(args.module) if args.case == 'import' else first_batch_case(args.main_args)
+        with open(args.result_file, 'w') as fout:
+            json.dump(result, fout)
+        return 0
+
+    cases = [(f'import {module_name}', 'import', module_name) for module_name in args.modules]
+    if len(args.main_args) > 0:
+        cases.append(('test first batch', 'first_batch', args.main_args))
+    results = {}
+    for name, case, case_arg in cases:
+        runs = [run_case(case, case_arg) for _ in range(args.repeat)]
+        results[name] = min(runs, key=lambda result: result['seconds'])
+        result = results[name]
+        message = f"{name:28s}: {result['seconds']:.3f}s (process {result['process_seconds']:.3f}s)"
+        if case == 'import':
+            message += f", heavy modules: {result['heavy_modules']}"
+        else:
+            message += (f", import {result['import_seconds']:.3f}s, setup {result['setup_seconds']:.3f}s, "
+                        f"first batch {result['first_batch_seconds']:.3f}s")
+        print(message)
+
+    if args.output_filename is not None:
+        with open(args.output_filename, 'w') as fout:
+            json.dump(results, fout, indent=2)
+    if args.baseline is not None:
+        with open(args.baseline) as fin:
+            baseline = json.load(fin)
+        if len(check_regressions(results, baseline, args.tolerance, args.min_slack)) > 0:
+            return 1
+        print(f'No regression compared to {args.baseline}')
+    return 0
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    sys.exit(main(args))
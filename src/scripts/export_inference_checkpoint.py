@@ -0,0 +1,103 @@
+'''
+Export an xCosModel checkpoint (e.g. the pretrained .pth written by utils/insight2xcos.py, or a
+training checkpoint) as an inference checkpoint: the grid backbone and attention parameters in half
+precision, in one .safetensors file with the arch entry (see model/inference_checkpoint.py).
+
+The arch entry is read from the config saved in the checkpoint, or from the given configs for
+checkpoints without one. With --compare, the cold start (building the model and loading the weights
+on CPU) of the original checkpoint and of the exported one are measured in fresh processes, and the
+xCos values of random pairs are compared.
+
+Example:
+    python scripts/export_inference_checkpoint.py -p ../pretrained_model/xcos/20200217_accu_9931_Arcface.pth \
+        -tc configs/xcos_train_config.json -o ../pretrained_model/xcos/20200217_accu_9931_Arcface.safetensors \
+        --compare
+'''
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # NOQA
+import argparse
+import time
+
+import torch
+
+import model.model as module_arch
+from model.inference_checkpoint import export_inference_checkpoint, load_inference_model
+from utils.benchmark import run_isolated
+from utils.checkpoint import load_checkpoint
+from utils.global_config import global_config
+from utils.logging_config import logger
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-p', '--checkpoint', type=str, required=True, help='Checkpoint to export')
+    parser.add_argument('-o', '--output_filename', type=str, required=True, help='Output .safetensors file')
+    parser.add_argument('-tc', '--template_config', type=str, default=None,
+                        help='Template config file, for checkpoints without a config')
+    parser.add_argument('-sc', '--specified_configs', type=str, nargs='+', default=None,
+                        help='Specified config files')
+    parser.add_argument('--dtype', type=str, default='float16', choices=['float16', 'float32'])
+    parser.add_argument('--compare', action='store_true',
+                        help='Measure the cold start of both checkpoints and compare their outputs')
+    args = parser.parse_args()
+    return args
+
+
+def get_arch_entry(checkpoint, args):
+    if 'config' in checkpoint:
+        return checkpoint['config']['arch']
+    if args.template_config is None:
+        raise ValueError(f'{args.checkpoint} has no config; give the arch by -tc/-sc')
+    global_config.setup(args.template_config, args.specified_configs)
+    return global_config['arch']
+
+
+def load_full_model(checkpoint_path, arch_entry):
+    start_time = time.time()
+    model = getattr(module_arch, arch_entry['type'])(**arch_entry['args'])
+    # Loaded fully (not memory-mapped), as a regular checkpoint loading before this format
+    checkpoint = load_checkpoint(checkpoint_path, keys=['state_dict'], mmap=False)
+    model.load_state_dict(checkpoint['state_dict'], strict=False)
+    return model.eval(), time.time() - start_time
+
+
+def cold_start_case(filename, arch_entry=None):
+    """ Run in a fresh process: the time to build and load the model (the full model if arch_entry is
+    given, else the inference model of filename), and its xCos values of fixed random pairs """
+    if arch_entry is not None:
+        model, elapsed_time = load_full_model(filename, arch_entry)
+    else:
+        start_time = time.time()
+        model = load_inference_model(filename)
+        elapsed_time = time.time() - start_time
+    generator = torch.Generator().manual_seed(0)
+    data = {'data_input': (torch.randn(4, 3, 112, 112, generator=generator),
+                           torch.randn(4, 3, 112, 112, generator=generator))}
+    with torch.no_grad():
+        x_coses = model(data, scenario='get_feature_and_xcos')['x_coses']
+    return {'seconds': elapsed_time, 'x_coses': x_coses.tolist()}
+
+
+def main(args):
+    checkpoint = load_checkpoint(args.checkpoint, keys=['state_dict', 'config'])
+    arch_entry = get_arch_entry(checkpoint, args)
+    tensors = export_inference_checkpoint(
+        checkpoint['state_dict'], arch_entry, args.output_filename, dtype=getattr(torch, args.dtype))
+    logger.info(f'{args.output_filename} written: {len(tensors)} of {len(checkpoint["state_dict"])} tensors, '
+                f'{os.path.getsize(args.output_filename) / 2 ** 20:.1f} MB '
+                f'(from {os.path.getsize(args.checkpoint) / 2 ** 20:.1f} MB)')
+
+    if args.compare:
+        full = run_isolated(cold_start_case, filename=args.checkpoint, arch_entry=arch_entry)
+        exported = run_isolated(cold_start_case, filename=args.output_filename)
+        max_diff = max(abs(a - b) for a, b in zip(full['x_coses'], exported['x_coses']))
+        for name, result in [('full model', full), ('inference model', exported)]:
+            logger.info(f"Cold start of the {name}: {result['seconds']:.2f}s, "
+                        f"peak RSS {result['peak_rss_mb']:.0f} MB")
+        logger.info(f'Max difference of xCos values: {max_diff:.5f}')
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    main(args)
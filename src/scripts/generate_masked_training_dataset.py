@@ -1,55 +1,110 @@
+'''
+Generate a masked face dataset by multiplying each face image with a random binary mask.
+
+Masks are loaded into memory once per worker process, images are processed in chunks
+(masks are applied to a whole chunk at once), and the mask of each image is chosen by a
+seed derived from (--seed, image path), so the output is deterministic regardless of the
+number of workers and the chunking. Finished images are appended to the output csv
+(`<output_dir>/imgs_masked<ratio>.csv`, rows of "output image,mask"), which also serves as
+the manifest to resume an interrupted run: images already listed are skipped.
+
+Example:
+    python scripts/generate_masked_training_dataset.py -r 25 -j 16 \
+        -md ../../datasets/face/masks -id ../../datasets/face/faces_emore/imgs \
+        -od ../../datasets/face/masked_ms1m
+
+'''
 import os
-import errno
+import zlib
 import argparse
-import numpy as np
 from glob import glob
+from multiprocessing import Pool
+
+import numpy as np
 from PIL import Image
 from tqdm import tqdm
-from joblib import Parallel, delayed
-
-
-def apply_single_mask(image_file, random_state):
-    random_state = np.random.RandomState(random_state)
-    mask_file = random_state.choice(mask_dir)
-    image = Image.open(image_file)
-    mask = Image.open(mask_file)
-    masked = np.array(image) * np.expand_dims(np.array(mask), 2)
-
-    name = os.path.basename(image_file)
-    out_subdir = os.path.basename(os.path.dirname(image_file))
-    if not os.path.exists(os.path.join(out_dir, out_subdir)):
-        try:
-            os.makedirs(os.path.join(out_dir, out_subdir))
-        except OSError as e:
-            if e.errno != errno.EEXIST:
-                raise OSError
-            # time.sleep might help here
-            pass
-    out_file = os.path.join(out_dir, out_subdir, name)
-    Image.fromarray(masked).save(out_file)
-
-    mask_number = os.path.join(os.path.basename(os.path.dirname(mask_file)), os.path.basename(mask_file))
-    output_name = os.path.join(os.path.basename(out_dir), out_subdir, name)
-    # csv_content.append((output_name, mask_number))
-    return (output_name, mask_number)
-
-
-def apply_mask(img_dir, mask_dir, out_dir, csv_path, n_jobs):
-    if not os.path.exists(out_dir):
-        os.makedirs(out_dir)
-    csv_content = []
-    print(f'>>> Img_dir[0]:{img_dir[0]}')
-    print(f'>>> mask_dir[0]:{mask_dir[0]}')
+
+# Masks loaded by each worker in `init_worker`
+_masks = None
+_mask_names = None
+
+
+def load_masks(mask_paths):
+    """ Load binary masks as a [N, H, W] uint8 array and their names as "<ratio dir>/<file>" """
+    masks = np.stack([np.array(Image.open(path)) for path in mask_paths])
+    names = [os.path.join(os.path.basename(os.path.dirname(path)), os.path.basename(path)) for path in mask_paths]
+    return masks, names
+
+
+def init_worker(mask_paths):
+    global _masks, _mask_names
+    _masks, _mask_names = load_masks(mask_paths)
+
+
+def image_seed(seed, rel_path):
+    """ Deterministic per-image seed """
+    return zlib.crc32(f'{seed}:{rel_path}'.encode('utf-8'))
+
+
+def apply_masks(images, masks):
+    """ Apply masks [B, H, W] to images [B, H, W, C] """
+    return images * masks[..., None]
+
+
+def process_chunk(job):
+    """ Mask a chunk of images and save them. Return the csv rows of the chunk. """
+    image_dir, out_dir, rel_paths, seed = job
+    mask_indices = [
+        np.random.RandomState(image_seed(seed, rel_path)).randint(len(_masks)) for rel_path in rel_paths
+    ]
+    images = [np.array(Image.open(os.path.join(image_dir, rel_path))) for rel_path in rel_paths]
+    if all(image.shape == images[0].shape for image in images):
+        masked_images = apply_masks(np.stack(images), _masks[mask_indices])
+    else:
+        masked_images = [apply_masks(image[None], _masks[[i]])[0] for image, i in zip(images, mask_indices)]
+
+    rows = []
+    out_dir_name = os.path.basename(out_dir)
+    for rel_path, masked, mask_idx in zip(rel_paths, masked_images, mask_indices):
+        Image.fromarray(masked).save(os.path.join(out_dir, rel_path))
+        rows.append((os.path.join(out_dir_name, rel_path), _mask_names[mask_idx]))
+    return rows
+
+
+def read_finished(csv_path):
+    """ Return the output names already listed in the csv of a previous run """
+    if not os.path.exists(csv_path):
+        return set()
+    with open(csv_path) as fin:
+        return set(line.split(',')[0] for line in fin if line.strip())
+
+
+def apply_mask(image_paths, image_dir, mask_paths, out_dir, csv_path, n_jobs, chunk_size, seed):
+    print(f'>>> image_paths[0]:{image_paths[0]}')
+    print(f'>>> mask_paths[0]:{mask_paths[0]}')
     print(f'>>> out_dir:{out_dir}')
     print(f'>>> csv_path:{csv_path}')
 
-    csv_content = Parallel(n_jobs=n_jobs,
-                           backend="multiprocessing")(delayed(apply_single_mask)(image_file, None)
-                                                      for image_file in tqdm(img_dir, total=len(img_dir)))
-    # [print(c[1]) for c in csv_content]
-    with open(csv_path, 'w') as filehandle:
-        for listitem in csv_content:
-            filehandle.write(f'{listitem[0]},{listitem[1]}\n')
+    rel_paths = sorted(os.path.relpath(path, image_dir) for path in image_paths)
+    finished = read_finished(csv_path)
+    out_dir_name = os.path.basename(out_dir)
+    rel_paths = [path for path in rel_paths if os.path.join(out_dir_name, path) not in finished]
+    print(f'>>> {len(finished)} images finished before, {len(rel_paths)} images to go')
+
+    # Create all output directories once instead of checking them for every image
+    for subdir in sorted(set(os.path.dirname(path) for path in rel_paths)):
+        os.makedirs(os.path.join(out_dir, subdir), exist_ok=True)
+
+    jobs = [
+        (image_dir, out_dir, rel_paths[i:i + chunk_size], seed)
+        for i in range(0, len(rel_paths), chunk_size)
+    ]
+    with Pool(n_jobs, initializer=init_worker, initargs=(mask_paths,)) as pool, open(csv_path, 'a') as fout:
+        with tqdm(total=len(rel_paths)) as progress:
+            for rows in pool.imap_unordered(process_chunk, jobs):
+                fout.writelines([f'{output_name},{mask_name}\n' for output_name, mask_name in rows])
+                fout.flush()
+                progress.update(len(rows))
 
 
 def parse_args():
@@ -79,6 +134,18 @@ def parse_args():
         type=str,
         default='../../datasets/face/masked_ms1m'
     )
+    parser.add_argument(
+        '-cs', '--chunk_size',
+        type=int,
+        default=256,
+        help='Number of images processed by a worker at once'
+    )
+    parser.add_argument(
+        '-s', '--seed',
+        type=int,
+        default=0,
+        help='Seed from which the per-image mask seeds are derived'
+    )
     args = parser.parse_args()
     return args
 
@@ -86,11 +153,10 @@ def parse_args():
 if __name__ == '__main__':
     args = parse_args()
     ratio = args.mask_ratio
-    mask_dir = glob(os.path.join(args.mask_dir, f'{ratio}/*'))
-    img_dir = glob(os.path.join(args.image_dir, '**/*.jpg'))
+    mask_paths = sorted(glob(os.path.join(args.mask_dir, f'{ratio}/*')))
+    image_paths = glob(os.path.join(args.image_dir, '**/*.jpg'))
     out_dir = os.path.join(args.output_dir, f'imgs_masked{ratio}')
     csv_path = out_dir + '.csv'
-    # print(img_dir)
-    print(len(img_dir))
-    # np.random.seed(9487)
-    apply_mask(img_dir, mask_dir, out_dir, csv_path, args.n_jobs)
+    print(len(image_paths))
+    os.makedirs(out_dir, exist_ok=True)
+    apply_mask(image_paths, args.image_dir, mask_paths, out_dir, csv_path, args.n_jobs, args.chunk_size, args.seed)
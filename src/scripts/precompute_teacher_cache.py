@@ -0,0 +1,87 @@
+'''
+Precompute the teacher cache of the 'distillation' optimize strategy: the grid features of the
+teacher's backbone for every image of the training set, in dataset index order, written by
+StreamingOutputWriter (a memory-mapped grid_feats.npy of [N, 32, 7, 7] and a manifest).
+
+The teacher and the training data loader (a FaceDataLoader) are read from the same configs as
+training, and the images are transformed as the training loader does without random flips. Point
+distillation.teacher_cache to the output directory to train the student from the cache.
+
+Example:
+    python scripts/precompute_teacher_cache.py -tc configs/xcos_train_config.json \
+        -sc configs/train/distillation_mobilefacenet.json -o ../datasets/face/CASIA/teacher_cache
+'''
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # NOQA
+import argparse
+
+import torch
+from torch.utils.data import DataLoader, Dataset
+from tqdm import tqdm
+
+import data_loader.data_loaders as module_data
+from model.distillation import build_teacher_model
+from utils.global_config import global_config
+from utils.logging_config import logger
+from utils.output_writer import StreamingOutputWriter
+
+
+class SingleImages(Dataset):
+    """ The images of a SiameseImageFolder one by one, in index order """
+    def __init__(self, dataset):
+        self.dataset = dataset
+
+    def __getitem__(self, index):
+        img, _ = self.dataset._load_sample(index)
+        return img
+
+    def __len__(self):
+        return len(self.dataset)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-tc', '--template_config', type=str, required=True, help='Template config file')
+    parser.add_argument('-sc', '--specified_configs', type=str, nargs='+', default=None,
+                        help='Specified config files')
+    parser.add_argument('-o', '--output_dir', type=str, default=None,
+                        help='Output directory (default: distillation.teacher_cache of the config)')
+    parser.add_argument('--batch_size', type=int, default=256)
+    parser.add_argument('--num_workers', type=int, default=4)
+    parser.add_argument('--dtype', type=str, default='float16', choices=['float16', 'float32'],
+                        help='Storage dtype of the grid features')
+    args = parser.parse_args()
+    return args
+
+
+def main(args):
+    global_config.setup(args.template_config, args.specified_configs)
+    entry = global_config['distillation']
+    output_dir = args.output_dir if args.output_dir is not None else entry.get('teacher_cache', None)
+    if output_dir is None:
+        raise ValueError('No output directory given by -o or distillation.teacher_cache')
+    device = torch.device('cuda:0' if torch.cuda.is_available() else 'cpu')
+
+    teacher = build_teacher_model(entry['teacher'], entry['teacher_checkpoint']).to(device).eval()
+    loader_entry = global_config['data_loader']
+    loader_args = {
+        **loader_entry['args'], 'shuffle': False, 'validation_split': 0.0, 'num_workers': 0, 'horizontal_flip': False,
+    }
+    dataset = SingleImages(getattr(module_data, loader_entry['type'])(**loader_args).dataset)
+    data_loader = DataLoader(dataset, batch_size=args.batch_size, shuffle=False, num_workers=args.num_workers,
+                             pin_memory=device.type == 'cuda')
+
+    logger.info(f'Writing teacher grid features of {len(dataset)} images to {output_dir}')
+    writer = StreamingOutputWriter(output_dir, len(dataset))
+    with torch.no_grad():
+        for imgs in tqdm(data_loader):
+            _, grid_feats = teacher.backbone(imgs.to(device, non_blocking=True))
+            writer.write('grid_feats', grid_feats.to(getattr(torch, args.dtype)), len(imgs))
+    manifest_path = writer.close()
+    logger.info(f'{manifest_path} written')
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    main(args)
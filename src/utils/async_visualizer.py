@@ -0,0 +1,98 @@
+'''
+async_visualizer.py
+
+Render and save xCos visualizations in a process pool so that inference does not wait
+for matplotlib. Batches of (image1, image2, grid_cos_map, attention_map) are submitted to
+a bounded queue of pending jobs; when the queue is full, the submitting side either blocks
+or drops the batch according to the drop policy.
+'''
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .logging_config import logger
+
+
+def _init_render_worker():
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+def render_and_save(img1s, img2s, grid_cos_maps, attention_maps, output_paths, renderer='matplotlib'):
+    """ Render xCos visualizations of a batch and save them to output_paths. """
+    from torchvision.utils import save_image
+    from .util import batch_visualize_xcos
+    visualizations = batch_visualize_xcos(img1s, img2s, grid_cos_maps, attention_maps, renderer=renderer)
+    for visualization, output_path in zip(visualizations, output_paths):
+        save_image(visualization, output_path)
+    return len(output_paths)
+
+
+class AsyncXCosVisualizer():
+    """ Process-pool stage that consumes xCos visualization jobs.
+
+    Args:
+        num_workers (int): number of rendering processes. If 0, jobs are rendered synchronously.
+        max_queue_size (int): maximum number of pending (submitted but unfinished) batches.
+        drop_policy (str): 'block' waits for the oldest job when the queue is full,
+            'drop' discards the incoming batch instead.
+        sample_rate (float): fraction of pairs to be visualized; the rest are skipped.
+        renderer (str): 'matplotlib' or 'fast', see utils.util.batch_visualize_xcos.
+    """
+    def __init__(self, num_workers=2, max_queue_size=8, drop_policy='block', sample_rate=1.0,
+                 renderer='matplotlib', seed=0):
+        assert drop_policy in ['block', 'drop'], f'Unknown drop policy {drop_policy}'
+        self.max_queue_size = max_queue_size
+        self.drop_policy = drop_policy
+        self.sample_rate = sample_rate
+        self.renderer = renderer
+        self.random_state = np.random.RandomState(seed)
+        self.executor = None
+        if num_workers > 0:
+            # Use spawn to avoid forking a process that has initialized CUDA
+            self.executor = ProcessPoolExecutor(
+                num_workers, mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_render_worker)
+        self.pending = deque()
+        self.stats = {'rendered': 0, 'dropped': 0, 'skipped': 0}
+
+    def submit(self, img1s, img2s, grid_cos_maps, attention_maps, output_paths):
+        """ Submit a batch of pairs (numpy arrays with the batch dimension first) to be rendered. """
+        kept = self.random_state.random_sample(len(output_paths)) < self.sample_rate
+        self.stats['skipped'] += int((~kept).sum())
+        if not kept.any():
+            return
+        job = (img1s[kept], img2s[kept], grid_cos_maps[kept], attention_maps[kept],
+               [path for path, keep in zip(output_paths, kept) if keep], self.renderer)
+
+        if self.executor is None:
+            self.stats['rendered'] += render_and_save(*job)
+            return
+
+        self._collect_finished()
+        if len(self.pending) >= self.max_queue_size:
+            if self.drop_policy == 'drop':
+                self.stats['dropped'] += int(kept.sum())
+                return
+            self.stats['rendered'] += self.pending.popleft().result()
+        self.pending.append(self.executor.submit(render_and_save, *job))
+
+    def _collect_finished(self):
+        still_pending = deque()
+        for future in self.pending:
+            if future.done():
+                self.stats['rendered'] += future.result()
+            else:
+                still_pending.append(future)
+        self.pending = still_pending
+
+    def close(self):
+        """ Wait for all pending jobs and shut down the process pool. """
+        while len(self.pending) > 0:
+            self.stats['rendered'] += self.pending.popleft().result()
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+        logger.info(f'xCos visualizations: {self.stats}')
@@ -0,0 +1,112 @@
+'''
+benchmark.py
+
+Measurement helpers shared by the benchmark scripts under scripts/: throughput and
+time-to-first-batch of data loaders, CPU time of the process and its (DataLoader worker)
+children, peak RSS, and running a benchmark case in a fresh process so that its peak RSS is
+not polluted by the previous cases.
+'''
+import json
+import multiprocessing
+import queue as queue_module
+import resource
+import sys
+import time
+import traceback
+
+import torch
+
+
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    """ Peak resident set size in MB. For RUSAGE_CHILDREN, it is the peak of the largest waited-for child. """
+    max_rss = resource.getrusage(who).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return max_rss / (1 << 20) if sys.platform == 'darwin' else max_rss / 1024
+
+
+def cpu_seconds(who=resource.RUSAGE_SELF):
+    """ User + system CPU time in seconds. For RUSAGE_CHILDREN only terminated and waited-for children count. """
+    usage = resource.getrusage(who)
+    return usage.ru_utime + usage.ru_stime
+
+
+def count_samples(batch):
+    """ Return the batch size of a (nested) batch, i.e. the leading dimension of its first tensor """
+    if torch.is_tensor(batch):
+        return batch.shape[0] if batch.dim() > 0 else 1
+    if isinstance(batch, dict):
+        batch = list(batch.values())
+    if isinstance(batch, (list, tuple)):
+        for value in batch:
+            n = count_samples(value)
+            if n is not None:
+                return n
+    return None
+
+
+def measure_loader(data_loader, epochs=1, max_batches=None):
+    """ Iterate over a data loader and return per-epoch throughput and resource usage.
+
+    Each epoch creates a new iterator which is deleted at the end of the epoch, so that (non-persistent)
+    workers are joined and their CPU time is accounted in RUSAGE_CHILDREN.
+    """
+    results = []
+    for _ in range(epochs):
+        main_cpu_start = cpu_seconds()
+        worker_cpu_start = cpu_seconds(resource.RUSAGE_CHILDREN)
+        start_time = time.time()
+        first_batch_time = None
+        n_samples = 0
+        n_batches = 0
+        iterator = iter(data_loader)
+        for batch in iterator:
+            if first_batch_time is None:
+                first_batch_time = time.time() - start_time
+            n_samples += count_samples(batch) or 0
+            n_batches += 1
+            if max_batches is not None and n_batches >= max_batches:
+                break
+        elapsed_time = time.time() - start_time
+        del iterator
+        results.append({
+            'n_batches': n_batches,
+            'n_samples': n_samples,
+            'time_to_first_batch': first_batch_time,
+            'elapsed_time': elapsed_time,
+            'samples_per_second': n_samples / elapsed_time if elapsed_time > 0 else None,
+            'main_cpu_seconds': cpu_seconds() - main_cpu_start,
+            'worker_cpu_seconds': cpu_seconds(resource.RUSAGE_CHILDREN) - worker_cpu_start,
+        })
+    return results
+
+
+def _run_and_put(queue, fn, kwargs):
+    try:
+        result = fn(**kwargs)
+        result['peak_rss_mb'] = peak_rss_mb()
+        result['peak_child_rss_mb'] = peak_rss_mb(resource.RUSAGE_CHILDREN)
+        queue.put(('ok', json.dumps(result)))
+    except Exception:
+        queue.put(('error', traceback.format_exc()))
+
+
+def run_isolated(fn, timeout=None, **kwargs):
+    """ Run `fn(**kwargs)` (returning a JSON-serializable dict) in a new spawned process and return its
+    result with the peak RSS of that process added. `fn` must be importable, i.e. defined at module level.
+
+    A plain (non-daemonic) Process is used instead of a Pool so that fn can start DataLoader workers.
+    """
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    process = context.Process(target=_run_and_put, args=(queue, fn, kwargs))
+    process.start()
+    try:
+        status, payload = queue.get(timeout=timeout)
+    except queue_module.Empty:
+        process.terminate()
+        raise
+    finally:
+        process.join()
+    if status != 'ok':
+        raise RuntimeError(f'Benchmark case failed:\n{payload}')
+    return json.loads(payload)
@@ -0,0 +1,229 @@
+'''
+checkpoint.py
+
+Write training checkpoints in a background thread. The state is copied to CPU memory on the
+calling thread (the only part training waits for), then serialized to a temporary file that is
+atomically renamed to the checkpoint filename, so an interrupted write never leaves a truncated
+checkpoint behind. Older checkpoints are deleted according to a keep-last/keep-best policy.
+
+It also captures/restores the RNG states of the main process for mid-epoch resuming, loads
+checkpoints memory-mapped so that only the tensors actually used are read from disk, and reads/writes
+flat tensor files in the safetensors layout (used by inference checkpoints) without the safetensors package.
+'''
+import os
+import json
+import time
+import random
+import struct
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+
+from .logging_config import logger
+
+
+def snapshot_to_cpu(obj):
+    """ Return a copy of a (nested) state whose tensors are detached CPU copies, so that training can
+    go on modifying the original tensors in place while the copy is being written. """
+    if torch.is_tensor(obj):
+        return obj.detach().to('cpu', copy=True)
+    if isinstance(obj, dict):
+        return {key: snapshot_to_cpu(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)) and not hasattr(obj, '_fields'):
+        return type(obj)(snapshot_to_cpu(value) for value in obj)
+    return obj
+
+
+def get_rng_states():
+    """ RNG states of python, numpy, torch and CUDA (all devices) of the main process """
+    return {
+        'python': random.getstate(),
+        'numpy': np.random.get_state(),
+        'torch': torch.get_rng_state(),
+        'cuda': torch.cuda.get_rng_state_all() if torch.cuda.is_available() else [],
+    }
+
+
+def set_rng_states(states):
+    random.setstate(states['python'])
+    np.random.set_state(states['numpy'])
+    torch.set_rng_state(states['torch'])
+    if torch.cuda.is_available() and len(states['cuda']) == torch.cuda.device_count():
+        torch.cuda.set_rng_state_all(states['cuda'])
+
+
+def atomic_torch_save(state, filename):
+    """ torch.save to a temporary file in the same directory, then rename it to filename """
+    tmp_filename = f'{filename}.tmp'
+    with open(tmp_filename, 'wb') as fout:
+        torch.save(state, fout)
+        fout.flush()
+        os.fsync(fout.fileno())
+    os.replace(tmp_filename, filename)
+
+
+def load_checkpoint(filename, keys=None, map_location='cpu', mmap=True):
+    """ Load a checkpoint onto map_location.
+
+    Args:
+        keys (list): top-level keys to keep (None: all of them). With mmap, the tensors under the other keys
+            (e.g. 'optimizers' outside training) are never read from disk.
+        mmap (bool): memory-map the file, so that tensors are read lazily when used. It needs PyTorch >= 2.1 and
+            a checkpoint of the zipfile format (the default since PyTorch 1.6); otherwise it is loaded fully.
+    """
+    start_time = time.time()
+    checkpoint = None
+    if mmap:
+        try:
+            # Checkpoints hold configs and RNG states besides tensors, so they are not weights-only (the
+            # default since PyTorch 2.6)
+            checkpoint = torch.load(filename, map_location=map_location, mmap=True, weights_only=False)
+        except (TypeError, RuntimeError) as err:
+            logger.warning(f'Cannot memory-map {filename} ({err}); loading it fully')
+    if checkpoint is None:
+        try:
+            checkpoint = torch.load(filename, map_location=map_location, weights_only=False)
+        except TypeError:
+            # PyTorch < 1.13 has no weights_only (and always loads full pickles)
+            checkpoint = torch.load(filename, map_location=map_location)
+    if keys is not None:
+        checkpoint = {key: value for key, value in checkpoint.items() if key in keys}
+    logger.info(f'Loaded {sorted(checkpoint.keys())} of {filename} in {time.time() - start_time:.2f}s')
+    return checkpoint
+
+
+# dtype names of the safetensors format
+SAFETENSORS_DTYPES = {
+    'F64': np.float64, 'F32': np.float32, 'F16': np.float16,
+    'I64': np.int64, 'I32': np.int32, 'I16': np.int16, 'I8': np.int8, 'U8': np.uint8, 'BOOL': np.bool_,
+}
+
+
+def save_safetensors(tensors, filename, metadata=None):
+    """ Write a dict of tensors as one file of the safetensors format: an 8-byte little-endian header size,
+    a JSON header (dtype, shape and data offsets of each tensor, and string metadata) and the raw contiguous
+    data of the tensors. Tensors are ordered by decreasing item size, so every tensor is aligned. """
+    dtype_names = {np.dtype(dtype): name for name, dtype in SAFETENSORS_DTYPES.items()}
+    arrays = {key: tensor.detach().cpu().contiguous().numpy() for key, tensor in tensors.items()}
+    keys = sorted(arrays.keys(), key=lambda key: -arrays[key].itemsize)
+    header = {} if metadata is None else {'__metadata__': {key: str(value) for key, value in metadata.items()}}
+    offset = 0
+    for key in keys:
+        array = arrays[key]
+        header[key] = {
+            'dtype': dtype_names[array.dtype],
+            'shape': list(array.shape),
+            'data_offsets': [offset, offset + array.nbytes],
+        }
+        offset += array.nbytes
+    header_bytes = json.dumps(header, separators=(',', ':')).encode('utf-8')
+    # Pad with spaces so that the data starts 8-byte aligned
+    header_bytes += b' ' * (-len(header_bytes) % 8)
+
+    tmp_filename = f'{filename}.tmp'
+    with open(tmp_filename, 'wb') as fout:
+        fout.write(struct.pack('<Q', len(header_bytes)))
+        fout.write(header_bytes)
+        for key in keys:
+            fout.write(arrays[key].tobytes())
+    os.replace(tmp_filename, filename)
+
+
+def load_safetensors(filename):
+    """ Read a file written by save_safetensors (or the safetensors package) as (tensors, metadata). The tensors
+    are views of a copy-on-write memory map of the file, so their data is read from disk when used. """
+    with open(filename, 'rb') as fin:
+        header_size, = struct.unpack('<Q', fin.read(8))
+        header = json.loads(fin.read(header_size).decode('utf-8'))
+    metadata = header.pop('__metadata__', {})
+    data = np.memmap(filename, dtype=np.uint8, mode='c', offset=8 + header_size)
+    tensors = {}
+    for key, info in header.items():
+        start, end = info['data_offsets']
+        array = data[start:end].view(SAFETENSORS_DTYPES[info['dtype']]).reshape(tuple(info['shape']))
+        tensors[key] = torch.from_numpy(array)
+    return tensors, metadata
+
+
+class AsyncCheckpointWriter():
+    """ Background checkpoint writer with a retention policy.
+
+    Args:
+        keep_last (int): number of most recent checkpoints to keep. If None, no checkpoint is removed.
+        keep_best (int): number of most recent best checkpoints kept in addition (None: all of them).
+        keep_iterations (int): number of most recent mid-epoch checkpoints to keep (None: all of them). They
+            do not count toward keep_last, and are all removed once an epoch checkpoint is written after them.
+        asynchronous (bool): if False, checkpoints are written on the calling thread.
+        max_pending (int): maximum number of checkpoints being written; save() waits for the oldest
+            one beyond that, which bounds the memory used by the CPU snapshots.
+    """
+    def __init__(self, keep_last=None, keep_best=None, keep_iterations=1, asynchronous=True, max_pending=1):
+        self.keep_last = keep_last
+        self.keep_best = keep_best
+        self.keep_iterations = keep_iterations
+        self.max_pending = max_pending
+        self.executor = ThreadPoolExecutor(1) if asynchronous else None
+        self.pending = deque()
+        # Written epoch checkpoints in saving order, as (filename, is_best), and written mid-epoch checkpoints;
+        # only accessed by the writing thread
+        self.written = []
+        self.written_iterations = []
+
+    def save(self, state, filename, is_best=False, is_iteration=False):
+        """ Save an epoch checkpoint, or a mid-epoch one if is_iteration """
+        state = snapshot_to_cpu(state)
+        if self.executor is None:
+            self._write(state, filename, is_best, is_iteration)
+            return
+        while len(self.pending) >= self.max_pending:
+            # Raises the exception of a failed write
+            self.pending.popleft().result()
+        self.pending.append(self.executor.submit(self._write, state, filename, is_best, is_iteration))
+
+    def _write(self, state, filename, is_best, is_iteration):
+        atomic_torch_save(state, filename)
+        if is_iteration:
+            self.written_iterations.append(filename)
+            self._apply_iteration_retention()
+        else:
+            self.written.append((filename, is_best))
+            # The mid-epoch checkpoints are superseded by the epoch checkpoint
+            self._remove(self.written_iterations)
+            self.written_iterations = []
+            self._apply_retention()
+
+    def _remove(self, filenames):
+        for filename in filenames:
+            if os.path.exists(filename):
+                os.remove(filename)
+                logger.info(f"Removing checkpoint: {filename} ...")
+
+    def _apply_iteration_retention(self):
+        """ Keep the keep_iterations most recent mid-epoch checkpoints """
+        if self.keep_iterations is None or len(self.written_iterations) <= self.keep_iterations:
+            return
+        n_removed = len(self.written_iterations) - self.keep_iterations
+        self._remove(self.written_iterations[:n_removed])
+        self.written_iterations = self.written_iterations[n_removed:]
+
+    def _apply_retention(self):
+        """ Keep the keep_last most recent checkpoints and the keep_best most recent best ones """
+        if self.keep_last is None:
+            return
+        kept = set(filename for filename, _ in self.written[max(len(self.written) - self.keep_last, 0):])
+        best = [filename for filename, is_best in self.written if is_best]
+        kept.update(best if self.keep_best is None else best[max(len(best) - self.keep_best, 0):])
+        self._remove([filename for filename, _ in self.written if filename not in kept])
+        self.written = [(filename, is_best) for filename, is_best in self.written if filename in kept]
+
+    def wait(self):
+        """ Wait for all pending writes """
+        while len(self.pending) > 0:
+            self.pending.popleft().result()
+
+    def close(self):
+        self.wait()
+        if self.executor is not None:
+            self.executor.shutdown()
@@ -0,0 +1,153 @@
+'''
+output_writer.py
+
+Streaming writer for inference outputs. Instead of keeping every batch in Python lists and
+calling np.savez at the end of testing, each batch is appended to a preallocated memory-mapped
+.npy file per key (or to chunk files for non-numeric keys). A manifest.json describes the written
+arrays so that downstream evaluation can read them lazily with `load_streamed_outputs`.
+
+Unlike the lists saved by the Tester without streaming, a tuple output such as the (feat1s, feat2s) pairs
+of 'flatten_feats'/'grid_feats' is stored as one (N, 2, ...) array, whose [:, j] holds the j-th elements;
+such keys have "layout": "tuple" in the manifest (and "rows" otherwise).
+'''
+import os
+import json
+from collections.abc import Mapping
+
+import numpy as np
+import torch
+
+from .util import ensure_dir
+
+MANIFEST_FILENAME = 'manifest.json'
+
+
+def batch_layout(value, batch_size):
+    """ 'tuple' if to_numpy_batch stacks the elements of a list/tuple value along axis 1, else 'rows' """
+    if isinstance(value, (list, tuple)) and len(value) > 0:
+        shapes = [tuple(v.shape) if hasattr(v, 'shape') else np.shape(v) for v in value]
+        if all(len(shape) > 0 and shape[0] == batch_size for shape in shapes):
+            return 'tuple'
+    return 'rows'
+
+
+def to_numpy_batch(value, batch_size):
+    """ Convert a batched value from a data/model output dictionary into a numpy array whose first
+    dimension is the batch dimension.
+
+    Tensors/arrays are converted directly. For a list/tuple whose elements all have `batch_size`
+    as leading dimension (e.g. the (feat1s, feat2s) pairs), elements are stacked along axis 1 so
+    that each row holds one pair. Otherwise the list is regarded as per-sample items and is
+    stacked along axis 0.
+    """
+    if torch.is_tensor(value):
+        return value.detach().cpu().numpy()
+    if isinstance(value, (list, tuple)):
+        elems = [to_numpy_batch(v, batch_size) for v in value]
+        return np.stack(elems, axis=1 if batch_layout(value, batch_size) == 'tuple' else 0)
+    return np.asarray(value)
+
+
+class StreamingOutputWriter():
+    """ Append batches of inference outputs to per-key files under `output_dir`.
+
+    Numeric keys are written into memory-mapped .npy files preallocated for `n_samples` rows,
+    so the memory usage does not grow with the size of the test set. Keys with non-numeric
+    dtypes (e.g. paths) are written as one chunk file per batch.
+    """
+    def __init__(self, output_dir, n_samples):
+        self.output_dir = output_dir
+        self.n_samples = n_samples
+        self._arrays = {}
+        self._chunks = {}
+        self._offsets = {}
+        self._layouts = {}
+        ensure_dir(self.output_dir)
+
+    def write(self, key, value, batch_size):
+        self._layouts.setdefault(key, batch_layout(value, batch_size))
+        array = to_numpy_batch(value, batch_size)
+        if array.dtype.kind in 'biufc':
+            self._write_memmap(key, array)
+        else:
+            self._write_chunk(key, array)
+
+    def _write_memmap(self, key, array):
+        if key not in self._arrays:
+            path = os.path.join(self.output_dir, f'{key}.npy')
+            self._arrays[key] = np.lib.format.open_memmap(
+                path, mode='w+', dtype=array.dtype, shape=(self.n_samples,) + array.shape[1:])
+            self._offsets[key] = 0
+        start = self._offsets[key]
+        end = start + len(array)
+        if end > self.n_samples:
+            raise ValueError(f'Too many rows written for key "{key}" ({end} > {self.n_samples})')
+        self._arrays[key][start:end] = array
+        self._offsets[key] = end
+
+    def _write_chunk(self, key, array):
+        chunks = self._chunks.setdefault(key, [])
+        filename = f'{key}_chunk{len(chunks):06d}.npy'
+        np.save(os.path.join(self.output_dir, filename), array, allow_pickle=True)
+        chunks.append(filename)
+        self._offsets[key] = self._offsets.get(key, 0) + len(array)
+
+    def close(self):
+        """ Flush all memory-mapped arrays and write the manifest. Return the manifest path. """
+        manifest = {'n_samples': self.n_samples, 'keys': {}}
+        for key, array in self._arrays.items():
+            array.flush()
+            manifest['keys'][key] = {
+                'format': 'memmap',
+                'file': f'{key}.npy',
+                'length': self._offsets[key],
+                'shape': list(array.shape),
+                'dtype': array.dtype.str,
+                'layout': self._layouts[key],
+            }
+        for key, chunks in self._chunks.items():
+            manifest['keys'][key] = {
+                'format': 'chunks',
+                'files': chunks,
+                'length': self._offsets[key],
+                'layout': self._layouts[key],
+            }
+        self._arrays = {}
+        manifest_path = os.path.join(self.output_dir, MANIFEST_FILENAME)
+        with open(manifest_path, 'w') as fout:
+            json.dump(manifest, fout, indent=4)
+        return manifest_path
+
+
+class StreamedOutputs(Mapping):
+    """ Read-only mapping of the outputs written by StreamingOutputWriter.
+
+    Arrays are loaded on first access; memory-mapped keys are never read into memory as a whole.
+    """
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        with open(os.path.join(output_dir, MANIFEST_FILENAME)) as fin:
+            self.manifest = json.load(fin)
+        self._loaded = {}
+
+    def __getitem__(self, key):
+        if key not in self._loaded:
+            entry = self.manifest['keys'][key]
+            if entry['format'] == 'memmap':
+                array = np.load(os.path.join(self.output_dir, entry['file']), mmap_mode='r')
+                self._loaded[key] = array[:entry['length']]
+            else:
+                self._loaded[key] = np.concatenate([
+                    np.load(os.path.join(self.output_dir, f), allow_pickle=True) for f in entry['files']
+                ])
+        return self._loaded[key]
+
+    def __iter__(self):
+        return iter(self.manifest['keys'])
+
+    def __len__(self):
+        return len(self.manifest['keys'])
+
+
+def load_streamed_outputs(output_dir):
+    return StreamedOutputs(output_dir)
@@ -0,0 +1,103 @@
+'''
+profiling.py
+
+Hot-path instrumentation for workers. StageProfiler records the wall time of named stages
+(data wait, host-to-device copy, forward, loss, backward, optimizer step, ...) in each batch,
+and summarizes them into percentiles at the end of an epoch. The summary is merged into the
+worker log so that it goes into epochs_summary.csv and Tensorboard.
+'''
+import os
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+import numpy as np
+import torch
+
+from .logging_config import logger
+from .util import ensure_dir
+
+
+class StageProfiler():
+    """ Record per-batch stage timings of a worker.
+
+    Args:
+        device (torch.device): device of the model; CUDA is synchronized around each stage
+            so that asynchronous kernels are accounted to the right stage.
+        enabled (bool): when False, all methods are no-ops.
+        synchronize (bool): synchronize CUDA before and after each stage.
+        percentiles (list): percentiles to be reported in the epoch summary.
+        trace_steps (list): batch indices to be traced by torch.profiler.
+        trace_epochs (list): epochs in which trace_steps are traced.
+        trace_dir (str): directory to save the chrome traces.
+    """
+    def __init__(self, device, enabled=False, synchronize=True, percentiles=(50, 90, 99),
+                 trace_steps=(), trace_epochs=(1,), trace_dir=None):
+        self.device = device
+        self.enabled = enabled
+        self.synchronize = synchronize and device.type == 'cuda'
+        self.percentiles = list(percentiles)
+        self.trace_steps = set(trace_steps)
+        self.trace_epochs = set(trace_epochs)
+        self.trace_dir = trace_dir
+        self._torch_profiler = None
+        self._trace_path = None
+        self.clear()
+
+    def clear(self):
+        self.records = defaultdict(list)
+
+    def _synchronize(self):
+        if self.synchronize:
+            torch.cuda.synchronize(self.device)
+
+    @contextmanager
+    def stage(self, name):
+        """ Context manager timing the enclosed code as stage `name` """
+        if not self.enabled:
+            yield
+            return
+        self._synchronize()
+        start = time.perf_counter()
+        yield
+        self._synchronize()
+        self.records[name].append(time.perf_counter() - start)
+
+    def record(self, name, seconds):
+        """ Record a duration measured outside of stage(), e.g. the data loading wait time """
+        if self.enabled:
+            self.records[name].append(seconds)
+
+    def step_begin(self, tag, epoch, batch_idx):
+        """ Start a torch.profiler trace if this batch is chosen to be traced """
+        if not self.enabled or self.trace_dir is None:
+            return
+        if epoch in self.trace_epochs and batch_idx in self.trace_steps:
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if self.device.type == 'cuda':
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+            self._torch_profiler = torch.profiler.profile(
+                activities=activities, record_shapes=True, profile_memory=True)
+            self._trace_path = os.path.join(self.trace_dir, f'{tag}_epoch{epoch}_batch{batch_idx}.json')
+            self._torch_profiler.start()
+
+    def step_end(self):
+        """ Stop the running torch.profiler trace (if any) and export it """
+        if self._torch_profiler is None:
+            return
+        self._torch_profiler.stop()
+        ensure_dir(self.trace_dir)
+        self._torch_profiler.export_chrome_trace(self._trace_path)
+        logger.info(f'Saving profiler trace {self._trace_path} ...')
+        self._torch_profiler = None
+
+    def summarize(self):
+        """ Return a dictionary of stage time percentiles (in milliseconds) of this epoch """
+        summary = {}
+        if not self.enabled:
+            return summary
+        for name, durations in self.records.items():
+            values = np.percentile(np.array(durations) * 1000, self.percentiles)
+            for q, value in zip(self.percentiles, values):
+                summary[f'time_{name}_p{q}_ms'] = value
+        return summary
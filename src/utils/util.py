@@ -6,13 +6,8 @@ import importlib.util
 import torch
 import numpy as np
 
-import io
-import cv2
-import base64
-import seaborn as sns
-from PIL import Image
-from torchvision.transforms import ToTensor
-from matplotlib import pyplot as plt
+# The drawing libraries (cv2, matplotlib, seaborn, PIL, torchvision) are imported by the functions using them,
+# as importing them takes seconds and most processes (e.g. data loader workers) never draw anything.
 
 
 lib_path = op.abspath(op.join(__file__, op.pardir, op.pardir, op.pardir, 'libs'))
@@ -99,7 +94,18 @@ def tensor_np_histogram(tensor):
     return np.histogram(tensor.cpu().numpy().flatten())
 
 
-def batch_visualize_xcos(img1s, img2s, grid_cos_maps, attention_maps):
+def batch_visualize_xcos(img1s, img2s, grid_cos_maps, attention_maps, renderer='matplotlib'):
+    """Plot the qualitative results of xCos for a batch.
+
+    Returns a list of tensors of shape (1, 3, H, W), one for each pair.
+    `renderer` is either 'matplotlib' (visualize_xcos) or 'fast' (batch_render_xcos_fast).
+    """
+    if renderer == 'fast':
+        canvases = batch_render_xcos_fast(img1s, img2s, grid_cos_maps, attention_maps)
+        canvases = torch.from_numpy(canvases).permute(0, 3, 1, 2).float().div(255)
+        return list(canvases.split(1))
+    elif renderer != 'matplotlib':
+        raise NotImplementedError(f'Renderer {renderer} not defined.')
     result_imgs = []
     for i in range(len(img1s)):
         result_imgs.append(visualize_xcos(img1s[i], img2s[i],
@@ -107,6 +113,130 @@ def batch_visualize_xcos(img1s, img2s, grid_cos_maps, attention_maps):
     return result_imgs
 
 
+def _colormap_lut(hex_colors, n=256):
+    """ Linearly interpolate anchor colors into a (n, 3) uint8 lookup table. """
+    colors = np.array([[int(c[i:i + 2], 16) for i in (1, 3, 5)] for c in hex_colors], dtype=np.float32)
+    positions = np.linspace(0, 1, len(colors))
+    x = np.linspace(0, 1, n)
+    return np.stack([np.interp(x, positions, colors[:, c]) for c in range(3)], axis=1).astype(np.uint8)
+
+
+# ColorBrewer anchors of the matplotlib colormaps used by visualize_xcos
+RDBU_LUT = _colormap_lut(['#67001f', '#b2182b', '#d6604d', '#f4a582', '#fddbc7', '#f7f7f7',
+                          '#d1e5f0', '#92c5de', '#4393c3', '#2166ac', '#053061'])
+YLGN_LUT = _colormap_lut(['#ffffe5', '#f7fcb9', '#d9f0a3', '#addd8e', '#78c679',
+                          '#41ab5d', '#238443', '#006837', '#004529'])
+
+
+def _centered_lut_index(values, vmin=-1., vmax=1., center=0.):
+    """ Map values to LUT indices the way seaborn does with `center`:
+    the colormap is centered at `center` and spans the larger side of [vmin, vmax]. """
+    vrange = max(vmax - center, center - vmin)
+    normed = (np.clip(values, vmin, vmax) - (center - vrange)) / (2 * vrange)
+    return (normed * 255).astype(np.int64)
+
+
+def _minmax_lut_index(values):
+    """ Map each map in a batch (B, h, w) to LUT indices by its own min/max like plt.imshow. """
+    vmin = values.min(axis=(1, 2), keepdims=True)
+    vmax = values.max(axis=(1, 2), keepdims=True)
+    normed = (values - vmin) / np.maximum(vmax - vmin, 1e-12)
+    return (normed * 255).astype(np.int64)
+
+
+def _upscale_maps(maps, size):
+    """ Nearest-neighbor upscale a batch of maps (B, h, w, ...) to (B, size, size, ...). """
+    rows = np.arange(size) * maps.shape[1] // size
+    cols = np.arange(size) * maps.shape[2] // size
+    return maps[:, rows][:, :, cols]
+
+
+def _draw_cell_borders(panels, n_cells, color=255):
+    """ Draw white borders between cells of upscaled maps, like the heatmap grid. """
+    size = panels.shape[1]
+    for pos in (np.arange(1, n_cells) * size) // n_cells:
+        panels[:, pos - 1:pos + 1] = color
+        panels[:, :, pos - 1:pos + 1] = color
+
+
+def batch_render_xcos_fast(img1s, img2s, grid_cos_maps, attention_maps, threshold=0.245):
+    """Render the qualitative result of xCos for a whole batch directly with numpy/cv2.
+
+    The layout follows visualize_xcos: two faces with grid lines, the grid cos map
+    (RdBu, centered at threshold) and the attention map (YlGn), each with a colour bar.
+
+    Arguments:
+        img1s [np.array] -- of shape (bs, c, h, w); value: [-1, 1]
+        img2s [np.array] -- of shape (bs, c, h, w)
+        grid_cos_maps [np.array]  -- of shape (bs, 7, 7)
+        attention_maps [np.array] -- of shape (bs, 7, 7)
+
+    Returns:
+        np.array -- uint8 canvases of shape (bs, H, W, 3)
+    """
+    import cv2
+    bs, _, size, _ = img1s.shape
+    margin, bar_width, label_width, title_height = 4, 8, 30, 16
+    font, font_scale = cv2.FONT_HERSHEY_SIMPLEX, 0.35
+    text_color = (0, 0, 0)
+
+    # Unnormalize images and CHW2HWC
+    faces = [np.transpose(((imgs * 0.5 + 0.5) * 255).clip(0, 255).astype('uint8'), (0, 2, 3, 1))
+             for imgs in (img1s, img2s)]
+    grid_cos_maps = grid_cos_maps.reshape(bs, -1, grid_cos_maps.shape[-1])
+    attention_maps = attention_maps.reshape(bs, -1, attention_maps.shape[-1])
+    n_cells = grid_cos_maps.shape[1]
+
+    # Panel positions
+    xs = [margin, 2 * margin + size, 3 * margin + 2 * size]
+    cos_bar_x = xs[2] + size + 2
+    xs.append(cos_bar_x + bar_width + label_width + margin)
+    att_bar_x = xs[3] + size + 2
+    height = margin + size + title_height
+    width = att_bar_x + bar_width + label_width
+
+    # Everything shared by all samples is drawn once on the template
+    template = np.full((height, width, 3), 255, dtype=np.uint8)
+    gradient = np.linspace(1, -1, size)
+    template[margin:margin + size, cos_bar_x:cos_bar_x + bar_width] = \
+        RDBU_LUT[_centered_lut_index(gradient, center=threshold)][:, None]
+    template[margin:margin + size, att_bar_x:att_bar_x + bar_width] = \
+        YLGN_LUT[np.linspace(255, 0, size).astype(np.int64)][:, None]
+    for x, title in zip(xs, ['Face 1', 'Face 2', 'cos_patch', 'weight_attention']):
+        cv2.putText(template, title, (x, height - 4), font, font_scale, text_color, 1, cv2.LINE_AA)
+    label_x = cos_bar_x + bar_width + 2
+    cv2.putText(template, '1.0', (label_x, margin + 8), font, font_scale, text_color, 1, cv2.LINE_AA)
+    cv2.putText(template, '-1.0', (label_x, margin + size), font, font_scale, text_color, 1, cv2.LINE_AA)
+
+    canvases = np.repeat(template[None], bs, axis=0)
+    rows = slice(margin, margin + size)
+
+    # Faces with grid lines (see drawGridLines)
+    grid_unit = size // n_cells
+    for x, face in zip(xs[:2], faces):
+        face = face.copy()
+        for pos in range(grid_unit, size, grid_unit):
+            face[:, :, pos] = (255, 0, 0)
+            face[:, pos, :] = (255, 0, 0)
+        canvases[:, rows, x:x + size] = face
+
+    # Colour-mapped grid cos maps and attention maps
+    cos_panels = RDBU_LUT[_upscale_maps(_centered_lut_index(grid_cos_maps, center=threshold), size)]
+    att_panels = YLGN_LUT[_upscale_maps(_minmax_lut_index(attention_maps), size)]
+    for x, panels in zip(xs[2:], (cos_panels, att_panels)):
+        _draw_cell_borders(panels, n_cells)
+        canvases[:, rows, x:x + size] = panels
+
+    # Attention colour bars are labelled with their own ranges
+    label_x = att_bar_x + bar_width + 2
+    for canvas, attention_map in zip(canvases, attention_maps):
+        cv2.putText(canvas, f'{attention_map.max():.2f}', (label_x, margin + 8),
+                    font, font_scale, text_color, 1, cv2.LINE_AA)
+        cv2.putText(canvas, f'{attention_map.min():.2f}', (label_x, margin + size),
+                    font, font_scale, text_color, 1, cv2.LINE_AA)
+    return canvases
+
+
 def visualize_xcos(image1, image2, grid_cos_map, attention_map,
                    name1=None, name2=None,
                    regressed_cos=None, is_same=None, threshold=0.245,
@@ -122,6 +252,13 @@ def visualize_xcos(image1, image2, grid_cos_map, attention_map,
     Returns:
         [type] -- [description]
     """
+    import io
+    import base64
+    import cv2
+    from PIL import Image
+    from matplotlib import pyplot as plt
+    from torchvision.transforms import ToTensor
+
     plt.gcf().clear()
     # name1, name2 = 'Left', 'Right'
     # isSame = int(isSame)
@@ -197,6 +334,8 @@ def drawGridLines(image_t, w_lines=5, h_lines=6,
     '''
     colorRGB: default: gray(128, 128, 128), you can use red(255, 0, 0)
     '''
+    import cv2
+
     colorRGB = (255, 0, 0)
     w_lines += 1
     h_lines += 1
@@ -242,6 +381,8 @@ def heatmap(data, row_labels, col_labels, ax=None,
     **kwargs
         All other arguments are forwarded to `imshow`.
     """
+    from matplotlib import pyplot as plt
+
     if cbar_kw is None:
         cbar_kw = {}
     if not ax:
@@ -304,6 +445,8 @@ def heatmap_seaborn(data, row_labels, col_labels, ax=None,
     **kwargs
         All other arguments are forwarded to `imshow`.
     """
+    import seaborn as sns
+    from matplotlib import pyplot as plt
 
     if not ax:
         exit('no ax')
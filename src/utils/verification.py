@@ -1,9 +1,8 @@
-import numpy as np
-from sklearn.model_selection import KFold
-import matplotlib.pyplot as plt
 import io
-from PIL import Image
-from torchvision import transforms
+
+import numpy as np
+
+# sklearn, matplotlib, PIL and torchvision are imported on first use, as importing them is slow
 
 
 def calculate_accuracy(threshold, dist, actual_issame, useCos=False):
@@ -28,6 +27,7 @@ def calculate_accuracy(threshold, dist, actual_issame, useCos=False):
 def calculate_roc_attention(thresholds,
                             xCoses,
                             actual_issame, nrof_folds=10, pca=0):
+    from sklearn.model_selection import KFold
 
     nrof_pairs = min(len(actual_issame), xCoses.shape[0])
     nrof_thresholds = len(thresholds)
@@ -76,10 +76,12 @@ def calculate_roc_attention(thresholds,
     return tpr, fpr, accuracy, best_thresholds
 
 
-def evaluate_accuracy(xCoses, actual_issame, nrof_folds=10, pca=0):
+def evaluate_accuracy(xCoses, actual_issame, nrof_folds=10, pca=0, plot_roc=False, roc_renderer='fast'):
     '''
     xCoses: np.array (# of pairs,)
     actual_issame: list (# of pairs,)
+    Returns the accuracy and best threshold of each fold, and the ROC curve as a dict of fpr/tpr arrays
+    (averaged over the folds) with its image tensor under 'image' if plot_roc (see get_roc_curve).
     '''
     # Calculate evaluation metrics
     thresholds = np.arange(-1.0, 1.0, 0.005)
@@ -91,24 +93,67 @@ def evaluate_accuracy(xCoses, actual_issame, nrof_folds=10, pca=0):
 #                                       np.asarray(actual_issame), 1e-3, nrof_folds=nrof_folds)
 #     return tpr, fpr, accuracy, best_thresholds, val, val_std, far
 
-    roc_curve_tensor = get_roc_curve(fpr, tpr)
-    return accuracy, best_thresholds, roc_curve_tensor
+    roc = {'fpr': fpr, 'tpr': tpr}
+    if plot_roc:
+        roc['image'] = get_roc_curve(fpr, tpr, renderer=roc_renderer)
+    return accuracy, best_thresholds, roc
+
+
+def get_roc_curve(fpr, tpr, renderer='fast'):
+    """ Image tensor (3, H, W) of the ROC curve, rendered by render_roc_curve ('fast') or matplotlib """
+    import torch
 
+    if renderer == 'fast':
+        return torch.from_numpy(render_roc_curve(fpr, tpr)).permute(2, 0, 1).float().div(255)
+    elif renderer != 'matplotlib':
+        raise NotImplementedError(f'Renderer {renderer} not defined.')
+    from PIL import Image
+    from torchvision import transforms
 
-def get_roc_curve(fpr, tpr):
     buf = gen_plot(fpr, tpr)
     roc_curve = Image.open(buf)
     roc_curve_tensor = transforms.ToTensor()(roc_curve)
     return roc_curve_tensor
 
 
+def render_roc_curve(fpr, tpr, height=480, width=640):
+    """ Draw the ROC curve with cv2 directly into a uint8 RGB array (height, width, 3) """
+    import cv2
+
+    canvas = np.full((height, width, 3), 255, dtype=np.uint8)
+    font, font_scale, color = cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0)
+    left, right, top, bottom = 60, 20, 40, 50
+    plot_width, plot_height = width - left - right, height - top - bottom
+
+    def to_pixels(x, y):
+        return np.stack([left + np.asarray(x) * plot_width, top + (1 - np.asarray(y)) * plot_height],
+                        axis=-1).round().astype(np.int32)
+
+    # Axes with ticks, and the chance diagonal
+    cv2.rectangle(canvas, (left, top), (left + plot_width, top + plot_height), color, 1)
+    for tick in np.linspace(0, 1, 6):
+        x, y = to_pixels(tick, 0)
+        cv2.putText(canvas, f'{tick:.1f}', (x - 12, y + 18), font, 0.4, color, 1, cv2.LINE_AA)
+        x, y = to_pixels(0, tick)
+        cv2.putText(canvas, f'{tick:.1f}', (x - 30, y + 4), font, 0.4, color, 1, cv2.LINE_AA)
+    cv2.line(canvas, tuple(to_pixels(0, 0).tolist()), tuple(to_pixels(1, 1).tolist()), (200, 200, 200), 1)
+    cv2.polylines(canvas, [to_pixels(fpr, tpr)], False, (31, 119, 180), 2, cv2.LINE_AA)
+
+    cv2.putText(canvas, 'ROC Curve', (left + plot_width // 2 - 45, top - 14), font, 0.6, color, 1, cv2.LINE_AA)
+    cv2.putText(canvas, 'FPR', (left + plot_width // 2 - 15, height - 12), font, font_scale, color, 1, cv2.LINE_AA)
+    cv2.putText(canvas, 'TPR', (8, top + plot_height // 2), font, font_scale, color, 1, cv2.LINE_AA)
+    return canvas
+
+
 def gen_plot(fpr, tpr):
     """Create a pyplot plot and save to buffer."""
+    import matplotlib.pyplot as plt
+
     plt.figure()
     plt.xlabel("FPR", fontsize=14)
     plt.ylabel("TPR", fontsize=14)
     plt.title("ROC Curve", fontsize=14)
-    # plot = plt.plot(fpr, tpr, linewidth=2)
+    plt.plot(fpr, tpr, linewidth=2)
     buf = io.BytesIO()
     plt.savefig(buf, format='jpeg')
     buf.seek(0)
@@ -116,6 +161,60 @@ def gen_plot(fpr, tpr):
     return buf
 
 
+def score_histograms(scores, actual_issame, folds, nrof_folds, nrof_bins):
+    """ Count scores into histograms of shape (nrof_folds, 2, nrof_bins): fold x (different, same) x bin,
+    where the bins evenly split [-1, 1] (scores out of it are counted in the first/last bin) """
+    bins = np.clip(((scores + 1) / 2 * nrof_bins).astype(np.int64), 0, nrof_bins - 1)
+    codes = (folds * 2 + actual_issame.astype(np.int64)) * nrof_bins + bins
+    return np.bincount(codes, minlength=nrof_folds * 2 * nrof_bins).reshape(nrof_folds, 2, nrof_bins)
+
+
+def _counts_above(histograms):
+    """ Number of scores in or above each bin, and 0 for the last edge: shape (..., nrof_bins + 1) """
+    above = np.cumsum(histograms[..., ::-1], axis=-1)[..., ::-1]
+    return np.concatenate([above, np.zeros(above.shape[:-1] + (1,), dtype=above.dtype)], axis=-1)
+
+
+def evaluate_histograms(histograms, far_targets=(1e-3,)):
+    '''
+    The verification results of score_histograms, with the bin edges as thresholds (a pair is predicted
+    the same if its score is above the threshold, at the resolution of the bins).
+    Like calculate_roc_attention, the best threshold of each fold is searched on the other folds.
+    Returns a dict of accuracy (mean of the folds), threshold (mean of the best thresholds of the folds),
+    auc, tar@far=<far> for each of far_targets, and the tpr/fpr of the thresholds (the ROC curve).
+    '''
+    nrof_folds, _, nrof_bins = histograms.shape
+    thresholds = np.linspace(-1, 1, nrof_bins + 1)
+    # Counts of each fold at each threshold
+    false_positives = _counts_above(histograms[:, 0])
+    true_positives = _counts_above(histograms[:, 1])
+    true_negatives = histograms[:, 0].sum(-1, keepdims=True) - false_positives
+    corrects = true_positives + true_negatives
+    nrof_pairs = histograms.sum(axis=(1, 2))
+
+    accuracy = np.zeros(nrof_folds)
+    best_thresholds = np.zeros(nrof_folds)
+    for fold_idx in range(nrof_folds):
+        train_corrects = corrects.sum(0) - corrects[fold_idx]
+        best_threshold_index = np.argmax(train_corrects)
+        best_thresholds[fold_idx] = thresholds[best_threshold_index]
+        accuracy[fold_idx] = corrects[fold_idx, best_threshold_index] / max(nrof_pairs[fold_idx], 1)
+
+    # ROC curve over all the folds, from (1, 1) at the lowest threshold to (0, 0) at the highest
+    tpr = true_positives.sum(0) / max(histograms[:, 1].sum(), 1)
+    fpr = false_positives.sum(0) / max(histograms[:, 0].sum(), 1)
+    results = {
+        'accuracy': float(accuracy.mean()),
+        'threshold': float(best_thresholds.mean()),
+        'auc': float(np.sum((fpr[:-1] - fpr[1:]) * (tpr[:-1] + tpr[1:]) / 2)),
+    }
+    for far in far_targets:
+        # The lowest threshold whose false accept rate is at most far
+        results[f'tar@far={far:g}'] = float(tpr[np.argmax(fpr <= far)])
+    results['tpr'], results['fpr'] = tpr, fpr
+    return results
+
+
 def getTFNPString(same, isSame_pred):
     title_str = 'LL'
     if same == 1 and int(isSame_pred) == 0:
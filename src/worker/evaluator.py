@@ -26,6 +26,7 @@ class Evaluator(WorkerTemplate):
             setattr(self, attr_name, getattr(pipeline, attr_name))
         self.gt_data_loader = gt_data_loader
         self.result_data_loader = result_data_loader
+        self._setup_profiler(pipeline)
 
     @property
     def enable_grad(self):
@@ -50,7 +51,7 @@ class Evaluator(WorkerTemplate):
 
     def _finalize_output(self, output):
         epoch_start_time = output
-        avg_metrics = {metric.nickname: metric.finalize() for metric in self.evaluation_metrics}
+        avg_metrics = self._finalize_metrics()
         log = {
             'elapsed_time (s)': time.time() - epoch_start_time,
         }
@@ -74,7 +75,9 @@ class Evaluator(WorkerTemplate):
 
     def _iter_data(self, epoch):
         output = self._init_output()
-        for batch_idx, (gt, result) in enumerate(zip(self.gt_data_loader, self.result_data_loader)):
+        gt_data_loader = self._prefetch(self.gt_data_loader)
+        result_data_loader = self._prefetch(self.result_data_loader)
+        for batch_idx, (gt, result) in enumerate(zip(gt_data_loader, result_data_loader)):
             batch_start_time = time.time()
             gt = self._data_to_device(gt)
             result = self._data_to_device(result)
@@ -1,13 +1,14 @@
 import os
 import time
 import torch
-from torchvision.utils import save_image
 from .worker_template import WorkerTemplate
 from data_loader.base_data_loader import BaseDataLoader
 from pipeline.base_pipeline import BasePipeline
 from utils.global_config import global_config
 from utils.logging_config import logger
 from utils.verification import checkTFPN
+from utils.output_writer import StreamingOutputWriter
+from utils.async_visualizer import AsyncXCosVisualizer
 
 
 class Tester(WorkerTemplate):
@@ -27,7 +28,7 @@ class Tester(WorkerTemplate):
         return False
 
     def _run_and_optimize_model(self, data):
-        with torch.no_grad():
+        with torch.no_grad(), self.profiler.stage('forward'):
             model_output = self.model(data, scenario='get_feature_and_xcos')
         return model_output, None
 
@@ -41,6 +42,20 @@ class Tester(WorkerTemplate):
         """ Initialize a dictioary structure to save inferenced results. """
         for metric in self.evaluation_metrics:
             metric.clear()
+        self.output_writer = None
+        if global_config.get('stream_outputs', False):
+            output_dir = os.path.join(self.saving_dir, f'{self.data_loader.name}_output')
+            self.output_writer = StreamingOutputWriter(output_dir, self.data_loader.n_samples)
+        self.visualizer = None
+        if global_config.arch.type == "xCosModel" and global_config.arch.args.get('draw_qualitative_result', False):
+            visualization_config = global_config['visualization']
+            self.visualizer = AsyncXCosVisualizer(
+                num_workers=visualization_config.get('async_workers', 2),
+                max_queue_size=visualization_config.get('async_queue_size', 8),
+                drop_policy=visualization_config.get('async_drop_policy', 'block'),
+                sample_rate=visualization_config.get('async_sample_rate', 1.0),
+                renderer=visualization_config.get('xcos_renderer', 'matplotlib'),
+            )
         return {
             'epoch_start_time': time.time(),
             'saved': {k: [] for k in global_config.saved_keys}
@@ -55,10 +70,15 @@ class Tester(WorkerTemplate):
                 if key not in global_config.saved_keys:
                     continue
                 value = dictionary[key]
+                if self.output_writer is not None:
+                    self.output_writer.write(key, value, batch_size)
+                    continue
                 saved_value = value.cpu().numpy() if torch.is_tensor(value) else value
                 epoch_output['saved'][key].extend([v for v in saved_value])
 
         data, model_output = products['data'], products['model_output']
+        # Only the streaming writer needs the batch size (and batches with a tensor)
+        batch_size = self._get_batch_size(data) if self.output_writer is not None else None
         if global_config.save_while_infer:
             # Clean previous results
             epoch_output['saved'] = {k: [] for k in global_config.saved_keys}
@@ -66,43 +86,57 @@ class Tester(WorkerTemplate):
         for d in [data, model_output]:
             update_epoch_output_from_dict(d)
 
-        if global_config.save_while_infer and global_config.arch.type == "xCosModel":
-            if global_config.arch.args.draw_qualitative_result:
-                # Save results
-                name = self.data_loader.name
-                # print(epoch_output.keys())
-                # print(epoch_output['saved'].keys())
-                # print(products.keys())
-                # ['flatten_feats', 'grid_feats', 'x_coses', 'attention_maps', 'grid_cos_maps', 'xcos_visualizations']
-                # print(len(products['model_output']['xcos_visualizations']))
-                # print(products['model_output']['xcos_visualizations'][0].shape)
-                # print(epoch_output['saved'].keys())
-
-                for i in range(len(epoch_output['saved']['xcos_visualizations'])):
-                    index = epoch_output['saved']['index'][i]
-                    visualization = epoch_output['saved']['xcos_visualizations'][i]
-                    xcos = epoch_output['saved']['x_coses'][i]
-                    is_same_label = epoch_output['saved']['is_same_labels'][i]
-                    TFPN = checkTFPN(xcos, is_same_label)
-                    output_path = os.path.join(self.saving_dir, f'{name}_{TFPN}_xcos_{xcos:.4f}_pair_{index:06d}.png')
-                    save_image(visualization, output_path)
-                    # output = {}
-                    # for saved_key in epoch_output['saved'].keys():
-                    #     output[saved_key] = epoch_output['saved'][saved_key][i]
-                    # output_path = os.path.join(self.saving_dir, f'{name}_index{index:06d}.npz')
-                    # np.savez(output_path, **output)
-                    if index % 1000 == 0:
-                        logger.info(f'Saving output {output_path} ...')
+        if global_config.save_while_infer and self.visualizer is not None:
+            self._submit_visualizations(data, model_output)
 
         return epoch_output
 
     def _finalize_output(self, epoch_output):
         """ Return saved inference results along with log messages """
+        if self.visualizer is not None:
+            self.visualizer.close()
+        if self.output_writer is not None:
+            manifest_path = self.output_writer.close()
+            logger.info(f'Streamed outputs saved with manifest {manifest_path}')
         log = {'elasped_time (s)': time.time() - epoch_output['epoch_start_time']}
-        avg_metrics = {metric.nickname: metric.finalize() for metric in self.evaluation_metrics}
+        avg_metrics = self._finalize_metrics()
         for key, value in avg_metrics.items():
             log[f"avg_{key}"] = value
         return {'saved': epoch_output['saved'], 'log': log}
 
+    def _submit_visualizations(self, data, model_output):
+        """ Send images, grid cos maps and attention maps of this batch to the visualizer """
+        name = self.data_loader.name
+        img1s, img2s = [img.cpu().numpy() for img in data['data_input']]
+        grid_cos_maps = model_output['grid_cos_maps'].squeeze(-1).detach().cpu().numpy()
+        attention_maps = model_output['attention_maps'].squeeze(-1).detach().cpu().numpy()
+        x_coses = model_output['x_coses'].cpu().numpy()
+        is_same_labels = data['is_same_labels'].cpu().numpy()
+        indices = data['index'].cpu().numpy()
+        if 'xcos_computed' in model_output:
+            # With cascade scoring, only the pairs scored by xCos have explanations to draw
+            computed = model_output['xcos_computed'].cpu().numpy()
+            img1s, img2s = img1s[computed], img2s[computed]
+            grid_cos_maps, attention_maps = grid_cos_maps[computed], attention_maps[computed]
+            x_coses, is_same_labels, indices = x_coses[computed], is_same_labels[computed], indices[computed]
+
+        output_paths = []
+        for xcos, is_same_label, index in zip(x_coses, is_same_labels, indices):
+            TFPN = checkTFPN(xcos, is_same_label)
+            output_path = os.path.join(self.saving_dir, f'{name}_{TFPN}_xcos_{xcos:.4f}_pair_{index:06d}.png')
+            output_paths.append(output_path)
+            if index % 1000 == 0:
+                logger.info(f'Saving output {output_path} ...')
+        self.visualizer.submit(img1s, img2s, grid_cos_maps, attention_maps, output_paths)
+
+    def _get_batch_size(self, data):
+        """ Get the batch size from the first tensor in the data dictionary """
+        for value in data.values():
+            if torch.is_tensor(value) and value.dim() > 0:
+                return value.size(0)
+            if isinstance(value, (list, tuple)) and len(value) > 0 and torch.is_tensor(value[0]):
+                return value[0].size(0)
+        raise ValueError('Can not infer the batch size from data')
+
     def _print_log(self, epoch, batch_idx, batch_start_time, loss):
         logger.info(f"Batch {batch_idx}, saving output ..")
@@ -3,6 +3,7 @@ import time
 import numpy as np
 
 from .training_worker import TrainingWorker
+from utils.checkpoint import get_rng_states, set_rng_states
 from utils.logging_config import logger
 from utils.util import get_lr
 from utils.global_config import global_config
@@ -19,12 +20,21 @@ class Trainer(TrainingWorker):
     def __init__(self, pipeline: BasePipeline, *args):
         super().__init__(pipeline, *args)
         # Some shared attributes are trainer exclusive and therefore is initialized here
-        shared_attrs = ['optimizers', 'loss_functions']
+        shared_attrs = ['optimizers', 'loss_functions', 'mask_augmentation']
         shared_attrs += ['gan_loss_functions'] if self.optimize_strategy == 'GAN' else []
+        shared_attrs += ['teacher'] if self.optimize_strategy == 'distillation' else []
         for attr_name in shared_attrs:
             setattr(self, attr_name, getattr(pipeline, attr_name))
         self.evaluation_metrics = self._filter_evaluation_metrics(self.evaluation_metrics, scenario='training')
 
+        # Mid-epoch checkpoints every `save_iteration_freq` batches (None: only at the end of epochs)
+        self.save_iteration_freq = global_config['trainer'].get('save_iteration_freq', None)
+        self.save_iteration_checkpoint = pipeline._save_iteration_checkpoint
+        # State of the interrupted epoch when resumed from a mid-epoch checkpoint
+        self.resumed_iteration_state = pipeline.resumed_iteration_state
+        # Number of samples of the epoch used so far
+        self.num_consumed = 0
+
     @property
     def enable_grad(self):
         return True
@@ -41,38 +51,109 @@ class Trainer(TrainingWorker):
             f'BT: {batch_time:.2f}s'
         )
 
+    def _init_output(self):
+        epoch_start_time, total_loss = super()._init_output()
+        self.num_consumed = 0
+        if self.resumed_iteration_state is not None:
+            state, self.resumed_iteration_state = self.resumed_iteration_state, None
+            # Restored after _setup_model() reseeds numpy and before the data loader iterator is created
+            set_rng_states(state['rng_states'])
+            total_loss = state['total_loss']
+            # The sampler skips exactly num_consumed samples; the batch index (rounded down if the batch size
+            # has changed) is only used for logging and the checkpoint frequency
+            self.num_consumed = state['num_consumed']
+            self.start_batch_idx = self.num_consumed // self.data_loader.batch_size
+            logger.info(f'Resuming the interrupted epoch at batch {self.start_batch_idx}')
+        return epoch_start_time, total_loss
+
+    def _after_iteration(self, epoch, batch_idx, output):
+        # Every batch but the last one of the epoch is full
+        n_samples = len(self.data_loader.sampler)
+        self.num_consumed = min(self.num_consumed + self.data_loader.batch_size, n_samples)
+        if self.save_iteration_freq is None or (batch_idx + 1) % self.save_iteration_freq != 0:
+            return
+        if self.num_consumed >= n_samples:
+            # The epoch checkpoint follows
+            return
+        _, total_loss = output
+        iteration_state = {
+            'batch_idx': batch_idx,
+            'num_consumed': self.num_consumed,
+            'rng_states': get_rng_states(),
+            'total_loss': total_loss,
+        }
+        self.save_iteration_checkpoint(epoch, iteration_state)
+
+    def _augment_data(self, data):
+        if self.mask_augmentation is None:
+            return data
+        with self.profiler.stage('augmentation'):
+            return self.mask_augmentation(data)
+
     def _run_and_optimize_model(self, data):
         if self.optimize_strategy == 'normal':
             self.optimizers['default'].zero_grad()
-            model_output = self.model(data)
-            _, total_loss = self._get_and_write_losses(data, model_output)
+            with self.profiler.stage('forward'):
+                model_output = self.model(data)
+            with self.profiler.stage('loss'):
+                _, total_loss = self._get_and_write_losses(data, model_output)
 
-            total_loss.backward()
-            self.optimizers['default'].step()
+            with self.profiler.stage('backward'):
+                total_loss.backward()
+            with self.profiler.stage('optimizer_step'):
+                self.optimizers['default'].step()
 
         elif self.optimize_strategy == 'multitasking':
             for optimizer_name in self.optimizers.keys():
                 self.optimizers[optimizer_name].zero_grad()
 
-            model_output = self.model(data, 'normal')
-            _, total_loss = self._get_and_write_losses(data, model_output)
+            with self.profiler.stage('forward'):
+                model_output = self.model(data, 'normal')
+            with self.profiler.stage('loss'):
+                _, total_loss = self._get_and_write_losses(data, model_output)
 
-            total_loss.backward()
+            with self.profiler.stage('backward'):
+                total_loss.backward()
 
-            for optimizer_name in self.optimizers.keys():
-                self.optimizers[optimizer_name].step()
+            with self.profiler.stage('optimizer_step'):
+                for optimizer_name in self.optimizers.keys():
+                    self.optimizers[optimizer_name].step()
 
         elif self.optimize_strategy == 'GAN':
             total_loss = 0
             for optimizer_name in self.optimizers.keys():
                 self.optimizers[optimizer_name].zero_grad()
                 forward_scenario = global_config['optimizers'][optimizer_name]['forward_scenario']
-                model_output = self.model(data, forward_scenario)
-                loss = self._get_and_write_gan_loss(data, model_output, optimizer_name)
-                loss.backward()
+                with self.profiler.stage('forward'):
+                    model_output = self.model(data, forward_scenario)
+                with self.profiler.stage('loss'):
+                    loss = self._get_and_write_gan_loss(data, model_output, optimizer_name)
+                with self.profiler.stage('backward'):
+                    loss.backward()
                 total_loss += loss
 
-                self.optimizers[optimizer_name].step()
+                with self.profiler.stage('optimizer_step'):
+                    self.optimizers[optimizer_name].step()
+
+        elif self.optimize_strategy == 'distillation':
+            for optimizer_name in self.optimizers.keys():
+                self.optimizers[optimizer_name].zero_grad()
+
+            # Targets of the distillation losses, e.g. data['teacher_x_coses']
+            with self.profiler.stage('teacher'):
+                data.update(self.teacher(data))
+            forward_scenario = global_config['distillation'].get('student_scenario', 'get_feature_and_xcos')
+            with self.profiler.stage('forward'):
+                model_output = self.model(data, forward_scenario)
+            with self.profiler.stage('loss'):
+                _, total_loss = self._get_and_write_losses(data, model_output)
+
+            with self.profiler.stage('backward'):
+                total_loss.backward()
+
+            with self.profiler.stage('optimizer_step'):
+                for optimizer_name in self.optimizers.keys():
+                    self.optimizers[optimizer_name].step()
 
         return model_output, total_loss
 
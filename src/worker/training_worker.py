@@ -29,7 +29,7 @@ class TrainingWorker(WorkerTemplate):
     def _average_stats(self, total_loss):
         """ Calculate the average loss/metrics in this epoch """
         avg_loss = total_loss / len(self.data_loader)
-        avg_metrics = {metric.nickname: metric.finalize() for metric in self.evaluation_metrics}
+        avg_metrics = self._finalize_metrics()
         return avg_loss, avg_metrics
 
     def _finalize_output(self, output):
@@ -27,13 +27,18 @@ class Validator(TrainingWorker):
     def _run_and_optimize_model(self, data):
         if self.validation_strategy == self.optimize_strategy:
             if self.optimize_strategy == 'normal':
-                model_output = self.model(data)
-                losses, total_loss = self._get_and_write_losses(data, model_output)
+                with self.profiler.stage('forward'):
+                    model_output = self.model(data)
+                with self.profiler.stage('loss'):
+                    losses, total_loss = self._get_and_write_losses(data, model_output)
             elif self.optimize_strategy == 'GAN':
-                model_output = self.model(data, scenario='generator_only')
-                losses, total_loss = self._get_and_write_losses(data, model_output)
+                with self.profiler.stage('forward'):
+                    model_output = self.model(data, scenario='generator_only')
+                with self.profiler.stage('loss'):
+                    losses, total_loss = self._get_and_write_losses(data, model_output)
         elif self.validation_strategy == "bypass_loss_calculation":
-            model_output = self.model(data, scenario='get_feature_and_xcos')
+            with self.profiler.stage('forward'):
+                model_output = self.model(data, scenario='get_feature_and_xcos')
             total_loss = torch.zeros([1])
         return model_output, total_loss
 
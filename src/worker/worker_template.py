@@ -1,3 +1,4 @@
+import os
 import time
 from abc import ABC, abstractmethod
 
@@ -5,9 +6,11 @@ import torch
 from torchvision.utils import make_grid
 
 from data_loader.base_data_loader import BaseDataLoader
+from data_loader.prefetcher import DevicePrefetcher, move_to_device
 from pipeline.base_pipeline import BasePipeline
 from utils.global_config import global_config
 from utils.util import batch_visualize_xcos
+from utils.profiling import StageProfiler
 
 
 class WorkerTemplate(ABC):
@@ -25,6 +28,9 @@ class WorkerTemplate(ABC):
 
         self.data_loader = data_loader
         self.step = step  # Tensorboard log step
+        # Index of the first batch of the next epoch; > 0 when an interrupted epoch is resumed
+        self.start_batch_idx = 0
+        self._setup_profiler(pipeline)
 
     # ============ Implement the following functions ==============
     @property
@@ -62,13 +68,31 @@ class WorkerTemplate(ABC):
         pass
 
     # ============ Implement the above functions ==============
+    def _setup_profiler(self, pipeline: BasePipeline):
+        """ Setup the stage profiler according to the 'profiling' configuration """
+        profiling_config = dict(global_config.get('profiling', {}))
+        saving_dir = getattr(pipeline, 'saving_dir', None)
+        if profiling_config.get('trace_dir') is None and saving_dir is not None:
+            profiling_config['trace_dir'] = os.path.join(saving_dir, 'traces')
+        self.profiler = StageProfiler(self.device, **profiling_config)
+
     def _update_all_metrics(self, data_input, model_output, write=True):
+        with self.profiler.stage('metric_update'):
+            for metric in self.evaluation_metrics:
+                with torch.no_grad():
+                    value = metric.update(data_input, model_output)
+                    # some metrics do not have per-batch evaluation (e.g. FID), then value would be None
+                    if write and value is not None:
+                        self.writer.add_scalar(metric.nickname, value)
+
+    def _finalize_metrics(self):
+        """ Finalize the evaluation metrics and write their images (e.g. ROC curves) to Tensorboard """
+        avg_metrics = {}
         for metric in self.evaluation_metrics:
-            with torch.no_grad():
-                value = metric.update(data_input, model_output)
-                # some metrics do not have per-batch evaluation (e.g. FID), then value would be None
-                if write and value is not None:
-                    self.writer.add_scalar(metric.nickname, value)
+            avg_metrics[metric.nickname] = metric.finalize()
+            for tag, image in metric.images().items():
+                self.writer.add_image(tag, image)
+        return avg_metrics
 
     # Generally, the following function should not be changed.
     def _write_data_to_tensorboard(self, data, model_output):
@@ -80,11 +104,12 @@ class WorkerTemplate(ABC):
             img1s, img2s = data['data_input']
             img1s = img1s.cpu().numpy()
             img2s = img2s.cpu().numpy()
-            grid_cos_maps = model_output['grid_cos_maps'].squeeze().detach().cpu().numpy()
-            attention_maps = model_output['attention_maps'].squeeze().detach().cpu().numpy()
-            visualizations = batch_visualize_xcos(img1s, img2s, grid_cos_maps, attention_maps)
-            if len(visualizations) > 10:
-                visualizations = visualizations[:10]
+            # Only the first 10 pairs are shown
+            img1s, img2s = img1s[:10], img2s[:10]
+            grid_cos_maps = model_output['grid_cos_maps'][:10].squeeze(-1).detach().cpu().numpy()
+            attention_maps = model_output['attention_maps'][:10].squeeze(-1).detach().cpu().numpy()
+            renderer = global_config['visualization'].get('xcos_renderer', 'matplotlib')
+            visualizations = batch_visualize_xcos(img1s, img2s, grid_cos_maps, attention_maps, renderer=renderer)
             self.writer.add_image("xcos_visualization", make_grid(torch.cat(visualizations), nrow=1))
 
         if self.optimize_strategy == 'GAN':
@@ -116,16 +141,27 @@ class WorkerTemplate(ABC):
         return losses, total_loss
 
     def _data_to_device(self, data):
-        """ Put data into CPU/GPU """
-        for key in data.keys():
-            # Dataloader yeilds something that's not tensor, e.g data['video_id']
-            if torch.is_tensor(data[key]):
-                data[key] = data[key].to(self.device)
-            elif isinstance(data[key], list):
-                for i, elem in enumerate(data[key]):
-                    data[key][i] = elem.to(self.device)
+        """ Put data into CPU/GPU
+        Nested lists/tuples (e.g. the image pairs in data['data_input']) are handled and non-tensor
+        items (e.g data['video_id']) are kept as they are. Tensors already on the device (moved by
+        DevicePrefetcher) are not copied again.
+        """
+        return move_to_device(data, self.device, non_blocking=True)
+
+    def _augment_data(self, data):
+        """ Batched augmentation on the device; only the Trainer augments data """
         return data
 
+    def _after_iteration(self, epoch, batch_idx, output):
+        """ Called after each batch, e.g. for the Trainer to save mid-epoch checkpoints """
+        pass
+
+    def _prefetch(self, data_loader):
+        """ Wrap the data loader with DevicePrefetcher if 'device_prefetch' is enabled """
+        if global_config.get('device_prefetch', False):
+            return DevicePrefetcher(data_loader, self.device)
+        return data_loader
+
     def _iter_data(self, epoch):
         """
         Iterate through the dataset and do inference.
@@ -133,10 +169,17 @@ class WorkerTemplate(ABC):
         `self._output_init` and `self._output_update`.
         """
         output = self._init_output()
-        for batch_idx, data in enumerate(self.data_loader):
+        self.profiler.clear()
+        data_wait_start_time = time.time()
+        start_batch_idx, self.start_batch_idx = self.start_batch_idx, 0
+        for batch_idx, data in enumerate(self._prefetch(self.data_loader), start_batch_idx):
             batch_start_time = time.time()
+            self.profiler.record('data_wait', batch_start_time - data_wait_start_time)
+            self.profiler.step_begin(self.data_loader.name, epoch, batch_idx)
             self._setup_writer()
-            data = self._data_to_device(data)
+            with self.profiler.stage('to_device'):
+                data = self._data_to_device(data)
+            data = self._augment_data(data)
             data['batch_idx'] = batch_idx
             model_output, loss = self._run_and_optimize_model(data)
 
@@ -147,11 +190,15 @@ class WorkerTemplate(ABC):
             }
 
             if batch_idx % global_config.log_step == 0:
-                self._write_data_to_tensorboard(data, model_output)
+                with self.profiler.stage('tensorboard'):
+                    self._write_data_to_tensorboard(data, model_output)
                 if global_config.verbosity >= 2:
                     self._print_log(epoch, batch_idx, batch_start_time, loss)
 
             output = self._update_output(output, products)
+            self._after_iteration(epoch, batch_idx, output)
+            self.profiler.step_end()
+            data_wait_start_time = time.time()
         return output
 
     def run(self, epoch):
@@ -159,4 +206,5 @@ class WorkerTemplate(ABC):
         with torch.set_grad_enabled(self.enable_grad):
             epoch_output = self._iter_data(epoch)
         output = self._finalize_output(epoch_output)
+        output['log'].update(self.profiler.summarize())
         return output